@@ -1,24 +1,65 @@
-import logging as logger
+import logging
+from time import time as now
 
 import discord
 from discord import app_commands
 from discord.ext import commands
+from humanfriendly import format_timespan
 
-#from utils.timeconverter import TimeConverter
-#from humanfriendly import format_timespan
+from utils.cases import cases
+from utils.deadlines import DeadlineScheduler
+from utils.tempbans import tempbans
+from utils.timeconverter import TimeConverter
+from utils.workqueue import CoalescingQueue
+
+logger = logging.getLogger(__name__)
 
 class Ban(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.scheduler = DeadlineScheduler(self.unban_due, name="tempbans")
+        # Overdue unbans after a restart drain through here at a steady pace
+        self.unbans = CoalescingQueue(
+            self.expire,
+            workers=2,
+            interval=0.5,
+            name="tempban-unbans",
+        )
+
+    async def cog_load(self):
+        for key, until in tempbans.pending.items():
+            self.scheduler.schedule(key, until)
+        self.scheduler.start()
+
+    async def cog_unload(self):
+        await self.scheduler.stop()
+        await self.unbans.stop()
+
+    async def unban_due(self, key):
+        self.unbans.push(key)
+
+    async def expire(self, key, _):
+        guild_id, user_id = key
+        guild = self.bot.get_guild(guild_id)
+        if guild is not None:
+            try:
+                await guild.unban(discord.Object(user_id), reason="Temporary ban expired")  # noqa: E501
+            except discord.NotFound:
+                pass
+            except discord.Forbidden:
+                logger.warning(f"No permission to lift temp ban of {user_id} in {guild_id}")  # noqa: E501
+            else:
+                await cases.record(guild_id, "unban", user_id, self.bot.user.id, "Temporary ban expired")  # noqa: E501
+        tempbans.done(guild_id, user_id)
 
     @app_commands.command(name="ban", description="Ban a user")
     @app_commands.describe(
         reason="Reason for ban",
         member="User to ban",
+        time="Time to ban for (1m, 5d, 6h etc..)",
     )
-    # time: app_commands.Transform[str, TimeConverter]=None
     @app_commands.default_permissions(ban_members=True)
-    async def ban(self,interaction: discord.Interaction, member: discord.Member, reason: str):  # noqa: E501
+    async def ban(self,interaction: discord.Interaction, member: discord.Member, reason: str, time: app_commands.Transform[str, TimeConverter]=None):  # noqa: E501
 
         '''
         Ban command
@@ -26,6 +67,14 @@ class Ban(commands.Cog):
         Bans user and let him know why
         '''
 
+        # TimeConverter gives 0 for text it can't parse, that must not
+        # turn into a permanent ban
+        if time is not None and not time:
+            return await interaction.response.send_message(
+                "Invalid time, use something like 1h or 2d.",
+                ephemeral=True,
+            )
+
         if member == interaction.user or member == interaction.guild.owner:
             return await interaction.response.send_message(
                 "You can't ban this user",
@@ -44,10 +93,11 @@ class Ban(commands.Cog):
                 ephemeral=True,
             )
 
+        duration = f" for {format_timespan(time)}" if time else ""
         try:
             await member.send(
                 embed=discord.Embed(
-                    description=f"You have been banned from {interaction.guild.name} \n**Reason**: {reason}",  # noqa: E501
+                    description=f"You have been banned from {interaction.guild.name}{duration} \n**Reason**: {reason}",  # noqa: E501
                     color=discord.Color.blurple(),
                 ),
             )
@@ -59,13 +109,28 @@ class Ban(commands.Cog):
                 ephemeral=True,
             )
         await interaction.guild.ban(member, reason=reason)
+        await cases.record(
+            interaction.guild.id,
+            "tempban" if time else "ban",
+            member.id,
+            interaction.user.id,
+            f"{reason} ({format_timespan(time)})" if time else reason,
+        )
+        if time:
+            until = int(now()) + time
+            tempbans.add(interaction.guild.id, member.id, until)
+            self.scheduler.schedule((interaction.guild.id, member.id), until)
+        else:
+            # Permanent ban replaces an earlier temporary one
+            tempbans.done(interaction.guild.id, member.id)
+            self.scheduler.cancel((interaction.guild.id, member.id))
         await interaction.response.send_message(
             f"Banned {member.mention}",
             ephemeral=True,
         )
         await interaction.followup.send(
             embed=discord.Embed(
-                description=f"{member.mention} has been banned \n**Reason**: {reason}",  # noqa: E501
+                description=f"{member.mention} has been banned{duration} \n**Reason**: {reason}",  # noqa: E501
                 color=0x2f3136,
             ),
             ephemeral=False,
@@ -90,6 +155,9 @@ class Ban(commands.Cog):
                 "This user is not banned",
                 ephemeral=True,
             )
+        tempbans.done(interaction.guild.id, member.id)
+        self.scheduler.cancel((interaction.guild.id, member.id))
+        await cases.record(interaction.guild.id, "unban", member.id, interaction.user.id, reason)  # noqa: E501
 
         await interaction.response.send_message(
             f"Unbanned {member.mention}",
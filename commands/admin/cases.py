@@ -0,0 +1,88 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+from utils.cases import cases
+
+
+class Cases(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @app_commands.command(name="cases", description="Moderation history")
+    @app_commands.describe(
+        user="Show cases against this user",
+        moderator="Show cases handled by this moderator",
+    )
+    @app_commands.default_permissions(moderate_members=True)
+    async def cases(
+        self,
+        interaction:discord.Interaction,
+        user:discord.User=None,
+        moderator:discord.User=None,
+    ):
+        if user is None and moderator is None:
+            return await interaction.response.send_message(
+                "Pick a user or a moderator",
+                ephemeral=True,
+            )
+        await interaction.response.defer(ephemeral=True)
+        view = self.case_pages(interaction.guild.id, user, moderator)
+        embed = await view.load()
+        await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+
+    class case_pages(discord.ui.View):
+
+        '''
+        Case history, each page continues from the last row of the previous
+        '''
+
+        def __init__(self, guild_id, user, moderator):
+            super().__init__(timeout=180)
+            self.guild_id = guild_id
+            self.user = user
+            self.moderator = moderator
+            # Cursor of every opened page, so Previous needs no offsets
+            self.cursors = [None]
+            self.next_cursor = None
+
+        async def load(self) -> discord.Embed:
+            rows, has_next = await cases.history(
+                self.guild_id,
+                target=self.user.id if self.user else None,
+                moderator=self.moderator.id if self.moderator else None,
+                cursor=self.cursors[-1],
+            )
+            self.next_cursor = (rows[-1][5], rows[-1][0]) if rows else None
+            self.previous_button.disabled = len(self.cursors) == 1
+            self.next_button.disabled = not has_next
+            subject = self.user or self.moderator
+            embed = discord.Embed(
+                title=f"Cases of {subject.name}",
+                color=discord.Colour.blurple(),
+            )
+            for case_id, action, target, moderator, reason, created in rows:
+                embed.add_field(
+                    name=f"#{case_id} {action}",
+                    value=f"<@{target}> by <@{moderator}> <t:{created}:R>\n{(reason or 'No reason')[:200]}",  # noqa: E501
+                    inline=False,
+                )
+            if not rows:
+                embed.description = "No cases."
+            embed.set_footer(text=f"Page {len(self.cursors)}")
+            return embed
+
+        @discord.ui.button(label="Previous", style=discord.ButtonStyle.primary)
+        async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):  # noqa: E501
+            if len(self.cursors) > 1:
+                self.cursors.pop()
+            await interaction.response.edit_message(embed=await self.load(), view=self)  # noqa: E501
+
+        @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+        async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):  # noqa: E501
+            if self.next_cursor is not None:
+                self.cursors.append(self.next_cursor)
+            await interaction.response.edit_message(embed=await self.load(), view=self)  # noqa: E501
+
+async def setup(bot:commands.Bot):
+    await bot.add_cog(Cases(bot))
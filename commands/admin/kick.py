@@ -4,6 +4,8 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
+from utils.cases import cases
+
 
 class Kick(commands.Cog):
     def __init__(self, bot):
@@ -53,6 +55,7 @@ class Kick(commands.Cog):
             logging.warning(f"UNSENT KICK MESSAGE: {e}")
 
         await member.kick(reason=reason)
+        await cases.record(interaction.guild.id, "kick", member.id, interaction.user.id, reason)  # noqa: E501
         await interaction.response.send_message(
             f"Kicked {member.mention}",
             ephemeral=True,
@@ -0,0 +1,134 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+from utils.moderation import MassAction, select_targets, split_by_hierarchy
+from utils.timeconverter import TimeConverter
+
+
+class MassModeration(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.running = set()
+
+    async def run(
+        self,
+        interaction:discord.Interaction,
+        action:str,
+        reason:str,
+        ids:str,
+        joined_within:int,
+        role:discord.Role,
+        notify:bool,
+    ):
+        guild = interaction.guild
+        permission = "ban_members" if action == "ban" else "kick_members"
+        name = permission.replace("_", " ").title()
+        if not getattr(interaction.permissions, permission):
+            return await interaction.response.send_message(
+                f"You need the {name} permission",
+                ephemeral=True,
+            )
+        if not getattr(guild.me.guild_permissions, permission):
+            return await interaction.response.send_message(
+                f"I need the {name} permission",
+                ephemeral=True,
+            )
+        if not (ids or joined_within or role):
+            return await interaction.response.send_message(
+                "Give ids, a join window or a role",
+                ephemeral=True,
+            )
+        if guild.id in self.running:
+            return await interaction.response.send_message(
+                "A mass action is already running in this server",
+                ephemeral=True,
+            )
+
+        targets = select_targets(guild, ids, joined_within, role)
+        if action == "kick":
+            targets = [t for t in targets if isinstance(t, discord.Member)]
+        targets, skipped = split_by_hierarchy(guild, interaction.user, targets)
+        if not targets:
+            return await interaction.response.send_message(
+                f"Nobody to {action} ({len(skipped)} skipped by role hierarchy)",
+                ephemeral=True,
+            )
+
+        await interaction.response.send_message(
+            f"Starting mass {action} of {len(targets)} users, "
+            f"{len(skipped)} skipped by role hierarchy",
+            ephemeral=True,
+        )
+        # Plain message, interaction tokens expire before big runs finish
+        status = await interaction.channel.send(
+            embed=discord.Embed(description=f"**Mass {action}**: starting", color=0x2f3136),  # noqa: E501
+        )
+
+        async def update(text:str):
+            await status.edit(embed=discord.Embed(description=text, color=0x2f3136))
+
+        self.running.add(guild.id)
+        try:
+            await MassAction(
+                guild,
+                action,
+                f"{reason} (mass {action} by {interaction.user})",
+                interaction.user.id,
+                notify=notify,
+            ).run(targets, update)
+        finally:
+            self.running.discard(guild.id)
+
+    # No default_permissions, subcommands can't have their own and a
+    # group wide ban_members would hide kick from kick-only moderators.
+    # run() checks the permission of each action instead.
+    class mass(app_commands.Group):
+        def __init__(self, cog):
+            super().__init__()
+            self.name="mass"
+            self.description="Ban or kick many users at once"
+            self.moderation = cog
+
+        @app_commands.command(name="ban", description="Ban many users at once")
+        @app_commands.describe(
+            reason="Reason for ban",
+            ids="User ids or mentions separated by anything",
+            joined_within="Members who joined within this time (1m, 5d, 6h etc..)",  # noqa: E501
+            role="Members with this role",
+            notify="DM users before banning",
+        )
+        async def mass_ban(
+            self,
+            interaction:discord.Interaction,
+            reason:str,
+            ids:str=None,
+            joined_within:app_commands.Transform[str, TimeConverter]=None,
+            role:discord.Role=None,
+            notify:bool=True,
+        ):
+            await self.moderation.run(interaction, "ban", reason, ids, joined_within, role, notify)  # noqa: E501
+
+        @app_commands.command(name="kick", description="Kick many members at once")  # noqa: E501
+        @app_commands.describe(
+            reason="Reason for kick",
+            ids="User ids or mentions separated by anything",
+            joined_within="Members who joined within this time (1m, 5d, 6h etc..)",  # noqa: E501
+            role="Members with this role",
+            notify="DM members before kicking",
+        )
+        async def mass_kick(
+            self,
+            interaction:discord.Interaction,
+            reason:str,
+            ids:str=None,
+            joined_within:app_commands.Transform[str, TimeConverter]=None,
+            role:discord.Role=None,
+            notify:bool=True,
+        ):
+            await self.moderation.run(interaction, "kick", reason, ids, joined_within, role, notify)  # noqa: E501
+
+async def setup(bot:commands.Bot):
+    cog = MassModeration(bot)
+    await bot.add_cog(cog)
+    bot.tree.add_command(cog.mass(cog))
@@ -1,17 +1,70 @@
-import os
-from datetime import datetime
+import asyncio
+import logging
+import sqlite3
+import time
 
 import discord
-from discord import app_commands, utils
+from discord import app_commands
 from discord.ext import commands
 
+from utils.admission import AdmissionQueue, QueueFull
 from utils.configmanager import gconfig, lang, uconfig
+from utils.ticket_archive import archive
+from utils.ticket_export import export_ticket
+from utils.ticket_reviews import MAX_RATING, reviews
+from utils.ticket_search import fts_query, ticket_search
+from utils.tickets import CLOSING, OPEN, TICKET_PREFIX, tickets
+from utils.transcripts import catch_up, transcripts
 
+logger = logging.getLogger(__name__)
+
+# Channel creates of one guild share a rate limit bucket
+admission = AdmissionQueue("ticket_create", concurrency=2, interval=1.0)
+MAX_QUEUED = 500
 
 class Ticketing(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        asyncio.create_task(ticket_search.backfill(tickets))
+        asyncio.create_task(self.catch_up_archives())
+
+    async def cog_unload(self):
+        await tickets.flush()
+
+    async def catch_up_archives(self):
+        '''Archives messages live tickets got while the bot was offline'''
+        for channel_id in list(tickets.channels):
+            channel = self.bot.get_channel(channel_id)
+            if channel_id in tickets and channel is not None:
+                await catch_up(channel)
+
+    @commands.Cog.listener("on_guild_channel_delete")
+    async def ticket_deleted(self, channel:discord.abc.GuildChannel):
+        tickets.remove(channel.id)
+
+    @commands.Cog.listener("on_message")
+    async def archive_message(self, message:discord.Message):
+        if message.channel.id in tickets:
+            archive.message(message)
+
+    @commands.Cog.listener("on_raw_message_edit")
+    async def archive_edit(self, payload:discord.RawMessageUpdateEvent):
+        if payload.channel_id in tickets:
+            archive.edit(payload.message)
+
+    @commands.Cog.listener("on_raw_message_delete")
+    async def archive_delete(self, payload:discord.RawMessageDeleteEvent):
+        if payload.channel_id in tickets:
+            archive.delete(payload.channel_id, payload.message_id)
+
+    @commands.Cog.listener("on_raw_bulk_message_delete")
+    async def archive_bulk_delete(self, payload:discord.RawBulkMessageDeleteEvent):  # noqa: E501
+        if payload.channel_id in tickets:
+            for message_id in payload.message_ids:
+                archive.delete(payload.channel_id, message_id)
+
     @app_commands.default_permissions(manage_guild=True)
     class ticketing_group(app_commands.Group):
         def __init__(self):
@@ -101,6 +154,87 @@ class Ticketing(commands.Cog):
                 await interaction.response.send_message(
                     content=f"Error while running: {e}",
                 )
+        @app_commands.command(name="export",description="Export ticket as HTML and JSON with attachments")  # noqa: E501
+        async def ticket_export(self,interaction: discord.Interaction):
+            channel = interaction.channel
+            if tickets.get(channel.id) is None:
+                return await interaction.response.send_message(
+                    "This channel is not a ticket",
+                    ephemeral=True,
+                )
+            await interaction.response.defer(thinking=True)
+            try:
+                async with transcripts.shared(
+                    (channel.id, "zip"),
+                    lambda: export_ticket(channel, interaction.user.name),
+                ) as file_path:
+                    await interaction.followup.send(
+                        file=discord.File(file_path, f"{channel.name}.zip"),
+                        content="Here is the ticket export:",
+                    )
+            except (discord.HTTPException, OSError) as e:
+                logger.warning(f"Export of ticket {channel.id} failed: {e}")
+                await interaction.followup.send(
+                    content=f"Export failed: {e}",
+                    ephemeral=True,
+                )
+        @app_commands.command(name="search",description="Search closed tickets")
+        @app_commands.describe(
+            query="Words to look for",
+            opener="Only tickets opened by this user",
+            staff="Only tickets this user answered in",
+            days="Only tickets closed in last N days",
+        )
+        async def ticket_search(self,interaction: discord.Interaction, query:str, opener:discord.User=None, staff:discord.User=None, days:int=None):  # noqa: E501
+            if not fts_query(query):
+                return await interaction.response.send_message(
+                    "Give at least one word to search for",
+                    ephemeral=True,
+                )
+            view = Ticketing.search_pages(
+                guild_id=interaction.guild.id,
+                query=query,
+                opener=opener.id if opener else None,
+                staff=staff.id if staff else None,
+                since=int(time.time()) - days * 86400 if days else None,
+            )
+            await interaction.response.defer(ephemeral=True)
+            try:
+                embed = await view.load()
+            except sqlite3.Error as e:
+                logger.warning(f"Ticket search for {query!r} failed: {e}")
+                return await interaction.followup.send(
+                    "Search failed, try different words",
+                    ephemeral=True,
+                )
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+        @app_commands.command(name="stats",description="Ticket review statistics")
+        @app_commands.describe(staff="Show ratings of this staff member")
+        async def ticket_stats(self,interaction: discord.Interaction, staff:discord.User=None):  # noqa: E501
+            if staff is None:
+                stats = reviews.guild_stats(interaction.guild.id)
+                title = f"Reviews of {interaction.guild.name}"
+            else:
+                stats = reviews.staff_stats(interaction.guild.id, staff.id)
+                title = f"Reviews of {staff.name}"
+            embed = discord.Embed(title=title, color=discord.Colour.blurple())
+            if stats is None:
+                embed.description = "No reviews yet."
+            else:
+                window_count, window_mean = stats.window_mean()
+                embed.add_field(name="Reviews", value=str(stats.count))
+                embed.add_field(name="Average", value=f"{stats.mean:.2f}")
+                embed.add_field(name="Last 30 days", value=f"{window_count} reviews, {window_mean:.2f} average")  # noqa: E501
+                embed.add_field(
+                    name="Ratings",
+                    value="\n".join(
+                        f"{rating} star: {count}"
+                        for rating, count in enumerate(stats.histogram, start=1)
+                    ),
+                    inline=False,
+                )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+
         @app_commands.command(name = 'panel', description='Launches the ticketing system')  # noqa: E501
         @app_commands.checks.cooldown(3, 60, key = lambda i: (i.guild_id))
         async def ticketing(self,interaction: discord.Interaction,title:str="Hi! If you need help or have a question, don't hesitate to create a ticket.", text:str=""):  # noqa: E501
@@ -158,55 +292,84 @@ class Ticketing(commands.Cog):
                     f"Slow down! Try again in {round(retry, 1)} seconds!",
                     ephemeral = True,
                 )
-            ticket = utils.get(
-                interaction.guild.text_channels,
-                name = f"ticket-{interaction.user.name.lower().replace(' ', '-')}-{interaction.user.discriminator}")  # noqa: E501
+            ticket_id = tickets.find_open(interaction.guild, interaction.user.id)
+            ticket = interaction.guild.get_channel(ticket_id) if ticket_id else None
+            if ticket_id and ticket is None:
+                # Channel vanished while bot was offline
+                tickets.remove(ticket_id)
 
             if ticket is not None:
-                await interaction.response.send_message(
+                return await interaction.response.send_message(
                     f"You already have a ticket open at {ticket.mention}!",
                     ephemeral = True,
                 )
+            if admission.queued(interaction.guild.id, interaction.user.id):
+                return await interaction.response.send_message(
+                    "Your ticket is already being created, hang on!",
+                    ephemeral = True,
+                )
 
-            else:
-                overwrites = {
-                    interaction.guild.default_role: discord.PermissionOverwrite(
-                        view_channel = False,
-                    ),
-                    interaction.user: discord.PermissionOverwrite(
-                        view_channel = True,
-                        read_message_history = True,
-                        send_messages = True,
-                        attach_files = True,
-                        embed_links = True,
-                    ),
-                    interaction.guild.me: discord.PermissionOverwrite(
-                        view_channel = True,
-                        send_messages = True,
-                        read_message_history = True,
-                    ),
-                }
-                try:
-                    channel = await interaction.guild.create_text_channel(
-                        name = f"ticket-for-{interaction.user.name}-{interaction.user.discriminator}",  # noqa: E501
-                        overwrites = overwrites,
-                        reason = f"Ticket for {interaction.user}",
-                    )
+            await interaction.response.defer(ephemeral = True, thinking = True)
+            cap = gconfig.get(interaction.guild.id,"Ticketing","max-open")
+            limit = MAX_QUEUED
+            if cap.isdigit():
+                limit = min(limit, int(cap) - tickets.count_open(interaction.guild.id))  # noqa: E501
 
-                except Exception as e:
-                    return await interaction.response.send_message(
-                        f"Ticket creation failed! Make sure I have `manage_channels` permissions! --> {e}",  # noqa: E501
-                        ephemeral = True,
-                    )
+            async def queued(position):
+                await interaction.edit_original_response(
+                    content=f"Lots of tickets are being opened right now, you are #{position} in the queue.",  # noqa: E501
+                )
 
-                await channel.send(
-                    f"@everyone, {interaction.user.mention} created a ticket!",
-                    view = Ticketing.main(),
+            try:
+                channel = await admission.submit(
+                    interaction.guild.id,
+                    interaction.user.id,
+                    lambda: self.create_ticket(interaction),
+                    limit=limit,
+                    on_queued=queued,
                 )
-                await interaction.response.send_message(
-                    f"I've opened a ticket for you at {channel.mention}!",
-                    ephemeral = True,
+            except QueueFull:
+                return await interaction.edit_original_response(
+                    content="This server has too many open tickets right now, try again later!",  # noqa: E501
+                )
+            except Exception as e:
+                return await interaction.edit_original_response(
+                    content=f"Ticket creation failed! Make sure I have `manage_channels` permissions! --> {e}",  # noqa: E501
                 )
+            await interaction.edit_original_response(
+                content=f"I've opened a ticket for you at {channel.mention}!",
+            )
+
+        async def create_ticket(self, interaction: discord.Interaction) -> discord.TextChannel:  # noqa: E501
+            overwrites = {
+                interaction.guild.default_role: discord.PermissionOverwrite(
+                    view_channel = False,
+                ),
+                interaction.user: discord.PermissionOverwrite(
+                    view_channel = True,
+                    read_message_history = True,
+                    send_messages = True,
+                    attach_files = True,
+                    embed_links = True,
+                ),
+                interaction.guild.me: discord.PermissionOverwrite(
+                    view_channel = True,
+                    send_messages = True,
+                    read_message_history = True,
+                ),
+            }
+            channel = await interaction.guild.create_text_channel(
+                name = f"{TICKET_PREFIX}{interaction.user.name}-{interaction.user.discriminator}",  # noqa: E501
+                overwrites = overwrites,
+                reason = f"Ticket for {interaction.user}",
+            )
+            tickets.add(channel.id, interaction.guild.id, interaction.user.id)
+            await channel.send(
+                f"@everyone, {interaction.user.mention} created a ticket!",
+                view = Ticketing.main(),
+            )
+            return channel
+
     class main(discord.ui.View):
 
         '''
@@ -248,56 +411,57 @@ class Ticketing(commands.Cog):
         )
         async def transcript(self, interaction:discord.Interaction, button):
             await interaction.response.defer()
+            compress = gconfig.get(interaction.guild.id,"Ticketing","transcript-gzip") == "True"  # noqa: E501
+            suffix = ".md.gz" if compress else ".md"
+            async with transcripts.transcript(
+                interaction.channel,
+                interaction.user.name,
+                compress,
+            ) as file_path:
+                await interaction.followup.send(
+                    file=discord.File(file_path, f"{interaction.channel.name}{suffix}"),  # noqa: E501
+                    content="Here is the transcript:",
+                )
+    class search_pages(discord.ui.View):
 
-            # Specify the path where the file will be saved
-            file_dir = ".cache/"
+        '''
+        Search results, each page is queried when it is opened
+        '''
 
-            file_path = os.path.join(file_dir, f"transcript-{interaction.channel.id}.md")  # noqa: E501
+        def __init__(self, guild_id, query, opener, staff, since):
+            super().__init__(timeout=180)
+            self.search = (guild_id, query, opener, staff, since)
+            self.page = 0
 
-            if os.path.exists(file_path):
-                return await interaction.followup.send(
-                    "A transcript is already being generated!",
-                    ephemeral=True,
+        async def load(self) -> discord.Embed:
+            results, has_next = await ticket_search.search(*self.search, page=self.page)  # noqa: E501
+            self.previous_button.disabled = self.page == 0
+            self.next_button.disabled = not has_next
+            embed = discord.Embed(
+                title=f"Tickets matching: {self.search[1]}",
+                color=discord.Colour.blurple(),
+            )
+            for channel_id, name, opener, closed, snippet in results:
+                embed.add_field(
+                    name=f"{name} ({channel_id})",
+                    value=f"Opened by <@{opener}>, closed <t:{closed}:R>\n{snippet[:900]}",  # noqa: E501
+                    inline=False,
                 )
+            if not results:
+                embed.description = "Nothing found."
+            embed.set_footer(text=f"Page {self.page + 1}")
+            return embed
 
-            try:
-                with open(file_path, 'a', encoding='utf-8') as f:
-                    f.write(f"# Transcript of {interaction.channel.name}:\n\n")
-                    async for message in interaction.channel.history(
-                        limit=None,
-                        oldest_first=True,
-                    ):
-                        created = datetime.strftime(
-                            message.created_at,
-                            "%m/%d/%Y at %H:%M:%S",
-                        )
-
-                        if message.edited_at:
-                            edited = datetime.strftime(
-                                message.edited_at,
-                                "%m/%d/%Y at %H:%M:%S",
-                            )
-                            f.write(
-                                f"{message.author} on {created}: {message.clean_content} (Edited at {edited})\n",  # noqa: E501
-                            )
-                        else:
-                            f.write(
-                                f"{message.author} on {created}: {message.clean_content}\n",  # noqa: E501
-                            )
-
-                    generated = datetime.now().strftime("%m/%d/%Y at %H:%M:%S")
-                    f.write(
-                        f"\n*Generated at {generated} by {interaction.user.name}*\n*Date Formatting: MM/DD/YY*\n*Time Zone: UTC*",  # noqa: E501
-                    )
+        @discord.ui.button(label="Previous", style=discord.ButtonStyle.primary)
+        async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):  # noqa: E501
+            self.page = max(0, self.page - 1)
+            await interaction.response.edit_message(embed=await self.load(), view=self)  # noqa: E501
+
+        @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+        async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):  # noqa: E501
+            self.page += 1
+            await interaction.response.edit_message(embed=await self.load(), view=self)  # noqa: E501
 
-                with open(file_path, 'rb') as f:
-                    await interaction.followup.send(
-                        file=discord.File(f, f"{interaction.channel.name}.md"),
-                        content="Here is the transcript:",
-                    )
-            finally:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
     class confirm(discord.ui.View):
 
         '''
@@ -318,20 +482,46 @@ class Ticketing(commands.Cog):
                 description=lang.get(interaction.user.id,"TicketingCommand","embed_review_description"),
             )
             try:
+                tickets.set_state(interaction.channel.id, CLOSING)
+                # Last chance to fill gaps in the log from the history
+                await catch_up(interaction.channel)
                 await interaction.channel.delete()
-                if gconfig.get(interaction.guild.id,"Ticketing","reviews-enabled") is True:  # noqa: E501
-                    await interaction.user.send(embed=embed,view=Ticketing.reviews(guild=interaction.guild))  # noqa: E501
+                if archive.has(interaction.channel.id):
+                    await transcripts.finalize(interaction.channel, interaction.user.name)  # noqa: E501
+                    await ticket_search.index(
+                        interaction.channel.id,
+                        tickets.get(interaction.channel.id),
+                        interaction.channel.name,
+                        exclude={interaction.client.user.id},
+                    )
+                tickets.remove(interaction.channel.id)
+                entry = tickets.get(interaction.channel.id)
+                opener = interaction.guild.get_member(entry["opener"]) if entry else None  # noqa: E501
+                # Nobody to ask once the opener left, the closer must not
+                # rate their own ticket
+                if opener is not None and gconfig.get(interaction.guild.id,"Ticketing","reviews-enabled") == "True":  # noqa: E501
+                    staff_id = interaction.user.id if opener != interaction.user else 0  # noqa: E501
+                    await opener.send(
+                        embed=embed,
+                        view=Ticketing.reviews(
+                            guild_id=interaction.guild.id,
+                            ticket_id=interaction.channel.id,
+                            staff_id=staff_id,
+                        ),
+                    )
 
             except discord.Forbidden :
+                tickets.set_state(interaction.channel.id, OPEN)
                 await interaction.response.send_message(
                     content="Channel deletion failed! Make sure I have `manage_channels` permissions!",  # noqa: E501
                     ephemeral = True,
                 )
 
     class reviews(discord.ui.View):
-        def __init__(self,guild:discord.Interaction.guild) -> None:  # noqa: ANN101
+        def __init__(self,guild_id:int,ticket_id:int,staff_id:int) -> None:  # noqa: ANN101, E501
             super().__init__(timeout = None)
-            self.guild:discord.Interaction.guild = guild
+            for rating in range(1, MAX_RATING + 1):
+                self.add_item(Ticketing.review_button(guild_id, ticket_id, staff_id, rating))  # noqa: E501
 
         def rev_embed(self,interaction:discord.Interaction):
             review_embed = discord.Embed(
@@ -339,81 +529,56 @@ class Ticketing(commands.Cog):
                 description=lang.get(uconfig.get(interaction.user.id,"Appearance","language"),"TicketingCommand","embed_review_rev_desc"),
             )
             return review_embed
-        async def disable_all_buttons(self, interaction: discord.Interaction):
-            for child in self.children:
-                if isinstance(child, discord.ui.Button):
-                    child.disabled = True
-            await interaction.response.edit_message(view=self)
 
-        @discord.ui.button(label="1 star")
-        async def rev_star1(self, interaction: discord.Interaction, button: discord.Button):  # noqa: E501
-            await self.disable_all_buttons(interaction)
-            response_embed = discord.Embed(
-                title=lang.get(uconfig.get(interaction.user.id,"Appearance","language"),"TicketingCommand","embed_review_resp_title"),
-            )
-            await interaction.user.send(
-                embed=response_embed,
-            )
-            channel = self.guild.get_channel(
-                gconfig.get(self.guild.id,"Ticketing","reviews-channel"),
-            )
-            await channel.send(content=f"Rating: 1\nUser: {interaction.user.name}")  # noqa: E501
+    class review_button(
+        discord.ui.DynamicItem[discord.ui.Button],
+        template=r"review:(?P<guild>\d+):(?P<ticket>\d+):(?P<staff>\d+):(?P<rating>\d+)",
+    ):
 
-        @discord.ui.button(label="2 star")
-        async def rev_star2(self, interaction: discord.Interaction, button: discord.Button):  # noqa: E501
-            await self.disable_all_buttons(interaction)
-            response_embed = discord.Embed(
-                title=lang.get(uconfig.get(interaction.user.id,"Appearance","language"),"TicketingCommand","embed_review_resp_title"),
-            )
-            await interaction.user.send(
-                embed=response_embed,
-            )
-            channel = self.guild.get_channel(
-                gconfig.get(self.guild.id,"Ticketing","reviews-channel"),
-            )
-            await channel.send(content=f"Rating: 2\nUser: {interaction.user.name}")  # noqa: E501
+        '''
+        Rating button of a review prompt
 
-        @discord.ui.button(label="3 star")
-        async def rev_star3(self, interaction: discord.Interaction, button: discord.Button):  # noqa: E501
-            await self.disable_all_buttons(interaction)
-            response_embed = discord.Embed(
-                title=lang.get(uconfig.get(interaction.user.id,"Appearance","language"),"TicketingCommand","embed_review_resp_title"),
-            )
-            await interaction.user.send(
-                embed=response_embed,
-            )
-            channel = self.guild.get_channel(
-                gconfig.get(self.guild.id,"Ticketing","reviews-channel"),
-            )
-            await channel.send(content=f"Rating: 3\nUser: {interaction.user.name}")  # noqa: E501
+        Guild, ticket, staff and rating are kept in the custom_id, so
+        prompts sent before a restart still work
+        '''
 
-        @discord.ui.button(label="4 star")
-        async def rev_star4(self, interaction: discord.Interaction, button: discord.Button):  # noqa: E501
-            await self.disable_all_buttons(interaction)
-            response_embed = discord.Embed(
-                title=lang.get(uconfig.get(interaction.user.id,"Appearance","language"),"TicketingCommand","embed_review_resp_title"),
-            )
-            await interaction.user.send(
-                embed=response_embed,
-            )
-            channel = self.guild.get_channel(
-                gconfig.get(self.guild.id,"Ticketing","reviews-channel"),
-            )
-            await channel.send(content=f"Rating: 4\nUser: {interaction.user.name}")  # noqa: E501
+        def __init__(self, guild_id:int, ticket_id:int, staff_id:int, rating:int):
+            super().__init__(discord.ui.Button(
+                label=f"{rating} star",
+                custom_id=f"review:{guild_id}:{ticket_id}:{staff_id}:{rating}",
+            ))
+            self.guild_id = guild_id
+            self.ticket_id = ticket_id
+            self.staff_id = staff_id
+            self.rating = rating
 
-        @discord.ui.button(label="5 star")
-        async def rev_star5(self, interaction: discord.Interaction, button: discord.Button):  # noqa: E501
+        @classmethod
+        async def from_custom_id(cls, interaction:discord.Interaction, item, match):  # noqa: E501
+            return cls(*(int(match[key]) for key in ("guild", "ticket", "staff", "rating")))  # noqa: E501
+
+        async def disable_all_buttons(self, interaction: discord.Interaction):
+            view = discord.ui.View.from_message(interaction.message)
+            for child in view.children:
+                if isinstance(child, discord.ui.Button):
+                    child.disabled = True
+            # Only shows the disabled buttons, clicks go to review_button
+            view.stop()
+            await interaction.response.edit_message(view=view)
+
+        async def callback(self, interaction: discord.Interaction):
             await self.disable_all_buttons(interaction)
+            reviews.add(self.guild_id, self.ticket_id, self.staff_id, self.rating)
             response_embed = discord.Embed(
                 title=lang.get(uconfig.get(interaction.user.id,"Appearance","language"),"TicketingCommand","embed_review_resp_title"),
             )
             await interaction.user.send(
                 embed=response_embed,
             )
-            channel = self.guild.get_channel(
-                gconfig.get(self.guild.id,"Ticketing","reviews-channel"),
-            )
-            await channel.send(content=f"Rating: 5\nUser: {interaction.user.name}")  # noqa: E501
+            guild = interaction.client.get_guild(self.guild_id)
+            channel_id = gconfig.get(self.guild_id,"Ticketing","reviews-channel")
+            channel = guild.get_channel(int(channel_id)) if guild and channel_id.isdigit() else None  # noqa: E501
+            if channel is not None:
+                await channel.send(content=f"Rating: {self.rating}\nUser: {interaction.user.name}")  # noqa: E501
 
 async def setup(bot:commands.Bot):
     cog = Ticketing(bot)
@@ -421,4 +586,5 @@ async def setup(bot:commands.Bot):
     bot.add_view(Ticketing.ticket_launcher())
     bot.add_view(Ticketing.main())
     bot.add_view(Ticketing.confirm())
+    bot.add_dynamic_items(Ticketing.review_button)
     bot.tree.add_command(cog.ticketing_group())
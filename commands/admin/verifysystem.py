@@ -1,21 +1,86 @@
+import io
 import logging
 
-#import os
 import discord
 from discord import app_commands
 from discord.ext import commands
 
 from utils.autocomplete import autocomplete_verify_modes
+from utils.captcha import CHALLENGE_TTL, captcha_pool, challenges
 from utils.configmanager import gconfig
+from utils.verification import role_grants
+from utils.verify_panels import VIEW_VERSION, panels
+from utils.workqueue import CoalescingQueue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMOJI = "\N{WHITE HEAVY CHECK MARK}"
+
+def emoji_key(emoji:str | discord.PartialEmoji) -> str:
+    '''
+    Comparable form of an emoji
+
+    Custom emojis compare by id. Unicode ones drop the U+FE0F variation
+    selector, which typed emojis often have and gateway reactions lack.
+    '''
+    if isinstance(emoji, str):
+        emoji = discord.PartialEmoji.from_str(emoji.strip())
+    if emoji.id:
+        return str(emoji.id)
+    return emoji.name.replace("\ufe0f", "")
+
+async def reattach_panel(message_id:int, client:discord.Client):
+    '''Replaces components of a panel posted by an older version'''
+    panel = panels.get(message_id)
+    if panel is None:
+        return
+    message = client.get_partial_messageable(panel["channel"]).get_partial_message(message_id)  # noqa: E501
+    try:
+        await message.edit(view=VerifySystem.views[panel["mode"]]())
+    except discord.NotFound:
+        panels.remove(message_id)
+        return
+    panels.mark_current(message_id)
+
+# Only panels somebody clicks get edited, a few at a time
+reattach = CoalescingQueue(reattach_panel, workers=2, interval=1.0, name="verify-reattach")  # noqa: E501
 
 
 class VerifySystem(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        captcha_pool.start()
+
+    async def cog_unload(self):
+        await captcha_pool.stop()
+        await role_grants.stop()
+        await reattach.stop()
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload:discord.RawReactionActionEvent):
+        if payload.message_id not in panels.watched:
+            return
+        member = payload.member
+        if member is None or member.bot:
+            return
+        panel = panels.get(payload.message_id)
+        if emoji_key(payload.emoji) != emoji_key(panel.get("emoji", DEFAULT_EMOJI)):  # noqa: E501
+            return
+        role = member.guild.get_role(panel["role"])
+        if role is not None and role not in member.roles:
+            role_grants.push(member, role)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload:discord.RawMessageDeleteEvent):
+        if payload.message_id in panels.panels:
+            panels.remove(payload.message_id)
+
     @app_commands.command(name="verify-system",description="No bots in the server")
     @app_commands.default_permissions(administrator=True)
     @app_commands.autocomplete(mode=autocomplete_verify_modes)
+    @app_commands.describe(emoji="Reaction to verify with in emoji mode")
     async def verify_system(
         self,
         interaction: discord.Interaction,
@@ -24,12 +89,34 @@ class VerifySystem(commands.Cog):
         role:discord.Role,
         channel: discord.TextChannel,
         mode: str = "button",
+        emoji: str = DEFAULT_EMOJI,
     ):
         if mode == "emoji":
             await interaction.response.send_message(
-                content="In progress",
+                content="Selected Emoji",
                 ephemeral=True,
             )
+            embed = discord.Embed(
+                title=title,
+                description=description,
+            )
+            message = await channel.send(embed=embed)
+            try:
+                await message.add_reaction(emoji)
+            except discord.HTTPException:
+                await message.delete()
+                return await interaction.followup.send(
+                    content=f"{emoji} is not an emoji I can use",
+                    ephemeral=True,
+                )
+            panels.add(
+                message.id,
+                interaction.guild.id,
+                channel.id,
+                role.id,
+                mode,
+                emoji=str(discord.PartialEmoji.from_str(emoji.strip())),
+            )
         elif mode == "button":
             await interaction.response.send_message(
                 content="Selected Button",
@@ -39,35 +126,25 @@ class VerifySystem(commands.Cog):
                 title=title,
                 description=description,
             )
-            await channel.send(
+            message = await channel.send(
                 embed=embed,
                 view=self.verify_button(),
             )
-            """gconfig.set(
-                interaction.guild.id,
-                str(channel.id)+"-verify",
-                "message_id",
-                message.id,
-            ) """
-            gconfig.set(
-                interaction.guild.id,
-                str(channel.id)+"-verifybutton",
-                "role",
-                role.id,
-            )
+            panels.add(message.id, interaction.guild.id, channel.id, role.id, mode)
         elif mode == "captcha":
             await interaction.response.send_message(
-                content="In progress :3",
+                content="Selected Captcha",
                 ephemeral=True,
             )
             embed = discord.Embed(
                 title=title,
                 description=description,
             )
-            await channel.send(
+            message = await channel.send(
                 embed=embed,
                 view=self.verify_captcha(),
             )
+            panels.add(message.id, interaction.guild.id, channel.id, role.id, mode)
         elif mode == "teams":
             await interaction.response.send_message(
                 content="In progress :)",
@@ -79,6 +156,45 @@ class VerifySystem(commands.Cog):
                 ephemeral=True,
             )
 
+    @staticmethod
+    def panel(interaction: discord.Interaction, message_id:int, mode:str) -> dict | None:  # noqa: E501
+        '''
+        Binding of panel message
+
+        Panels posted before the index have only a "<channel>-verify<mode>"
+        config section, they are indexed on their first click.
+        '''
+        panel = panels.get(message_id)
+        if panel is None:
+            role = gconfig.get(interaction.guild.id, f"{interaction.channel.id}-verify{mode}", "role")  # noqa: E501
+            if not role.isdigit():
+                return None
+            panel = panels.add(message_id, interaction.guild.id, interaction.channel.id, int(role), mode)  # noqa: E501
+        elif panel["version"] < VIEW_VERSION:
+            reattach.push(message_id, interaction.client)
+        return panel
+
+    @staticmethod
+    async def grant(interaction: discord.Interaction, message_id:int, mode:str):
+        '''Acknowledges the click and queues the role grant'''
+        panel = VerifySystem.panel(interaction, message_id, mode)
+        role = interaction.guild.get_role(panel["role"]) if panel else None
+        if role is None:
+            return await interaction.response.send_message(
+                content="Verification role is not set up",
+                ephemeral=True,
+            )
+        if role in interaction.user.roles:
+            return await interaction.response.send_message(
+                content="You are already verified",
+                ephemeral=True,
+            )
+        await interaction.response.send_message(
+            content="Verifying...",
+            ephemeral=True,
+        )
+        role_grants.push(interaction.user, role, interaction)
+
     class verify_button(discord.ui.View):
         def __init__(self)-> None:
             super().__init__(timeout=None)
@@ -89,30 +205,7 @@ class VerifySystem(commands.Cog):
             custom_id="verify",
         )
         async def verify(self, interaction: discord.Interaction, button: discord.ui.button): # noqa: E501
-            #await interaction.response.send_message(content="Clicked :3",ephemeral=True) # noqa: E501
-            try:
-                role = gconfig.get(
-                    interaction.guild.id,
-                    str(interaction.channel.id)+"-verifybutton",
-                    "role",
-                )
-                if role is None:
-                    interaction.response.send_message("interaction failed: role is none")  # noqa: E501
-                # Convert the string back to an integer and role
-                role_id = int(role)
-                role = interaction.guild.get_role(role_id)
-
-                await interaction.user.add_roles(role)
-                await interaction.response.send_message(
-                    content="Verified!",
-                    ephemeral=True,
-                )
-            except discord.errors.Forbidden:
-                await interaction.response.send_message(
-                    content="Insufficient Permissions",
-                )
-            except Exception as e:
-                logging.error(str(e))
+            await VerifySystem.grant(interaction, interaction.message.id, "button")
 
     class verify_teams(discord.ui.View):
         def __init__(self)-> None:
@@ -120,56 +213,69 @@ class VerifySystem(commands.Cog):
     class verify_captcha(discord.ui.View):
         def __init__(self):
             super().__init__(timeout=None)
-    class verify_emoji(discord.ui.View):
-        def __init__(self)-> None:
-            super().__init__(timeout=None)
 
-async def setup(bot: commands.Bot):  # noqa: C901
+        @discord.ui.button(
+            label="Verify",
+            style = discord.ButtonStyle.blurple,
+            custom_id="verify-captcha",
+        )
+        async def verify(self, interaction: discord.Interaction, button: discord.ui.button): # noqa: E501
+            # An empty pool renders inline, which may take longer than 3s
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            answer, image = await captcha_pool.take()
+            challenges.issue(interaction.guild.id, interaction.user.id, answer)
+            await interaction.followup.send(
+                content=f"Type the text from the image, you have {CHALLENGE_TTL // 60} minutes.",  # noqa: E501
+                file=discord.File(io.BytesIO(image), filename="captcha.png"),
+                view=VerifySystem.captcha_answer(interaction.message.id),
+                ephemeral=True,
+            )
+
+    class captcha_answer(discord.ui.View):
+        def __init__(self, panel_id:int)-> None:
+            super().__init__(timeout=CHALLENGE_TTL)
+            self.panel_id = panel_id
+
+        @discord.ui.button(label="Answer", style=discord.ButtonStyle.green)
+        async def answer(self, interaction: discord.Interaction, button: discord.ui.button): # noqa: E501
+            await interaction.response.send_modal(
+                VerifySystem.captcha_modal(self.panel_id),
+            )
+
+    class captcha_modal(discord.ui.Modal, title="Captcha"):
+        text = discord.ui.TextInput(label="Text from the image", max_length=16)
+
+        def __init__(self, panel_id:int)-> None:
+            super().__init__()
+            self.panel_id = panel_id
+
+        async def on_submit(self, interaction: discord.Interaction):
+            result = challenges.check(
+                interaction.guild.id,
+                interaction.user.id,
+                self.text.value,
+            )
+            if result is None:
+                return await interaction.response.send_message(
+                    content="Captcha expired, press Verify again",
+                    ephemeral=True,
+                )
+            if result is False:
+                return await interaction.response.send_message(
+                    content="Wrong answer, try again",
+                    ephemeral=True,
+                )
+            await VerifySystem.grant(interaction, self.panel_id, "captcha")
+    views = {
+        "button": verify_button,
+        "captcha": verify_captcha,
+    }
+
+async def setup(bot: commands.Bot):
     cog = VerifySystem(bot)
     await bot.add_cog(cog)
-    bot.add_view(VerifySystem.verify_button())
-
-#    for filename in os.listdir("data/guilds"):
-#        if filename.endswith(".toml"):
-#            guild_id = filename[:-5]  # Remove the .toml extension
-#
-#            for key in gconfig.config[guild_id]:
-#                if key.endswith("-verifybutton"):
-#                    message_id = gconfig.get(guild_id, key, "message_id")
-#                    channel_id_str = key[:-7]
-#                    role_id = gconfig.get(guild_id, key, "role")
-#
-#                    # Convert channel_id to integer
-#                    try:
-#                        channel_id = int(channel_id_str)
-#                    except ValueError:
-#                        logging.error(f"Invalid channel ID {channel_id_str}")
-#                        continue
-#
-#                    if role_id and message_id:
-#                        guild = bot.get_guild(int(guild_id))
-#                        if not guild:
-#                            logging.debug(f"Guild {guild_id} not found.")
-#                            continue
-#                        else:
-#                            logging.debug(f"Guild found: {guild}")
-#
-#                        channel = guild.get_channel(channel_id)
-#                        if not channel:
-#                            logging.debug(f"Channel {channel_id} not found in guild {guild_id}")  # noqa: E501
-#                        else:
-#                            logging.debug(f"Channel found: {channel}")
-#
-#                        view = cog.verify_button()
-#                        try:
-#                            message = await channel.fetch_message(int(message_id))
-#                            await message.edit(view=view)
-#                            logging.debug(f"Updated message {message_id} in channel {channel_id} with new view.")  # noqa: E501
-#                        except discord.NotFound:
-#                            logging.debug(f"Message {message_id} not found in channel {channel_id}.")  # noqa: E501
-#                        except discord.Forbidden:
-#                            logging.debug(f"Bot does not have permission to fetch message {message_id}.")  # noqa: E501
-#                        except discord.HTTPException as e:
-#                            logging.error(f"HTTP error when fetching message {message_id}: {e}")  # noqa: E501
-#                        except Exception as e:
-#                            logging.error(f"Unexpected error when updating message {message_id}: {e}")  # noqa: E501
+    # Components are matched by custom_id, so one view per mode serves
+    # every panel without fetching a single message
+    for view in VerifySystem.views.values():
+        bot.add_view(view())
+    logger.debug(f"Restored {len(panels)} verify panels")
@@ -251,6 +251,63 @@ class GuildConfig(commands.Cog):
                     ephemeral=True,
                 )
 
+        @app_commands.command(
+            name="transcripts",
+            description="Transcript options",
+        )
+        @app_commands.describe(compress="Send transcripts gzip compressed")
+        async def conf_ticketing_transcripts(
+            self,
+            interaction: discord.Interaction,
+            compress: bool,
+        ):
+            try:
+                gconfig.set(
+                    id=interaction.guild_id,
+                    title="Ticketing",
+                    key="transcript-gzip",
+                    value=compress,
+                )
+                await interaction.response.send_message(
+                    content=f"Set value {str(compress)}",
+                    ephemeral=True,
+                )
+            except Exception as e:
+                await interaction.response.send_message(
+                    content=f"Exception happened: {e}",
+                    ephemeral=True,
+                )
+
+        @app_commands.command(
+            name="max-open",
+            description="Maximum open tickets on the server",
+        )
+        @app_commands.describe(amount="Open tickets allowed at once, 0 for no limit")  # noqa: E501
+        async def conf_ticketing_max_open(
+            self,
+            interaction: discord.Interaction,
+            amount: app_commands.Range[int, 0, 500],
+        ):
+            try:
+                if amount:
+                    gconfig.set(
+                        id=interaction.guild_id,
+                        title="Ticketing",
+                        key="max-open",
+                        value=amount,
+                    )
+                else:
+                    gconfig.delete(interaction.guild_id, "Ticketing", "max-open")
+                await interaction.response.send_message(
+                    content=f"Set value {str(amount)}",
+                    ephemeral=True,
+                )
+            except Exception as e:
+                await interaction.response.send_message(
+                    content=f"Exception happened: {e}",
+                    ephemeral=True,
+                )
+
     @app_commands.default_permissions(
         administrator=True,
     )
@@ -1,9 +1,11 @@
+import contextlib
 import datetime
 import logging
 
 import discord
 from discord.ext import commands
 
+from utils.cases import cases
 from utils.configmanager import gconfig
 
 #from humanfriendly import format_timespan
@@ -29,8 +31,16 @@ class AntiAlts(commands.Cog):
                     title="ALT Account Detected!",
                     description=text,
                 )
-                member.send(embed=embed)
-                member.kick("Alternative Account [Lorelei]")
+                with contextlib.suppress(discord.HTTPException):
+                    await member.send(embed=embed)
+                await member.kick(reason="Alternative Account [Lorelei]")
+                await cases.record(
+                    member.guild.id,
+                    "alt-kick",
+                    member.id,
+                    self.bot.user.id,
+                    f"Account age {int(account_age)}s",
+                )
             else:
                 logging.debug("Acc okay")
         logging.debug("antialts disabled :<")
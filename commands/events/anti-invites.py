@@ -3,6 +3,7 @@ import logging
 import discord
 from discord.ext import commands
 
+from utils.cases import cases
 from utils.configmanager import gconfig, lang, uconfig
 
 
@@ -30,6 +31,13 @@ class AntiInvites(commands.Cog):
                     if 'discord.gg' in message.content:
                         try:
                             await message.delete()
+                            await cases.record(
+                                guild_id,
+                                "invite",
+                                message.author.id,
+                                self.bot.user.id,
+                                "Posted an invite link",
+                            )
                             await message.author.send(
                                 content=lang.get(ulanguage,"Responds","no_invites"),
                             )
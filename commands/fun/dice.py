@@ -1,5 +1,5 @@
+import asyncio
 import logging
-import random
 
 import discord
 from discord import app_commands
@@ -7,22 +7,54 @@ from discord.ext import commands
 
 from utils.autocomplete import autocomplete_dice_modes
 from utils.configmanager import gconfig, lang, uconfig
-from utils.dices import dices
+from utils.dices import DiceError, dices, mode_expression, parse, roll
+from utils.dices import stats as simulate
 
+BAR_WIDTH = 20
+
+def stats_embed(expression:str, result:dict) -> discord.Embed:
+    embed = discord.Embed(
+        title=f"Distribution of {expression}",
+        description=f"{result['trials']:,} simulated rolls",
+    )
+    embed.add_field(name="Mean", value=f"{result['mean']:.2f}")
+    embed.add_field(name="Std dev", value=f"{result['std']:.2f}")
+    embed.add_field(name="Range", value=f"{result['min']} - {result['max']}")
+    embed.add_field(
+        name="Percentiles",
+        value=" | ".join(f"p{p}: {v:g}" for p, v in result["percentiles"].items()),
+        inline=False,
+    )
+    peak = max(count for _, _, count in result["histogram"])
+    lines = []
+    for low, high, count in result["histogram"]:
+        label = str(low) if low == high else f"{low}-{high}"
+        bar = "#" * round(BAR_WIDTH * count / peak)
+        lines.append(f"{label:>11} {bar} {count / result['trials']:.1%}")
+    embed.add_field(name="Histogram", value="```\n" + "\n".join(lines) + "\n```", inline=False)  # noqa: E501
+    return embed
 
 class Dice(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    def default_mode(self, interaction:discord.Interaction) -> str:
+        mode = gconfig.get(id=interaction.guild.id,title="FUN",key="def_dice")
+        if mode not in dices:
+            mode = uconfig.get(id=interaction.user.id,title="FUN",key="def_dice")
+        return mode if mode in dices else "classic (D6)"
+
     @app_commands.command(name="dice",description="Roll the Dice!")
     @app_commands.autocomplete(mode=autocomplete_dice_modes)
-    async def dice(self,interaction:discord.Interaction,mode:str=None):
-        if mode == "" or mode is None:  # noqa: SIM118
-            mode = gconfig.get(id=interaction.guild.id,title="FUN",key="def_dice")  # noqa: E501
-            if mode is None:
-                mode = uconfig.get(id=interaction.user.id,title="FUN",key="def_dice")  # noqa: E501
-                if mode is None:
-                    mode = "classic (D6)"
+    @app_commands.describe(
+        expression="Dice expression like 8d6+3, 4d6kh3, 2d10! or 1000d20",
+        stats="Simulate a million rolls and show the distribution",
+    )
+    async def dice(self,interaction:discord.Interaction,mode:str=None,expression:str=None,stats:bool=False):  # noqa: E501
+        if expression:
+            mode = expression
+        elif mode == "" or mode is None:
+            mode = self.default_mode(interaction)
         elif mode not in dices.keys():  # noqa: SIM118
             embed = discord.Embed(
                 title="Error",
@@ -30,14 +62,31 @@ class Dice(commands.Cog):
             )
             await interaction.response.send_message(embed=embed,ephemeral=True)  # noqa: E501
             return
+        expression = expression or mode_expression(*dices[mode])
         try:
-            min_val, max_val = dices[mode]
-            roll = random.randint(min_val,max_val)  # noqa: S311
+            if stats:
+                parse(expression)
+                await interaction.response.defer()
+                result = await asyncio.to_thread(simulate, expression)
+                await interaction.followup.send(embed=stats_embed(expression, result))  # noqa: E501
+                return
+            total, details = roll(expression)
             embed = discord.Embed(
                 title=lang.get(uconfig.get(interaction.user.id,"APPEARANCE","language"),"Responds","dice_roller_title"),
-                description=lang.get(uconfig.get(interaction.user.id,"APPEARANCE","language"),"Responds","dice_roller_desc").format(mode=mode,roll=roll),
+                description=lang.get(uconfig.get(interaction.user.id,"APPEARANCE","language"),"Responds","dice_roller_desc").format(mode=mode,roll=total),
             )
+            if expression == mode and details:
+                embed.set_footer(text="\n".join(details)[:2000])
             await interaction.response.send_message(embed=embed)
+        except DiceError as e:
+            embed = discord.Embed(
+                title="Error",
+                description=str(e),
+            )
+            if interaction.response.is_done():
+                await interaction.followup.send(embed=embed, ephemeral=True)
+            else:
+                await interaction.response.send_message(embed=embed,ephemeral=True)  # noqa: E501
         except Exception as e:
             logging.error(f"dice failed, \n{e}")
 async def setup(bot:commands.Bot):
@@ -1,48 +1,196 @@
-
-#TODO logic for all
+import asyncio
+import contextlib
+import logging
+import time
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
+from utils.configmanager import gconfig
+from utils.deadlines import DeadlineScheduler
+from utils.giveaways import MAX_WEIGHT, giveaways
+from utils.timeconverter import TimeConverter
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 2
+
+
+def parse_message_id(message:str) -> int:
+    '''Accepts message id or message link'''
+    message = message.strip().rstrip("/").split("/")[-1]
+    return int(message) if message.isdigit() else None
+
+def entry_weight(member:discord.Member) -> int:
+    '''Highest giveaway weight of members roles, 1 without any'''
+    weights = gconfig.config.get(str(member.guild.id), {}).get("GIVEAWAYS", {})
+    return max(
+        (int(weights[str(role.id)]) for role in member.roles if str(role.id) in weights),  # noqa: E501
+        default=1,
+    )
+
+def giveaway_embed(record:dict) -> discord.Embed:
+    embed = discord.Embed(
+        title = record["title"],
+        description = record["description"],
+        color = discord.Color.greyple() if record["ended"] else discord.Color.blurple(),  # noqa: E501
+    )
+    embed.add_field(
+        name="Winners",
+        value=str(record["winners"]),
+    )
+    if record["ended"]:
+        embed.add_field(
+            name="Won by",
+            value=", ".join(f"<@{user}>" for user in record["winner_ids"]) or "Nobody joined",  # noqa: E501
+            inline=False,
+        )
+        embed.set_footer(text="Giveaway ended")
+    else:
+        embed.add_field(
+            name="Ends",
+            value=f"<t:{record['ends_at']}:R>",
+        )
+    return embed
 
 class Giveaways(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.scheduler = DeadlineScheduler(self.end_giveaway, name="giveaways")
+        self.flusher = None
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                giveaways.flush_entrants()
+            except OSError as e:
+                logger.error(f"Saving giveaway entrants failed: {e}")
+
+    async def cog_load(self):
+        self.flusher = asyncio.create_task(self.flush_loop())
+        # Overdue ones fire right away, the rest sleep in one heap
+        for record in giveaways.running():
+            self.scheduler.schedule(record["message_id"], record["ends_at"])
+        self.scheduler.start()
+
+    async def cog_unload(self):
+        self.flusher.cancel()
+        await self.scheduler.stop()
+        giveaways.flush_entrants()
+
+    async def announce(self, record:dict, rerolled:list[int]=None):
+        channel = self.bot.get_channel(record["channel_id"])
+        if channel is None:
+            return
+        message = channel.get_partial_message(record["message_id"])
+        await message.edit(embed=giveaway_embed(record), view=None)
+        winners = rerolled or record["winner_ids"]
+        if winners:
+            mentions = ", ".join(f"<@{user}>" for user in winners)
+            text = "New winners" if rerolled else "Congratulations"
+            await message.reply(f"{text} {mentions}! You won **{record['title']}**!")  # noqa: E501
+        else:
+            await message.reply(f"Nobody joined **{record['title']}**, no winners.")  # noqa: E501
+
+    async def end_giveaway(self, message_id:int):
+        record = giveaways.get(message_id)
+        if record is None or record["ended"]:
+            return
+        giveaways.end(message_id, giveaways.draw(message_id, record["winners"]))
+        await self.announce(record)
 
     @app_commands.default_permissions(administrator=True)
     class giveaway(app_commands.Group):
-        def __init__(self):
+        def __init__(self, cog):
             super().__init__()
             self.name="giveaway"
             self.description="Giveaway commands"
+            self.giveaway_cog = cog
+
+        async def lookup(self, interaction:discord.Interaction, message:str) -> dict:  # noqa: E501
+            message_id = parse_message_id(message)
+            record = giveaways.get(message_id) if message_id else None
+            if record is None or record["guild_id"] != interaction.guild.id:
+                await interaction.response.send_message(
+                    content="Giveaway not found.",
+                    ephemeral=True,
+                )
+                return None
+            return record
 
         @app_commands.command(name="create", description="Create giveaway")
+        @app_commands.describe(duration="How long it runs (1h, 2d, 30m...)")
         async def giveaway_create(
             self,
             interaction:discord.Interaction,
             channel:discord.TextChannel,
-            duration:int,
-            winners:int,
+            duration:app_commands.Transform[str, TimeConverter],
+            winners:app_commands.Range[int, 1, 100],
             title:str,
             description:str,
         ):
-            view = Giveaways.giveaway_open()
-            await view.create(interaction,channel,title,description,winners)
+            if not duration:
+                return await interaction.response.send_message(
+                    content="Invalid duration, use something like 1h or 2d.",
+                    ephemeral=True,
+                )
+            ends_at = int(time.time()) + duration
+            preview = {
+                "title": title,
+                "description": description,
+                "winners": winners,
+                "ends_at": ends_at,
+                "ended": False,
+            }
+            message = await channel.send(
+                embed=giveaway_embed(preview),
+                view=Giveaways.giveaway_open(),
+            )
+            giveaways.create(
+                message.id,
+                interaction.guild.id,
+                channel.id,
+                interaction.user.id,
+                title,
+                description,
+                winners,
+                ends_at,
+            )
+            self.giveaway_cog.scheduler.schedule(message.id, ends_at)
             await interaction.response.send_message(
                 content="Giveaway created!",
                 ephemeral=True,
             )
 
         @app_commands.command(name="reroll",description="Rerolls user")
+        @app_commands.describe(message="Message id or link of giveaway")
         async def giveaway_reroll(
             self,
             interaction:discord.Interaction,
             message:str,
+            winners:app_commands.Range[int, 1, 100]=1,
         ):
-            pass
+            record = await self.lookup(interaction, message)
+            if record is None:
+                return
+            if not record["ended"]:
+                return await interaction.response.send_message(
+                    content="Giveaway is still running.",
+                    ephemeral=True,
+                )
+            new = giveaways.draw(record["message_id"], winners, exclude=set(record["winner_ids"]))  # noqa: E501
+            giveaways.end(record["message_id"], record["winner_ids"] + new)
+            await interaction.response.send_message(
+                content="Rerolled!" if new else "No entrants left to reroll.",
+                ephemeral=True,
+            )
+            if new:
+                await self.giveaway_cog.announce(record, rerolled=new)
 
         @app_commands.command(name="edit",description="Edits giveaway")
+        @app_commands.describe(message="Message id or link of giveaway")
         async def giveaway_edit(
             self,
             interaction:discord.Interaction,
@@ -50,56 +198,102 @@ class Giveaways(commands.Cog):
             title:str,
             description:str,
         ):
-            pass
+            record = await self.lookup(interaction, message)
+            if record is None:
+                return
+            record["title"] = title
+            record["description"] = description
+            giveaways.save(record)
+            channel = interaction.guild.get_channel(record["channel_id"])
+            if channel is not None:
+                await channel.get_partial_message(record["message_id"]).edit(
+                    embed=giveaway_embed(record),
+                )
+            await interaction.response.send_message(
+                content="Giveaway edited!",
+                ephemeral=True,
+            )
 
         @app_commands.command(name="remove",description="Removes giveaway.")
+        @app_commands.describe(message="Message id or link of giveaway")
         async def giveaway_remove(
             self,
             interaction:discord.Interaction,
             message:str,
         ):
-            pass
+            record = await self.lookup(interaction, message)
+            if record is None:
+                return
+            self.giveaway_cog.scheduler.cancel(record["message_id"])
+            giveaways.remove(record["message_id"])
+            channel = interaction.guild.get_channel(record["channel_id"])
+            if channel is not None:
+                with contextlib.suppress(discord.NotFound):
+                    await channel.get_partial_message(record["message_id"]).delete()
+            await interaction.response.send_message(
+                content="Giveaway removed!",
+                ephemeral=True,
+            )
+
+        @app_commands.command(name="weight",description="Extra entries for members with role")  # noqa: E501
+        @app_commands.describe(weight="Entries counted for role, 1 removes the bonus")  # noqa: E501
+        async def giveaway_weight(
+            self,
+            interaction:discord.Interaction,
+            role:discord.Role,
+            weight:app_commands.Range[int, 1, MAX_WEIGHT],
+        ):
+            if weight == 1:
+                gconfig.delete(interaction.guild.id, "GIVEAWAYS", str(role.id))
+            else:
+                gconfig.set(interaction.guild.id, "GIVEAWAYS", str(role.id), weight)
+            await interaction.response.send_message(
+                content=f"{role.mention} now counts as {weight} entries.",
+                ephemeral=True,
+            )
 
         @app_commands.command(name="list",description="Lists all running Giveaways.")  # noqa: E501
         async def giveaway_list(
             self,
             interaction:discord.Interaction,
         ):
-            pass
+            running = sorted(
+                giveaways.running(interaction.guild.id),
+                key=lambda record: record["ends_at"],
+            )
+            embed = discord.Embed(
+                title="Running giveaways",
+                description="\n".join(
+                    f"[{record['title']}](https://discord.com/channels/{record['guild_id']}/{record['channel_id']}/{record['message_id']}) - ends <t:{record['ends_at']}:R>"  # noqa: E501
+                    for record in running[:25]
+                ) or "No giveaways running.",
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
 
     class giveaway_open(discord.ui.View):
         def __init__(self) -> None:  # noqa: ANN101
             super().__init__(timeout = None)
 
-        async def create(
-            self,
-            interaction: discord.Interaction,
-            channel: discord.TextChannel,
-            title,
-            desc,
-            win,
-        ):
-            embed = discord.Embed(
-                title = title,
-                description = desc,
-            )
-            embed.add_field(
-                name="Winners",
-                value=str(win),
-            )
-            await channel.send(embed=embed, view=self)
-
         @discord.ui.button(
             label = "Join",
             style = discord.ButtonStyle.blurple,
             custom_id = "join",
         )
         async def join_giv(self,interaction: discord.Interaction, button: discord.Button): # noqa: E501
-            await interaction.response.send_message(content="Joined!",ephemeral=True)  # noqa: E501
+            record = giveaways.get(interaction.message.id)
+            if record is None or record["ended"]:
+                return await interaction.response.send_message(
+                    content="This giveaway has ended.",
+                    ephemeral=True,
+                )
+            if giveaways.join(record["message_id"], interaction.user.id, entry_weight(interaction.user)):  # noqa: E501
+                await interaction.response.send_message(content="Joined!",ephemeral=True)  # noqa: E501
+            else:
+                await interaction.response.send_message(content="You already joined!",ephemeral=True)  # noqa: E501
 
 
 async def setup(bot:commands.Bot):
-#    cog = Giveaways(bot)
-#    await bot.add_cog(cog)
-#    bot.tree.add_command(cog.giveaway())
-    pass
+    cog = Giveaways(bot)
+    await bot.add_cog(cog)
+    bot.tree.add_command(cog.giveaway(cog))
+    bot.add_view(Giveaways.giveaway_open())
@@ -1,9 +1,22 @@
+import asyncio
+import logging
+import random
+import time
+
 import discord
 from discord import app_commands
 from discord.ext import commands
 from PIL import Image, ImageDraw, ImageFont
 
 from utils.configmanager import gconfig
+from utils.leaderboard import GlobalLeaderboard
+from utils.level_rewards import LevelRewards
+from utils.levels import LevelStore
+
+logger = logging.getLogger(__name__)
+
+XP_COOLDOWN = 60
+FLUSH_INTERVAL = 60
 
 
 def profile_gen(interaction:discord.Interaction,bg:str):
@@ -45,10 +58,131 @@ def profile_gen(interaction:discord.Interaction,bg:str):
 class LevelSystem(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.store = LevelStore()
+        self.rewards = LevelRewards(bot, self.store)
+        self.leaderboard = GlobalLeaderboard(bot, self.store)
+        self.last_xp = {}
+        self.flusher = None
+
+    async def cog_load(self):
+        self.flusher = asyncio.create_task(self.flush_loop())
+        self.rewards.resume_all()
+        await self.leaderboard.start()
+
+    async def cog_unload(self):
+        self.flusher.cancel()
+        await self.leaderboard.stop()
+        await self.rewards.queue.stop()
+        await self.rewards.flush()
+        await self.store.flush()
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            # Cooldowns that ran out dont need to be remembered
+            cutoff = time.monotonic() - XP_COOLDOWN
+            self.last_xp = {key: at for key, at in self.last_xp.items() if at > cutoff}  # noqa: E501
+            try:
+                await self.store.flush()
+            except OSError as e:
+                logger.error(f"Saving levels failed: {e}")
+
+    @commands.Cog.listener("on_message")
+    async def give_xp(self, message:discord.Message):
+        if message.guild is None or message.author.bot:
+            return
+        key = (message.guild.id, message.author.id)
+        now = time.monotonic()
+        if now - self.last_xp.get(key, 0) < XP_COOLDOWN:
+            return
+        self.last_xp[key] = now
+        old, new = self.store.add(*key, random.randint(15, 25))  # noqa: S311
+        if new > old:
+            self.rewards.queue_levelup(message.author, new)
+
+    @app_commands.default_permissions(manage_roles=True)
+    class rewards_group(app_commands.Group):
+        def __init__(self, cog):
+            super().__init__()
+            self.name="levelrewards"
+            self.description="Roles given for reaching levels"
+            self.levels = cog
+
+        async def reconcile(self, interaction:discord.Interaction):
+            reporting = True
+
+            async def progress(done, total, changed):
+                # Reconciling goes on even when the message can't be
+                # edited anymore, e.g. after the token expired
+                nonlocal reporting
+                if not reporting:
+                    return
+                try:
+                    await interaction.edit_original_response(
+                        content=f"Syncing reward roles... {done}/{total} members, {changed} changed",  # noqa: E501
+                    )
+                except discord.HTTPException as e:
+                    logger.debug(f"Stopped reporting reconcile progress: {e}")
+                    reporting = False
+            self.levels.rewards.start_reconcile(interaction.guild, progress)
+
+        @app_commands.command(name="add",description="Give role at level")
+        async def rewards_add(self, interaction:discord.Interaction, level:int, role:discord.Role):  # noqa: E501
+            if role >= interaction.guild.me.top_role:
+                return await interaction.response.send_message(
+                    "I can't give this role due to role hierarchy",
+                    ephemeral=True,
+                )
+            self.levels.rewards.set_threshold(interaction.guild.id, level, role.id)
+            await interaction.response.send_message(
+                f"{role.mention} will be given at level {level}",
+                ephemeral=True,
+            )
+            await self.reconcile(interaction)
+
+        @app_commands.command(name="remove",description="Remove reward of level")
+        async def rewards_remove(self, interaction:discord.Interaction, level:int):
+            self.levels.rewards.remove_threshold(interaction.guild.id, level)
+            await interaction.response.send_message(
+                f"Removed reward of level {level}",
+                ephemeral=True,
+            )
+            await self.reconcile(interaction)
+
+        @app_commands.command(name="list",description="List level rewards")
+        async def rewards_list(self, interaction:discord.Interaction):
+            thresholds = self.levels.rewards.thresholds(interaction.guild.id)
+            embed = discord.Embed(
+                title="Level rewards",
+                description="\n".join(
+                    f"Level {level}: <@&{role}>"
+                    for level, role in sorted(thresholds.items())
+                ) or "No rewards set",
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+
+        @app_commands.command(name="sync",description="Fix reward roles of all members")  # noqa: E501
+        async def rewards_sync(self, interaction:discord.Interaction):
+            await interaction.response.send_message(
+                "Syncing reward roles...",
+                ephemeral=True,
+            )
+            await self.reconcile(interaction)
 
     @app_commands.command(name="global-leaderboard",description="Level Leaderboard")
     async def global_leaderboard(self,interaction:discord.Interaction):
-        pass
+        ranking = self.leaderboard.top(10)
+        embed = discord.Embed(
+            title="Global Leaderboard",
+            description="\n".join(
+                f"**{place}.** <@{user}> - {xp} XP"
+                for place, (user, xp) in enumerate(ranking, start=1)
+            ) or "Nobody has XP yet",
+        )
+        await interaction.response.send_message(
+            embed=embed,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
 
     @app_commands.command(name="leaderboard",description="Server Leaderboard")
     async def leaderboard(self, interaction:discord.Interaction):
@@ -70,3 +204,4 @@ class LevelSystem(commands.Cog):
 async def setup(bot:commands.Bot):
     cog = LevelSystem(bot)
     await bot.add_cog(cog)
+    bot.tree.add_command(cog.rewards_group(cog))
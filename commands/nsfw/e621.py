@@ -1,12 +1,86 @@
+import asyncio
 import random
 
 import discord
-import requests
 from discord import app_commands
 from discord.ext import commands
 
 from utils.autocomplete import autocomplete_tags
+from utils.http import http
+from utils.respcache import ResponseCache
 
+PAGE_SIZE = 100
+# Next page is fetched when the viewer gets this close to the end
+PREFETCH_AT = 10
+# Records a view keeps, older ones are dropped as pages are added
+MAX_RETAINED = 300
+VIEW_TIMEOUT = 600
+
+# Same tags asked seconds apart share one upstream request
+posts_cache = ResponseCache("e621_posts", ttl=60, stale=600, max_bytes=4 * 1024 * 1024)  # noqa: E501
+
+def normalize_query(web:str, tags:str) -> tuple[str, str]:
+    '''Cache key: base url and sorted, deduplicated tags'''
+    web = web.strip().rstrip("/")
+    if not web.startswith("http"):
+        web = "https://" + web
+    words = tags.replace("+", " ").lower().split()
+    return web, "+".join(sorted(set(words)))
+
+class Post:
+
+    '''
+    What create_embed needs of an e621 post, nothing else
+    '''
+
+    __slots__ = ("id", "artists", "url", "kind")
+
+    def __init__(self, id:int, artists:tuple, url:str):
+        self.id = id
+        self.artists = artists
+        self.url = url
+        if url.endswith((".mp4", ".webm")):
+            self.kind = "video"
+        elif url.endswith(".swf"):
+            self.kind = "flash"
+        else:
+            self.kind = "image"
+
+def compact_post(post:dict) -> Post | None:
+    url = post.get("file", {}).get("url")
+    if not url:
+        # Deleted or login-only posts have no file url
+        return None
+    return Post(post["id"], tuple(post.get("tags", {}).get("artist", ())), url)
+
+async def fetch_posts(web:str, tags:str, before:int=None) -> list[Post]:
+    url = f"{web}/posts.json?limit={PAGE_SIZE}"
+    if tags != "":
+        url += f"&tags={tags}"
+    if before is not None:
+        url += f"&page=b{before}"
+    data = await http.get_json(url)
+    return [post for post in map(compact_post, data["posts"]) if post]
+
+def load_page(web:str, tags:str, before:int=None):
+    return posts_cache.get(
+        (web, tags, before),
+        lambda: fetch_posts(web, tags, before),
+    )
+
+def create_embed(post:Post) -> tuple[discord.Embed, str | None]:
+    embed = discord.Embed(
+        title=f"Post {post.id}, by {', '.join(post.artists)}",
+    )
+    video_url = None
+    if post.kind == "video":
+        video_url = post.url
+        embed.description = f"[Click here to view the video]({video_url})"  # Add video link to description  # noqa: E501
+    elif post.kind == "flash":
+        embed.description = "Flash files are no longer supported!"
+    else:
+        embed.set_image(url=post.url)
+    return embed, video_url
 
 class E6_commands(commands.Cog):
     def __init__(self, bot):
@@ -26,22 +100,10 @@ class E6_commands(commands.Cog):
         @app_commands.autocomplete(tags=autocomplete_tags)
         async def e6_random_post(self,interaction:discord.Interaction,tags:str="",web:str="https://e621.net"):
             try:
-                tags = tags.replace(" ","+")
-                if web.endswith("/"):
-                    web[:-1]
-                if not web.startswith("http"):
-                    web = "https://" + web
-                url = f"{web}/posts.json?limit=100"
-                if tags != "":
-                    url += f"&tags={tags}"
-                response = requests.get(
-                    url,
-                    timeout=60,
-                    headers={"User-Agent": "Lorelei-bot"},
-                )
-                data = response.json()
-                if not data["posts"]:
-                    if tags is not None:
+                web, tags = normalize_query(web, tags)
+                posts = await load_page(web, tags)
+                if not posts:
+                    if tags:
                         await interaction.response.send_message(
                             content=f"No images found for these tags: {tags}",
                         )
@@ -49,38 +111,68 @@ class E6_commands(commands.Cog):
                         await interaction.response.send_message(
                         content="No image found.",
                     )
-                #post = random.choice(data["posts"]) # noqa: S311
-
-                posts = data["posts"]
+                    return
                 current_index = random.randint(0, len(posts) - 1)  # Start with a random post  # noqa: E501, S311
 
-                embed, video_url = self.create_embed(posts[current_index])
-                await interaction.response.send_message(
-                    embed=embed,
-                    view=E6_commands.e6_view(posts, current_index),
-                )
+                embed, video_url = create_embed(posts[current_index])
+                view = E6_commands.e6_view(web, tags, posts, current_index)
+                await interaction.response.send_message(embed=embed, view=view)
             except Exception as e:
                 await interaction.response.send_message(content=f"Exception: {e}")
 
-        def create_embed(self, post):
-            embed = discord.Embed(
-                title=f"Post {post['id']}, by {', '.join(post['tags']['artist'])}",
-            )
-            video_url = None
-            if post["file"]["url"].endswith((".mp4", ".webm")):  # If the file is a video  # noqa: E501
-                video_url = post["file"]["url"]
-                embed.description = f"[Click here to view the video]({video_url})"  # Add video link to description  # noqa: E501
-            elif post["file"]["url"].endswith(".swf"):
-                embed.description = "Flash files are no longer supported!"
-            else:
-                embed.set_image(url=post["file"]["url"])
-            return embed, video_url
-
     class e6_view(discord.ui.View):
-        def __init__(self, posts, index):
-            super().__init__()
-            self.posts = posts
+
+        '''
+        Pages through search results
+
+        Holds compact records only, fetches the page after the last
+        post in the background when the viewer gets near the end and
+        forgets the oldest records past MAX_RETAINED.
+        '''
+
+        def __init__(self, web, tags, posts, index):
+            super().__init__(timeout=VIEW_TIMEOUT)
+            self.web = web
+            self.tags = tags
+            self.posts = list(posts)
             self.index = index
+            self.exhausted = len(posts) < PAGE_SIZE
+            self.prefetch = None
+            self._maybe_prefetch()
+
+        def _maybe_prefetch(self):
+            near_end = self.index >= len(self.posts) - PREFETCH_AT
+            if near_end and not self.exhausted and self.prefetch is None:
+                self.prefetch = asyncio.create_task(
+                    load_page(self.web, self.tags, before=self.posts[-1].id),
+                )
+
+        async def _take_prefetch(self, wait:float) -> bool:
+            '''Appends the prefetched page, True when posts were added'''
+            if self.prefetch is None:
+                return False
+            try:
+                page = await asyncio.wait_for(asyncio.shield(self.prefetch), wait)
+            except asyncio.TimeoutError:
+                return False
+            except Exception:
+                # Try again on the next click
+                self.prefetch = None
+                return False
+            self.prefetch = None
+            if len(page) < PAGE_SIZE:
+                self.exhausted = True
+            self.posts.extend(page)
+            overflow = len(self.posts) - MAX_RETAINED
+            if overflow > 0:
+                del self.posts[:overflow]
+                self.index -= overflow
+            return bool(page)
+
+        async def on_timeout(self):
+            if self.prefetch is not None:
+                self.prefetch.cancel()
+            self.posts.clear()
 
         @discord.ui.button(label="Previous", custom_id="prev", style=discord.ButtonStyle.primary)  # noqa: E501
         async def prev(self, interaction: discord.Interaction, button: discord.ui.Button):  # noqa: E501
@@ -89,12 +181,19 @@ class E6_commands(commands.Cog):
 
         @discord.ui.button(label="Next", custom_id="next", style=discord.ButtonStyle.primary)  # noqa: E501
         async def next(self, interaction: discord.Interaction, button: discord.ui.Button):  # noqa: E501
-            self.index = (self.index + 1) % len(self.posts)
+            if self.index + 1 >= len(self.posts):
+                # Out of posts, give the prefetch a moment before wrapping
+                if not await self._take_prefetch(wait=2.0):
+                    self.index = -1
+            elif self.prefetch is not None and self.prefetch.done():
+                await self._take_prefetch(wait=0)
+            self.index += 1
+            self._maybe_prefetch()
             await self.update_embed(interaction)
 
         async def update_embed(self, interaction: discord.Interaction):
             post = self.posts[self.index]
-            embed, video_url = E6_commands.e6_commands.create_embed(self, post)
+            embed, video_url = create_embed(post)
             await interaction.response.edit_message(embed=embed, view=self)  # noqa: E501
 
 async def setup(bot: commands.Bot):
@@ -1,24 +1,26 @@
-import random
-
 import discord
-import requests
 from discord import app_commands
 from discord.ext import commands
 
+from utils.post_pool import PostPool
+
+HOT_URL = 'https://www.reddit.com/r/nsfw/hot/.json'
+irl_pool = PostPool("reddit_irl_pool", HOT_URL)
 
-def get_nsfw_post() -> str:
-    url = 'https://www.reddit.com/r/nsfw/hot/.json'
-    headers = {'User-Agent': 'Lorelei-bot'}
-    response = requests.get(url, headers=headers,timeout=60)
-    data = response.json()
-    posts = data['data']['children']
-    post = random.choice(posts)['data']  # noqa: S311
-    return post['url']
+def get_nsfw_post() -> str | None:
+    '''Random image from the pool, no request on the command path'''
+    return irl_pool.pick()
 
 class NSFW(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        irl_pool.start()
+
+    async def cog_unload(self):
+        await irl_pool.stop()
+
     class nsfw(app_commands.Group):
         def __init__(self):
             super().__init__()
@@ -29,6 +31,11 @@ class NSFW(commands.Cog):
         @app_commands.command(name="irl",description="IRL photos",nsfw=True)
         async def irl(self,interaction:discord.Interaction):
             data = get_nsfw_post()
+            if data is None:
+                return await interaction.response.send_message(
+                    content="No images loaded yet, try again in a moment.",
+                    ephemeral=True,
+                )
             embed = discord.Embed(
                 color=discord.Color.blurple(),
                 title="IRL NSFW Image",
@@ -1,13 +1,28 @@
+import logging
+
 import discord
 from discord import app_commands
 from discord.ext import commands
 
 import config
-import utils.cosita_toolkit as ctkit
 from utils.configmanager import lang, uconfig
+from utils.http import HttpError, http
+
+logger = logging.getLogger(__name__)
 
 mowner,mrepo = config.repository.split("/")
-def info_text_gen(userid):
+
+async def get_repo_contributors(owner:str, repo:str) -> list:
+    '''Async take on ctkit.GithubApi.get_repo_contributors'''
+    url = f"https://api.github.com/repos/{owner}/{repo}/contributors"
+    try:
+        contributors = await http.get_json(url)
+    except HttpError as e:
+        logger.warning(f"Failed to fetch contributors: {e}")
+        return []
+    return [contributor['login'] for contributor in contributors]
+
+async def info_text_gen(userid):
     info_text_raw = lang.get(
         uconfig.get(
             userid,
@@ -18,7 +33,7 @@ def info_text_gen(userid):
         "info_text_raw",
     )
 
-    contributors = ctkit.GithubApi.get_repo_contributors(owner=mowner,repo=mrepo)
+    contributors = await get_repo_contributors(owner=mowner,repo=mrepo)
     contributors = [
         contributor for contributor in contributors if contributor != mowner
     ]
@@ -38,7 +53,7 @@ class Info(commands.Cog):
         '''
         embed = discord.Embed(
             title="Lorelei-bot",
-            description=info_text_gen(userid=interaction.user.id),
+            description=await info_text_gen(userid=interaction.user.id),
             color=discord.colour.Color.blurple(),
         )
 
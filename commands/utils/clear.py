@@ -1,50 +1,85 @@
+import datetime
+import logging
+import time
+
 import discord
 from discord import app_commands
 from discord.ext import commands
 
+from utils.purge import Purge, make_predicate
+
+logger = logging.getLogger(__name__)
+
+# Interaction tokens expire after 15 minutes, keep some margin
+TOKEN_LIFETIME = datetime.timedelta(minutes=14)
 
 class Clear(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
     @app_commands.command(name="clear", description="Clear n messages specific user")  # noqa: E501
+    @app_commands.describe(
+        amount="How many matching messages to delete",
+        member="Only messages of this member",
+        contains="Only messages containing this text",
+        attachments="Only messages with attachments",
+        bots="Only messages of bots",
+    )
     @app_commands.default_permissions(manage_messages=True)
-    async def clear(interaction: discord.Interaction, amount:int, member: discord.Member = None):  # noqa: E501
+    async def clear(
+        self,
+        interaction: discord.Interaction,
+        amount:app_commands.Range[int, 1, 1000],
+        member: discord.Member = None,
+        contains: str = None,
+        attachments: bool = False,
+        bots: bool = False,
+    ):
+        # Ephemeral, so the response itself is not in the scanned history
+        await interaction.response.defer(ephemeral=True)
+        remaining = interaction.created_at + TOKEN_LIFETIME - discord.utils.utcnow()
+        purge = Purge(
+            interaction.channel,
+            make_predicate(member, contains, attachments, bots),
+            amount,
+            deadline=time.monotonic() + remaining.total_seconds(),
+        )
+
+        async def status(text:str):
+            await interaction.edit_original_response(content=text)
+
         try:
-            await interaction.response.defer()
-            channel = interaction.channel
-
-            if member is None:
-                await channel.purge(limit=amount)
-                await interaction.followup.send(
-                    embed=discord.Embed(
-                        description=f"Successfully deleted {amount} messages.",
-                        color=discord.Color.green(),
-                    ),
-                )
-
-            elif member is not None:
-                await channel.purge(limit=amount)
-                await interaction.followup.send(
-                    embed=discord.Embed(
-                        description=f"Successfully deleted {amount} messages from {member.name}",  # noqa: E501
-                        color=discord.Color.green(),
-                    ),
-                )
-            else:
-                await interaction.followup.send(
-                    content="INTERACTION FAILED",
-                    ephemeral=True,
-                )
-        except discord.errors.NotFound:
-            await interaction.followup.send(
-                content="Removed all that we could, but exception happened",
+            await purge.run(status)
+        except discord.Forbidden:
+            return await interaction.followup.send(
+                content="I dont have permissions to delete messages here",
+                ephemeral=True,
             )
-        except Exception as e:
-            await interaction.followup.send(
+        except discord.HTTPException as e:
+            return await interaction.followup.send(
                 content=f"Clear failed!: {e}",
                 ephemeral=True,
             )
 
+        description = f"Successfully deleted {purge.deleted} messages"
+        if member is not None:
+            description += f" from {member.name}"
+        if purge.skipped:
+            description += f", {purge.skipped} old ones left, run it again"
+        embed = discord.Embed(
+            description=description + f" (scanned {purge.scanned})",
+            color=discord.Color.green(),
+        )
+        try:
+            await interaction.edit_original_response(content=None, embed=embed)
+        except discord.HTTPException as e:
+            # Token is gone, tell the channel instead
+            logger.debug(f"Clear result edit failed: {e}")
+            await interaction.channel.send(
+                content=interaction.user.mention,
+                embed=embed,
+                delete_after=30,
+            )
+
 async def setup(bot:commands.Bot):
     await bot.add_cog(Clear(bot))
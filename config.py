@@ -49,6 +49,22 @@ helper = True
 #
 # Helper port, default 9920
 helperport = 9920
+########## Leaderboard ############
+#
+# Only used when shards are split over
+# several processes: one coordinator
+# merges XP the others publish to it.
+# None = the process running shard 0,
+# True/False forces it per process
+# Default = None
+leaderboard_coordinator = None
+#
+# Coordinator port, default 9921
+leaderboard_port = 9921
+#
+# Publish interval in seconds, default 30
+leaderboard_interval = 30
+###################################
 ############# Shards ##############
 #
 # How many Shards to use?
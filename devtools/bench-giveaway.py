@@ -0,0 +1,53 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.giveaways import Entrants  # noqa: E402
+
+
+@click.command()
+@click.option("--joins", default=100000, help="Entrants joining")
+@click.option("--winners", default=10, help="Winners to draw")
+@click.option("--weighted", is_flag=True, help="Give a tenth of entrants weight 5")
+def main(joins, winners, weighted):
+    """Measure joins, persistence and winner draws of one giveaway."""
+    path = os.path.join(tempfile.mkdtemp(), "bench.entrants")
+    entrants = Entrants(path)
+    ids = [random.getrandbits(63) for _ in range(joins)]  # noqa: S311
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for index, user_id in enumerate(ids):
+        entrants.add(user_id, 5 if weighted and index % 10 == 0 else 1)
+        # duplicate click
+        entrants.add(user_id)
+        if index % 1000 == 0:
+            entrants.flush()
+    entrants.flush()
+    took = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    click.echo(f"{joins} joins (+{joins} duplicates): {took * 1000:.0f}ms, {took / joins * 1e6:.2f}us/join")  # noqa: E501
+    click.echo(f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB, file: {os.path.getsize(path) / 1024:.0f} KiB")  # noqa: E501
+
+    started = time.perf_counter()
+    drawn = entrants.draw(winners)
+    click.echo(f"Draw of {len(drawn)}: {(time.perf_counter() - started) * 1e6:.0f}us")  # noqa: E501
+
+    started = time.perf_counter()
+    rerolled = entrants.draw(winners, exclude=set(drawn))
+    click.echo(f"Reroll of {len(rerolled)}: {(time.perf_counter() - started) * 1e6:.0f}us")  # noqa: E501
+
+    started = time.perf_counter()
+    reloaded = Entrants(path)
+    click.echo(f"Reload of {len(reloaded)}: {(time.perf_counter() - started) * 1000:.0f}ms")  # noqa: E501
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.transcripts import PAGE_SIZE, TranscriptService  # noqa: E402
+
+
+class FakeAuthor:
+    def __init__(self, index):
+        self.id = index
+
+    def __str__(self):
+        return f"user{self.id}"
+
+
+class FakeMessage:
+    def __init__(self, index):
+        self.id = index
+        self.author = FakeAuthor(index % 7)
+        self.reference = None
+        self.attachments = []
+        self.embeds = []
+        self.created_at = datetime(2024, 1, 1) + timedelta(seconds=index)
+        self.edited_at = None if index % 5 else self.created_at
+        self.clean_content = f"message number {index} " + "lorem ipsum " * 8
+
+
+class FakeChannel:
+    def __init__(self, count, latency):
+        self.id = 0
+        self.name = "ticket-bench"
+        self.count = count
+        self.latency = latency
+        self.pages = 0
+
+    async def history(self, limit, after=None, oldest_first=True):
+        start = 0 if after is None else after.id + 1
+        self.pages += 1
+        await asyncio.sleep(self.latency)
+        for index in range(start, min(start + limit, self.count)):
+            yield FakeMessage(index)
+
+
+async def run(count, latency, compress):
+    service = TranscriptService(cache_dir=tempfile.gettempdir())
+    channel = FakeChannel(count, latency)
+    tracemalloc.start()
+    started = time.perf_counter()
+    async with service.transcript(channel, "bench", compress) as path:
+        took = time.perf_counter() - started
+        size = os.path.getsize(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    click.echo(f"{count} messages, {channel.pages} pages of {PAGE_SIZE}")
+    click.echo(f"Time to transcript: {took:.2f}s ({took / channel.pages * 1000:.1f}ms/page)")  # noqa: E501
+    click.echo(f"File size: {size / 1024:.0f} KiB, peak traced memory: {peak / 1024:.0f} KiB")  # noqa: E501
+
+@click.command()
+@click.option("--messages", default=10000, help="Messages in the fake ticket")
+@click.option("--latency", default=0.0, help="Simulated seconds per history page")  # noqa: E501
+@click.option("--gzip", "compress", is_flag=True, help="Compress the transcript")
+def main(messages, latency, compress):
+    """Measure time-to-transcript of a generated ticket."""
+    asyncio.run(run(messages, latency, compress))
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,10 @@ def send_command(command:str):
             client.sendall(command.encode('utf-8'))
             if command.startswith("reload_all"):
                 logging.info("Please wait, this may take a minute or two...")
-            response = client.recv(1024).decode('utf-8')
+            chunks = []
+            while chunk := client.recv(4096):
+                chunks.append(chunk)
+            response = b"".join(chunks).decode('utf-8')
             logging.info(response)
 
     except ConnectionRefusedError:
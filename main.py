@@ -22,6 +22,8 @@ import discord.ext.commands
 import config
 import utils.profiler as profiler
 from utils.configmanager import lang
+from utils.http import http
+from utils.metrics import metrics
 
 ############################### Logging ############################################
 
@@ -152,6 +154,9 @@ async def handle_command(command,bot):  # noqa: C901
             else:
                 return "Unknown profiler action."
 
+    elif command.startswith("metrics"):
+        return metrics.render()
+
     elif command.startswith("kill"):
         logger.info("Killing from helper")
         sys.exit()
@@ -207,6 +212,13 @@ class aclient(discord.ext.commands.AutoShardedBot):
         self.synced = False
         self.shard_count = shard_count
 
+    async def setup_hook(self) -> None:
+        await http.start()
+
+    async def close(self) -> None:
+        await super().close()
+        await http.close()
+
     async def on_ready(self) -> None:
 
         await self.wait_until_ready()
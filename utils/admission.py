@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+
+import discord
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    pass
+
+class AdmissionQueue:
+
+    '''
+    Per-guild FIFO with bounded concurrency
+
+    Burst of requests in one guild is served in order, at most
+    `concurrency` at once and spaced by `interval`, instead of all
+    hitting the same REST route together.
+    '''
+
+    def __init__(self, name:str, concurrency:int=2, interval:float=1.0):
+        self.name = name
+        self.concurrency = concurrency
+        self.interval = interval
+        self.waiting = defaultdict(deque)
+        self.active = defaultdict(int)
+        self.keys = defaultdict(set)
+        self.next_start = defaultdict(float)
+        self.admitted = metrics.counter(f"{name}_admitted_total", "Jobs that finished")  # noqa: E501
+        self.rejected = metrics.counter(f"{name}_rejected_total", "Jobs refused by limits")  # noqa: E501
+        self.failed = metrics.counter(f"{name}_failed_total", "Jobs that raised")
+        self.wait_time = metrics.histogram(f"{name}_wait_seconds", help="Time spent queued")  # noqa: E501
+        self.run_time = metrics.histogram(f"{name}_run_seconds", help="Time spent running")  # noqa: E501
+        metrics.gauge(f"{name}_depth", self.depth, "Jobs waiting in all guilds")
+
+    def depth(self) -> int:
+        return sum(len(waiting) for waiting in self.waiting.values())
+
+    def pending(self, guild_id:int) -> int:
+        '''Waiting and running jobs of guild'''
+        return len(self.waiting[guild_id]) + self.active[guild_id]
+
+    def queued(self, guild_id:int, key) -> bool:
+        return key in self.keys[guild_id]
+
+    async def submit(self, guild_id:int, key, job, limit:int=None, on_queued=None):  # noqa: E501
+        '''
+        Runs job() in the guild lane and returns its result
+
+        Raises QueueFull when `limit` jobs are already pending in guild.
+        on_queued(position) is awaited once if the job has to wait, a
+        failed position update does not stop the job.
+        '''
+        if limit is not None and self.pending(guild_id) >= limit:
+            self.rejected.inc()
+            raise QueueFull(self.pending(guild_id))
+        future = asyncio.get_running_loop().create_future()
+        entry = (job, future, time.monotonic())
+        self.waiting[guild_id].append(entry)
+        self.keys[guild_id].add(key)
+        try:
+            self._pump(guild_id)
+            if on_queued is not None and entry in self.waiting[guild_id]:
+                try:
+                    await on_queued(self.waiting[guild_id].index(entry) + 1)
+                except discord.HTTPException as e:
+                    logger.debug(f"{self.name}: queue position update failed: {e}")  # noqa: E501
+            return await future
+        finally:
+            self.keys[guild_id].discard(key)
+
+    def _pump(self, guild_id:int):
+        waiting = self.waiting[guild_id]
+        while waiting and self.active[guild_id] < self.concurrency:
+            job, future, queued_at = waiting.popleft()
+            self.active[guild_id] += 1
+            asyncio.create_task(self._run(guild_id, job, future, queued_at))
+
+    async def _run(self, guild_id:int, job, future, queued_at:float):
+        try:
+            now = time.monotonic()
+            start = max(now, self.next_start[guild_id])
+            self.next_start[guild_id] = start + self.interval
+            await asyncio.sleep(start - now)
+            self.wait_time.observe(time.monotonic() - queued_at)
+            started = time.monotonic()
+            result = await job()
+            self.run_time.observe(time.monotonic() - started)
+            self.admitted.inc()
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            self.failed.inc()
+            logger.warning(f"{self.name}: job in guild {guild_id} failed: {e}")
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self.active[guild_id] -= 1
+            self._pump(guild_id)
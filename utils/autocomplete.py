@@ -3,20 +3,14 @@ import os
 from typing import List
 
 import discord
-import requests
 from discord import app_commands
 
 from utils.dices import dices
+from utils.tag_suggest import tag_suggester
 
 
 async def fetch_tags(query):
-    headers = {
-        'User-Agent': 'Lorelei-bot/1.0 (by cosita3cz on e621)',
-    }
-    response = requests.get(f'https://e621.net/tags.json?search[name_matches]={query}*&search[order]=count&limit=20',timeout=60,headers=headers)
-    if response.status_code == 200:  # noqa: PLR2004
-        return [tag['name'] for tag in response.json()]
-    return []
+    return await tag_suggester.suggest(query)
 
 async def autocomplete_color(interaction: discord.Interaction,current: str) -> List[app_commands.Choice[str]]:  # noqa: E501
     colors = ['Blurple', 'Red', 'Green', 'Blue', 'Yellow',"Purple","White"]
@@ -75,7 +69,8 @@ async def autocomplete_tags(interaction: discord.Interaction, current: str):
                     ),
                 )
 
-        return choices
+        # Discord takes at most 25 choices of up to 100 characters
+        return [choice for choice in choices if len(choice.value) <= 100][:25]  # noqa: PLR2004
     except Exception as e:
         logging.warning(f"Autocomplete tags failed! {e}")
         return [
@@ -0,0 +1,220 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+FONTS_DIR = "data/fonts"
+# No 0/O, 1/I/L lookalikes
+ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+LENGTH = 5
+SIZE = (220, 80)
+CHALLENGE_TTL = 120
+MAX_ATTEMPTS = 3
+SWEEP_AT = 1000
+
+_fonts = None
+_random = random.SystemRandom()
+
+def _load_fonts():
+    '''Maps every character to the bundled fonts that can draw it'''
+    global _fonts
+    _fonts = {char: [] for char in ALPHABET}
+    for name in sorted(os.listdir(FONTS_DIR)):
+        if not name.endswith(".ttf"):
+            continue
+        font = ImageFont.truetype(os.path.join(FONTS_DIR, name), 42)
+        for char in ALPHABET:
+            # Freedom.ttf has no digits
+            if font.getmask(char).getbbox() is not None:
+                _fonts[char].append(font)
+
+def render(text:str) -> bytes:
+    '''PNG captcha of text, distorted enough to bother OCR'''
+    if _fonts is None:
+        _load_fonts()
+    image = Image.new("RGB", SIZE, (235, 235, 240))
+    draw = ImageDraw.Draw(image)
+    width, height = SIZE
+    for _ in range(6):
+        draw.line(
+            [(_random.randint(0, width), _random.randint(0, height)) for _ in range(2)],  # noqa: E501
+            fill=tuple(_random.randint(90, 200) for _ in range(3)),
+            width=2,
+        )
+    step = (width - 20) // len(text)
+    for i, char in enumerate(text):
+        glyph = Image.new("RGBA", (step + 20, height), (0, 0, 0, 0))
+        ImageDraw.Draw(glyph).text(
+            (10, 10),
+            char,
+            font=_random.choice(_fonts[char]),
+            fill=tuple(_random.randint(0, 110) for _ in range(3)),
+        )
+        glyph = glyph.rotate(_random.uniform(-30, 30), resample=Image.BICUBIC)
+        image.paste(glyph, (10 + i * step + _random.randint(-4, 4), _random.randint(-8, 4)), glyph)  # noqa: E501
+    for _ in range(width * height // 40):
+        draw.point(
+            (_random.randrange(width), _random.randrange(height)),
+            fill=tuple(_random.randint(60, 220) for _ in range(3)),
+        )
+    image = image.filter(ImageFilter.SMOOTH)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=False)
+    return buffer.getvalue()
+
+def render_batch(count:int) -> list[tuple[str, bytes]]:
+    '''Runs in a worker process, returns (answer, png) pairs'''
+    batch = []
+    for _ in range(count):
+        text = "".join(_random.choice(ALPHABET) for _ in range(LENGTH))
+        batch.append((text, render(text)))
+    return batch
+
+class CaptchaPool:
+
+    '''
+    Ready-made captchas rendered in worker processes
+
+    Verification takes from the pool and only waits for a render when
+    it runs dry; a refill task keeps it topped up in batches.
+    '''
+
+    def __init__(self, size:int=64, workers:int=2, batch:int=8):
+        self.size = size
+        self.workers = workers
+        self.batch = batch
+        self.ready = deque()
+        self.executor = None
+        self.refill_task = None
+        self.hits = metrics.counter("captcha_pool_hits_total", "Captchas served from the pool")  # noqa: E501
+        self.misses = metrics.counter("captcha_pool_misses_total", "Captchas rendered on demand")  # noqa: E501
+        self.rendered = metrics.counter("captcha_rendered_total", "Captchas rendered")  # noqa: E501
+        self.render_time = metrics.histogram("captcha_render_batch_seconds", help="Time to render one batch")  # noqa: E501
+        metrics.gauge("captcha_pool_ready", lambda: len(self.ready), "Captchas waiting in the pool")  # noqa: E501
+        metrics.gauge("captcha_pool_hit_ratio", self.hit_ratio, "Share of captchas served from the pool")  # noqa: E501
+
+    def hit_ratio(self) -> float:
+        total = self.hits.value + self.misses.value
+        return self.hits.value / total if total else 0.0
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # Forking a process with live threads and sockets is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        self._refill()
+
+    async def stop(self):
+        if self.refill_task is not None:
+            self.refill_task.cancel()
+            self.refill_task = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def _render(self, count:int) -> list[tuple[str, bytes]]:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        batch = await loop.run_in_executor(self.executor, render_batch, count)
+        self.render_time.observe(time.perf_counter() - started)
+        self.rendered.inc(len(batch))
+        return batch
+
+    def _refill(self):
+        if self.refill_task is None or self.refill_task.done():
+            self.refill_task = asyncio.create_task(self._refill_loop())
+
+    async def _refill_loop(self):
+        while len(self.ready) < self.size:
+            # One batch per worker in flight, never past the pool size
+            missing = self.size - len(self.ready)
+            counts = []
+            while missing > 0 and len(counts) < self.workers:
+                counts.append(min(self.batch, missing))
+                missing -= counts[-1]
+            jobs = [self._render(count) for count in counts]
+            try:
+                for batch in await asyncio.gather(*jobs):
+                    self.ready.extend(batch)
+            except Exception as e:
+                logger.error(f"Rendering captchas failed: {e}")
+                return
+
+    async def take(self) -> tuple[str, bytes]:
+        '''Returns (answer, png)'''
+        if self.executor is None:
+            self.start()
+        if self.ready:
+            self.hits.inc()
+            captcha = self.ready.popleft()
+        else:
+            self.misses.inc()
+            captcha = (await self._render(1))[0]
+        if len(self.ready) < self.size // 2:
+            self._refill()
+        return captcha
+
+class Challenges:
+
+    '''
+    Pending captcha answers per (guild, user), valid for CHALLENGE_TTL
+    '''
+
+    def __init__(self, ttl:int=CHALLENGE_TTL, attempts:int=MAX_ATTEMPTS):
+        self.ttl = ttl
+        self.attempts = attempts
+        self.pending = {}
+        self.sweep_at = SWEEP_AT
+
+    def _sweep(self, now:float):
+        expired = [key for key, (_, expires, _) in self.pending.items() if expires <= now]  # noqa: E501
+        for key in expired:
+            del self.pending[key]
+        # Raids keep many challenges alive, dont rescan on every issue
+        self.sweep_at = max(SWEEP_AT, len(self.pending) * 2)
+
+    def issue(self, guild_id:int, user_id:int, answer:str) -> float:
+        '''Stores a new challenge, replacing the old one, returns its expiry'''
+        now = time.monotonic()
+        if len(self.pending) > self.sweep_at:
+            self._sweep(now)
+        self.pending[(guild_id, user_id)] = (answer, now + self.ttl, self.attempts)
+        return now + self.ttl
+
+    def check(self, guild_id:int, user_id:int, answer:str) -> bool | None:
+        '''
+        True when answer is right, False when wrong and None when there
+        is no live challenge (expired or out of attempts)
+        '''
+        key = (guild_id, user_id)
+        challenge = self.pending.get(key)
+        if challenge is None:
+            return None
+        expected, expires, attempts = challenge
+        if expires <= time.monotonic():
+            del self.pending[key]
+            return None
+        if answer.strip().upper() == expected:
+            del self.pending[key]
+            return True
+        if attempts <= 1:
+            del self.pending[key]
+        else:
+            self.pending[key] = (expected, expires, attempts - 1)
+        return False
+
+captcha_pool = CaptchaPool()
+challenges = Challenges()
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.tempbans import MODERATION_DIR
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join(MODERATION_DIR, "cases.db")
+PAGE_SIZE = 10
+
+SCHEMA = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS cases (
+    guild_id INTEGER NOT NULL,
+    case_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    target_id INTEGER NOT NULL,
+    moderator_id INTEGER NOT NULL,
+    reason TEXT,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, case_id)
+);
+CREATE INDEX IF NOT EXISTS cases_target ON cases (guild_id, target_id, case_id);
+CREATE INDEX IF NOT EXISTS cases_moderator
+    ON cases (guild_id, moderator_id, created_at);
+"""
+
+COLUMNS = "case_id, action, target_id, moderator_id, reason, created_at"
+
+class CaseStore:
+
+    '''
+    Moderation case log
+
+    Case numbers are handed out in memory per guild and the rows are
+    written in batches by one writer task. SQLite is only touched from
+    a dedicated thread; history is paged with keyset cursors, so the
+    cost of a page does not depend on how deep it is.
+    '''
+
+    def __init__(self, path:str=DB_PATH):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cases")  # noqa: E501
+        self.db = None
+        self.last_case = {}
+        self.queue = None
+        self.task = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _connect(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.executescript(SCHEMA)
+        return self.db
+
+    def _last_case(self, guild_id:int) -> int:
+        row = self._connect().execute(
+            "SELECT MAX(case_id) FROM cases WHERE guild_id = ?", (guild_id,),
+        ).fetchone()
+        return row[0] or 0
+
+    def _insert(self, rows:list):
+        db = self._connect()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?, ?, ?, ?)", rows)  # noqa: E501
+
+    async def record(
+        self,
+        guild_id:int,
+        action:str,
+        target_id:int,
+        moderator_id:int,
+        reason:str=None,
+    ) -> int:
+        '''Queues a new case and returns its number'''
+        if guild_id not in self.last_case:
+            last = await self._run(self._last_case, guild_id)
+            self.last_case.setdefault(guild_id, last)
+        self.last_case[guild_id] += 1
+        case_id = self.last_case[guild_id]
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._writer())
+        self.queue.put_nowait((
+            guild_id, case_id, action, target_id, moderator_id, reason, int(time.time()),  # noqa: E501
+        ))
+        return case_id
+
+    async def _writer(self):
+        while True:
+            rows = [await self.queue.get()]
+            while not self.queue.empty():
+                rows.append(self.queue.get_nowait())
+            try:
+                await self._run(self._insert, rows)
+            except sqlite3.Error as e:
+                logger.error(f"Writing {len(rows)} cases failed: {e}")
+            finally:
+                for _ in rows:
+                    self.queue.task_done()
+
+    async def flush(self):
+        if self.queue is not None:
+            await self.queue.join()
+
+    def _history(self, guild_id, target, moderator, cursor, limit):
+        db = self._connect()
+        if target is not None:
+            sql = f"SELECT {COLUMNS} FROM cases WHERE guild_id = ? AND target_id = ?"  # noqa: S608, E501
+            params = [guild_id, target]
+            if moderator is not None:
+                sql += " AND moderator_id = ?"
+                params.append(moderator)
+            if cursor is not None:
+                sql += " AND case_id < ?"
+                params.append(cursor[1])
+            sql += " ORDER BY case_id DESC LIMIT ?"
+        else:
+            sql = f"SELECT {COLUMNS} FROM cases WHERE guild_id = ? AND moderator_id = ?"  # noqa: S608, E501
+            params = [guild_id, moderator]
+            if cursor is not None:
+                sql += " AND (created_at, case_id) < (?, ?)"
+                params.extend(cursor)
+            sql += " ORDER BY created_at DESC, case_id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = db.execute(sql, params).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    async def history(
+        self,
+        guild_id:int,
+        target:int=None,
+        moderator:int=None,
+        cursor:tuple=None,
+        limit:int=PAGE_SIZE,
+    ) -> tuple[list, bool]:
+        '''
+        One page of cases against target and/or by moderator, newest first
+
+        cursor is (created_at, case_id) of the last row of the previous
+        page. Returns the rows and whether another page exists.
+        '''
+        await self.flush()
+        return await self._run(self._history, guild_id, target, moderator, cursor, limit)  # noqa: E501
+
+cases = CaseStore()
@@ -0,0 +1,76 @@
+import asyncio
+import contextlib
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class DeadlineScheduler:
+
+    '''
+    Runs handler(key) when the deadline of key passes
+
+    All deadlines share one min-heap and one task that sleeps until the
+    earliest of them, so pending jobs cost a heap entry each instead of
+    a sleeping task. Rescheduled or cancelled keys leave stale heap
+    entries that are skipped when popped. Deadlines that passed while
+    the bot was offline fire right after start.
+    '''
+
+    def __init__(self, handler, concurrency:int=4, name:str="scheduler"):
+        self.handler = handler
+        self.name = name
+        self.deadlines = {}
+        self.heap = []
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.running = set()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def schedule(self, key, when:float):
+        self.deadlines[key] = when
+        heapq.heappush(self.heap, (when, key))
+        if self.heap[0][1] == key:
+            self.wakeup.set()
+
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+
+    def next_deadline(self) -> float:
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    async def _loop(self):
+        while True:
+            self.wakeup.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else deadline - time.time()
+            if timeout is None or timeout > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                continue
+            _, key = heapq.heappop(self.heap)
+            del self.deadlines[key]
+            task = asyncio.create_task(self._fire(key))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _fire(self, key):
+        async with self.semaphore:
+            try:
+                await self.handler(key)
+            except Exception as e:
+                logger.error(f"{self.name}: job {key} failed: {e}")
@@ -1,3 +1,8 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
 dices = {
     "classic (D6)":[1,6],
     "triangle (D4)":[1,4],
@@ -6,3 +11,182 @@ dices = {
     "DnD dice (D20)":[1,20],
     "0-10":[0,10],
 }
+
+MAX_DICE = 100_000
+MAX_SIDES = 1_000_000
+MAX_TERMS = 20
+# Rerolls of one exploding die before it stops
+MAX_EXPLOSIONS = 100
+STATS_TRIALS = 1_000_000
+# Dice rolled by a stats run in total and per numpy call
+STATS_BUDGET = 50_000_000
+CHUNK_SIZE = 4_000_000
+SHOWN_DICE = 20
+MAX_BINS = 20
+
+TERM_RE = re.compile(
+    r"([+-])?\s*(?:(\d*)d(\d+|%)(!)?(?:(kh|kl|dh|dl)(\d+))?|(\d+))",
+    re.IGNORECASE,
+)
+
+class DiceError(Exception):
+    pass
+
+def mode_expression(min_val:int, max_val:int) -> str:
+    '''Expression rolling uniformly between min_val and max_val'''
+    offset = min_val - 1
+    expression = f"1d{max_val - offset}"
+    if offset:
+        expression += f"{offset:+d}"
+    return expression
+
+def _dice_term(sign, count, sides, explode, keep, keep_count) -> tuple:
+    count = int(count) if count else 1
+    sides = 100 if sides == "%" else int(sides)
+    if not 1 <= count <= MAX_DICE or not 1 <= sides <= MAX_SIDES:
+        raise DiceError(f"Use 1-{MAX_DICE} dice with 1-{MAX_SIDES} sides")
+    if explode and sides == 1:
+        raise DiceError("A one sided die can't explode")
+    if keep:
+        keep_count = int(keep_count)
+        if keep_count > count:
+            raise DiceError(f"Can't keep or drop {keep_count} of {count} dice")
+        # Dropping the lowest n is keeping the highest count - n
+        if keep[0] == "d":
+            keep = ("l" if keep[1] == "h" else "h", count - keep_count)
+        else:
+            keep = (keep[1], keep_count)
+    return ("dice", sign, count, sides, bool(explode), keep or None)
+
+@lru_cache(maxsize=1024)
+def parse(expression:str) -> tuple:
+    '''
+    Parses "8d6+3", "4d6kh3", "2d10!" into a tuple of terms
+
+    Terms are ("dice", sign, count, sides, explode, keep), keep being
+    ("h" or "l", n) or None, and ("const", sign, value).
+    '''
+    text = expression.replace(" ", "").lower()
+    if not text:
+        raise DiceError("Empty expression")
+    terms = []
+    position = 0
+    total_dice = 0
+    while position < len(text):
+        match = TERM_RE.match(text, position)
+        if match is None or (terms and not match.group(1)):
+            raise DiceError(f"Can't read `{text[position:]}`")
+        sign = -1 if match.group(1) == "-" else 1
+        *dice, constant = match.groups()[1:]
+        if constant is not None:
+            terms.append(("const", sign, int(constant)))
+        else:
+            terms.append(_dice_term(sign, *dice))
+            total_dice += terms[-1][2]
+        position = match.end()
+    if len(terms) > MAX_TERMS or total_dice > MAX_DICE:
+        raise DiceError(f"At most {MAX_TERMS} terms and {MAX_DICE} dice")
+    return tuple(terms)
+
+def dice_per_trial(terms:tuple) -> int:
+    return sum(term[2] for term in terms if term[0] == "dice")
+
+def _roll(rng, trials:int, count:int, sides:int, explode:bool, keep) -> np.ndarray:  # noqa: E501
+    '''Sum of one dice term for every trial'''
+    rolls = rng.integers(1, sides + 1, size=(trials, count), dtype=np.int64)
+    if explode:
+        # Compounding: a max roll adds another roll to the same die
+        live = rolls == sides
+        for _ in range(MAX_EXPLOSIONS):
+            if not live.any():
+                break
+            extra = rng.integers(1, sides + 1, size=int(live.sum()), dtype=np.int64)  # noqa: E501
+            rolls[live] += extra
+            live[live] = extra == sides
+    if keep is not None:
+        side, n = keep
+        if n == 0:
+            return np.zeros(trials, dtype=np.int64)
+        if side == "h":
+            rolls = np.partition(rolls, count - n, axis=1)[:, count - n:]
+        else:
+            rolls = np.partition(rolls, n - 1, axis=1)[:, :n]
+    return rolls.sum(axis=1)
+
+def evaluate(terms:tuple, trials:int=1, rng=None) -> np.ndarray:
+    '''Totals of `trials` independent rolls of the expression'''
+    rng = rng or np.random.default_rng()
+    totals = np.zeros(trials, dtype=np.int64)
+    for kind, sign, *term in terms:
+        if kind == "const":
+            totals += sign * term[0]
+        else:
+            count, sides, explode, keep = term
+            totals += sign * _roll(rng, trials, count, sides, explode, keep)
+    return totals
+
+def roll(expression:str) -> tuple[int, list[str]]:
+    '''
+    Rolls expression once
+
+    Returns the total and a short breakdown per dice term; single
+    terms with many dice only show their sum.
+    '''
+    terms = parse(expression)
+    rng = np.random.default_rng()
+    total = 0
+    details = []
+    for kind, sign, *term in terms:
+        if kind == "const":
+            total += sign * term[0]
+            continue
+        count, sides, explode, keep = term
+        if count <= SHOWN_DICE and keep is None and not explode:
+            rolls = rng.integers(1, sides + 1, size=count)
+            value = int(rolls.sum())
+            details.append(f"{count}d{sides}: {', '.join(map(str, rolls))}")
+        else:
+            value = int(_roll(rng, 1, count, sides, explode, keep)[0])
+            details.append(f"{count}d{sides}: {value}")
+        total += sign * value
+    return total, details
+
+def stats(expression:str, trials:int=STATS_TRIALS, bins:int=12) -> dict:
+    '''
+    Simulates expression `trials` times
+
+    Trials are capped so the run rolls at most STATS_BUDGET dice and
+    are evaluated in chunks to bound memory.
+    '''
+    terms = parse(expression)
+    per_trial = max(dice_per_trial(terms), 1)
+    trials = max(1, min(trials, STATS_BUDGET // per_trial))
+    chunk = max(1, CHUNK_SIZE // per_trial)
+    rng = np.random.default_rng()
+    totals = np.concatenate([
+        evaluate(terms, min(chunk, trials - start), rng)
+        for start in range(0, trials, chunk)
+    ])
+    low, high = int(totals.min()), int(totals.max())
+    # One bin per value when they fit, otherwise equal integer ranges
+    if high - low < MAX_BINS:
+        edges = np.arange(low, high + 2)
+    else:
+        edges = np.linspace(low, high + 1, bins + 1)
+    counts, edges = np.histogram(totals, bins=edges)
+    return {
+        "trials": trials,
+        "mean": float(totals.mean()),
+        "std": float(totals.std()),
+        "min": low,
+        "max": high,
+        "percentiles": dict(zip(
+            (5, 25, 50, 75, 95),
+            (float(p) for p in np.percentile(totals, (5, 25, 50, 75, 95))),
+            strict=True,
+        )),
+        "histogram": [
+            (int(np.ceil(start)), int(np.ceil(end)) - 1, int(count))
+            for start, end, count in zip(edges[:-1], edges[1:], counts, strict=True)  # noqa: E501
+        ],
+    }
@@ -0,0 +1,226 @@
+import heapq
+import logging
+import os
+import random
+import struct
+import time
+from array import array
+from collections import defaultdict
+
+import toml
+
+logger = logging.getLogger(__name__)
+
+GIVEAWAYS_DIR = "data/giveaways"
+# user id, weight
+ENTRANT = struct.Struct("<QB")
+MAX_WEIGHT = 255
+
+class Entrants:
+
+    '''
+    Entrants of one giveaway
+
+    Ids live in an array('Q') with weights in a parallel array('B'), and
+    a set answers "already joined?" in O(1). Joins are buffered and
+    appended to data/giveaways/<message_id>.entrants by flush(), the
+    file is never rewritten.
+    '''
+
+    def __init__(self, path:str):
+        self.path = path
+        self.ids = array("Q")
+        self.weights = array("B")
+        self.members = set()
+        self.max_weight = 1
+        self.pending = bytearray()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        usable = len(data) - len(data) % ENTRANT.size
+        for user_id, weight in ENTRANT.iter_unpack(data[:usable]):
+            self._add(user_id, weight)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, user_id:int):
+        return user_id in self.members
+
+    def _add(self, user_id:int, weight:int) -> bool:
+        if user_id in self.members:
+            return False
+        self.members.add(user_id)
+        self.ids.append(user_id)
+        self.weights.append(weight)
+        self.max_weight = max(self.max_weight, weight)
+        return True
+
+    def add(self, user_id:int, weight:int=1) -> bool:
+        weight = max(1, min(weight, MAX_WEIGHT))
+        if not self._add(user_id, weight):
+            return False
+        self.pending += ENTRANT.pack(user_id, weight)
+        return True
+
+    def flush(self):
+        if self.pending:
+            with open(self.path, "ab") as f:
+                f.write(self.pending)
+            self.pending = bytearray()
+
+    def draw(self, count:int, exclude=frozenset(), rng=random) -> list[int]:
+        '''
+        Picks up to count distinct winners, weighted by entrant weight
+
+        Random indexes are accepted with probability weight/max_weight,
+        so k winners take O(k) tries while entrants far outnumber them.
+        If too many tries get rejected it falls back to one O(n) pass.
+        '''
+        excluded = sum(1 for user in exclude if user in self.members)
+        target = min(count, len(self.ids) - excluded)
+        winners = []
+        chosen = set()
+        tries = 0
+        budget = 32 * (target + 1) * self.max_weight
+        while len(winners) < target and tries < budget:
+            tries += 1
+            index = rng.randrange(len(self.ids))
+            user = self.ids[index]
+            if user in chosen or user in exclude:
+                continue
+            if rng.random() * self.max_weight >= self.weights[index]:
+                continue
+            chosen.add(user)
+            winners.append(user)
+        if len(winners) < target:
+            # Efraimidis-Spirakis keys over whatever is left
+            left = (
+                (rng.random() ** (1 / weight), user)
+                for user, weight in zip(self.ids, self.weights, strict=True)
+                if user not in chosen and user not in exclude
+            )
+            winners += [user for _, user in heapq.nlargest(target - len(winners), left)]  # noqa: E501
+        return winners
+
+class GiveawayStore:
+
+    '''
+    Giveaway records, one data/giveaways/<message_id>.toml each
+
+    Records are loaded once on startup and written on every change, a
+    giveaway only changes on create, edit and end.
+    '''
+
+    def __init__(self, directory:str=GIVEAWAYS_DIR):
+        self.directory = directory
+        self.giveaways = {}
+        self.by_guild = defaultdict(set)
+        self.entrants = {}
+        self._load_all()
+
+    def _path(self, message_id:int) -> str:
+        return os.path.join(self.directory, f"{message_id}.toml")
+
+    def _load_all(self):
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".toml"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), encoding="utf-8") as f:  # noqa: E501
+                    record = toml.load(f)
+                self._index(record)
+            except (toml.TomlDecodeError, KeyError) as e:
+                logger.warning(f"Giveaway {filename} is broken, skipping: {e}")
+        logger.debug(f"Loaded {len(self.giveaways)} giveaways")
+
+    def _index(self, record:dict):
+        if "entrants" in record:
+            # Records from before entrants had their own file
+            entrants = self.get_entrants(record["message_id"])
+            for user_id in record.pop("entrants"):
+                entrants.add(user_id)
+            entrants.flush()
+            self.giveaways[record["message_id"]] = record
+            self.save(record)
+        self.giveaways[record["message_id"]] = record
+        self.by_guild[record["guild_id"]].add(record["message_id"])
+
+    def save(self, record:dict):
+        self._index(record)
+        path = self._path(record["message_id"])
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            toml.dump(record, f)
+        os.replace(path + ".tmp", path)
+
+    def create(self, message_id, guild_id, channel_id, host_id, title, description, winners, ends_at) -> dict:  # noqa: E501
+        record = {
+            "message_id": message_id,
+            "guild_id": guild_id,
+            "channel_id": channel_id,
+            "host_id": host_id,
+            "title": title,
+            "description": description,
+            "winners": winners,
+            "ends_at": int(ends_at),
+            "ended": False,
+            "winner_ids": [],
+        }
+        self.save(record)
+        return record
+
+    def get(self, message_id:int) -> dict:
+        return self.giveaways.get(message_id)
+
+    def remove(self, message_id:int):
+        record = self.giveaways.pop(message_id, None)
+        if record is not None:
+            self.by_guild[record["guild_id"]].discard(message_id)
+            os.remove(self._path(message_id))
+        self.entrants.pop(message_id, None)
+        if os.path.exists(self._entrants_path(message_id)):
+            os.remove(self._entrants_path(message_id))
+
+    def _entrants_path(self, message_id:int) -> str:
+        return os.path.join(self.directory, f"{message_id}.entrants")
+
+    def get_entrants(self, message_id:int) -> Entrants:
+        '''Entrants are loaded from disk on first use'''
+        entrants = self.entrants.get(message_id)
+        if entrants is None:
+            entrants = self.entrants[message_id] = Entrants(self._entrants_path(message_id))  # noqa: E501
+        return entrants
+
+    def flush_entrants(self):
+        for entrants in self.entrants.values():
+            entrants.flush()
+
+    def running(self, guild_id:int=None) -> list[dict]:
+        ids = self.by_guild.get(guild_id, ()) if guild_id else self.giveaways
+        return [
+            self.giveaways[message_id] for message_id in ids
+            if not self.giveaways[message_id]["ended"]
+        ]
+
+    def join(self, message_id:int, user_id:int, weight:int=1) -> bool:
+        return self.get_entrants(message_id).add(user_id, weight)
+
+    def draw(self, message_id:int, count:int, exclude=frozenset()) -> list[int]:
+        return self.get_entrants(message_id).draw(count, exclude)
+
+    def end(self, message_id:int, winner_ids:list[int]):
+        entrants = self.entrants.pop(message_id, None)
+        if entrants is not None:
+            entrants.flush()
+        record = self.giveaways[message_id]
+        record["ended"] = True
+        record["ended_at"] = int(time.time())
+        record["winner_ids"] = winner_ids
+        self.save(record)
+
+giveaways = GiveawayStore()
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Lorelei-bot/1.0 (by cosita3cz on e621)"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Per host: concurrent requests, total timeout, retries, body size cap
+DEFAULT_POLICY = {"concurrency": 4, "timeout": 15, "retries": 2, "max_bytes": 5 * 1024 * 1024}  # noqa: E501
+HOST_POLICIES = {
+    # e621 asks API users to stay around 2 requests per second
+    "e621.net": {"concurrency": 2, "timeout": 10},
+    "www.reddit.com": {"concurrency": 2, "timeout": 10},
+    "api.github.com": {"concurrency": 2, "timeout": 10, "retries": 1},
+}
+
+class HttpError(Exception):
+    def __init__(self, url:str, status:int=None, reason:str=""):
+        super().__init__(f"{url}: {status or ''} {reason}".strip())
+        self.url = url
+        self.status = status
+
+class Response:
+    __slots__ = ("status", "headers", "body", "url")
+
+    def __init__(self, status:int, headers, body:bytes, url:str):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    def json(self):
+        return json.loads(self.body)
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+class HostStats:
+    def __init__(self, host:str):
+        name = "http_" + re.sub(r"\W", "_", host)
+        self.latency = metrics.histogram(f"{name}_seconds", help=f"Request latency to {host}")  # noqa: E501
+        self.requests = metrics.counter(f"{name}_requests_total", f"Requests to {host}")  # noqa: E501
+        self.errors = metrics.counter(f"{name}_errors_total", f"Failed requests to {host}")  # noqa: E501
+        self.retries = metrics.counter(f"{name}_retries_total", f"Retried requests to {host}")  # noqa: E501
+
+class HttpClient:
+
+    '''
+    Shared outbound HTTP client
+
+    One aiohttp session for the whole bot, opened in setup_hook and
+    closed with the bot. Every host gets its own slot of the connection
+    pool, a concurrency limit, timeout, retry count and body size cap
+    from HOST_POLICIES. Failed requests are retried with jittered
+    exponential backoff, honouring Retry-After.
+    '''
+
+    def __init__(self):
+        self.session = None
+        self.limits = {}
+        self.stats = {}
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=64, limit_per_host=8, ttl_dns_cache=300),  # noqa: E501
+                headers={"User-Agent": USER_AGENT},
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def policy(self, host:str) -> dict:
+        return {**DEFAULT_POLICY, **HOST_POLICIES.get(host, {})}
+
+    def _host(self, host:str) -> tuple[asyncio.Semaphore, HostStats]:
+        if host not in self.limits:
+            self.limits[host] = asyncio.Semaphore(self.policy(host)["concurrency"])
+            self.stats[host] = HostStats(host)
+        return self.limits[host], self.stats[host]
+
+    async def _read(self, response, url:str, max_bytes:int) -> bytes:
+        if (response.content_length or 0) > max_bytes:
+            raise HttpError(url, response.status, "response too large")
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            body += chunk
+            if len(body) > max_bytes:
+                raise HttpError(url, response.status, "response too large")
+        return bytes(body)
+
+    async def request(self, method:str, url:str, **options) -> Response:
+        '''
+        Sends request and returns the whole response
+
+        Accepts aiohttp request arguments plus `timeout`, `retries` and
+        `max_bytes` overriding the host policy. Responses with a 4xx
+        status are returned, HttpError is raised once retries run out.
+        '''
+        if self.session is None:
+            await self.start()
+        host = urlsplit(url).hostname or ""
+        policy = self.policy(host)
+        timeout = aiohttp.ClientTimeout(total=options.pop("timeout", policy["timeout"]))  # noqa: E501
+        retries = options.pop("retries", policy["retries"])
+        max_bytes = options.pop("max_bytes", policy["max_bytes"])
+        limit, stats = self._host(host)
+        for attempt in range(retries + 1):
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                async with limit, self.session.request(method, url, timeout=timeout, **options) as response:  # noqa: E501
+                    body = await self._read(response, url, max_bytes)
+                    stats.requests.inc()
+                    stats.latency.observe(time.perf_counter() - started)
+                    if response.status not in RETRY_STATUSES:
+                        return Response(response.status, response.headers, body, url)  # noqa: E501
+                    error = HttpError(url, response.status)
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = HttpError(url, reason=str(e) or type(e).__name__)
+            stats.errors.inc()
+            if attempt == retries:
+                break
+            stats.retries.inc()
+            delay = random.uniform(0, 0.5 * 2 ** attempt)  # noqa: S311
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, min(int(retry_after), 30))
+            logger.debug(f"{method} {url} failed ({error}), retrying in {delay:.2f}s")  # noqa: E501
+            await asyncio.sleep(delay)
+        raise error
+
+    async def get(self, url:str, **options) -> Response:
+        return await self.request("GET", url, **options)
+
+    async def get_json(self, url:str, **options):
+        '''GET that raises HttpError unless the answer is 200 with JSON'''
+        response = await self.get(url, **options)
+        if response.status != 200:  # noqa: PLR2004
+            raise HttpError(url, response.status)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise HttpError(url, response.status, "invalid JSON") from e
+
+http = HttpClient()
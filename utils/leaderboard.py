@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import json
+import logging
+import time
+
+import config
+from utils.levels import LevelStore
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_TOP = 100
+SHARD_TOP = 25
+# Contributions of processes silent for this many publish intervals go
+STALE_INTERVALS = 5
+
+class GlobalIndex:
+
+    '''
+    Merged XP of all shard processes
+
+    Keeps contributions per process, keyed by the shards it runs, so a
+    process that reconnects or restarts and sends a fresh snapshot
+    replaces its old numbers instead of doubling them. Processes that
+    stop reporting are dropped by expire(). The top GLOBAL_TOP users are kept ranked incrementally, queries
+    only slice the ready list.
+    '''
+
+    def __init__(self, size:int=GLOBAL_TOP):
+        self.size = size
+        self.totals = {}
+        self.contributions = {}
+        self.shard_tops = {}
+        self.seen = {}
+        self._top = {}
+        self.ranking = []
+
+    def apply(self, proc:str, delta:dict[int, int], reset:bool=False, top=None):
+        self.seen[proc] = time.monotonic()
+        contrib = self.contributions.setdefault(proc, {})
+        if reset:
+            self._subtract(contrib)
+            contrib.clear()
+        for user, xp in delta.items():
+            contrib[user] = contrib.get(user, 0) + xp
+            self.totals[user] = self.totals.get(user, 0) + xp
+        if top is not None:
+            self.shard_tops[proc] = top
+
+        if reset:
+            self._rebuild()
+        else:
+            # XP only grows between resets, so only touched users can move
+            for user in delta:
+                self._offer(user)
+            self._rank()
+
+    def _subtract(self, contrib:dict):
+        for user, xp in contrib.items():
+            self.totals[user] -= xp
+            if not self.totals[user]:
+                del self.totals[user]
+
+    def expire(self, max_age:float):
+        '''Drops contributions of processes that did not report lately'''
+        cutoff = time.monotonic() - max_age
+        stale = [proc for proc, seen in self.seen.items() if seen < cutoff]
+        for proc in stale:
+            logger.info(f"Dropping leaderboard contributions of silent {proc}")
+            self._subtract(self.contributions.pop(proc, {}))
+            self.shard_tops.pop(proc, None)
+            del self.seen[proc]
+        if stale:
+            self._rebuild()
+
+    def _offer(self, user:int):
+        total = self.totals[user]
+        if user in self._top or len(self._top) < self.size:
+            self._top[user] = total
+            return
+        lowest = min(self._top, key=self._top.get)
+        if total > self._top[lowest]:
+            del self._top[lowest]
+            self._top[user] = total
+
+    def _rebuild(self):
+        self._top = dict(heapq.nlargest(
+            self.size,
+            self.totals.items(),
+            key=lambda item: item[1],
+        ))
+        self._rank()
+
+    def _rank(self):
+        self.ranking = sorted(self._top.items(), key=lambda item: item[1], reverse=True)  # noqa: E501
+
+    def top(self, n:int=10) -> list[tuple[int, int]]:
+        return self.ranking[:n]
+
+class GlobalLeaderboard:
+
+    '''
+    Publishes XP of this process and serves the global ranking
+
+    A process that runs every shard (bot.shard_ids is None, the normal
+    single AutoShardedBot setup) merges in-process and opens no socket.
+    When shards are split across processes, the coordinator listens on
+    localhost and merges what the others send into GlobalIndex; every
+    publish is answered with the current global top. The coordinator is
+    the process running shard 0 unless config.leaderboard_coordinator
+    says otherwise. Each process only publishes guilds it is connected
+    to, data files of other processes' guilds are ignored.
+    '''
+
+    def __init__(self, bot, store:LevelStore, proc:str=None):
+        self.bot = bot
+        self.store = store
+        # Stable across restarts, a restarted process replaces its numbers
+        self.proc = proc or (
+            "shards-" + ",".join(map(str, sorted(bot.shard_ids)))
+            if bot.shard_ids is not None else "all"
+        )
+        self.standalone = bot.shard_ids is None
+        if self.standalone:
+            self.coordinator = True
+        elif config.leaderboard_coordinator is None:
+            self.coordinator = 0 in bot.shard_ids
+        else:
+            self.coordinator = bool(config.leaderboard_coordinator)
+        self.index = GlobalIndex() if self.coordinator else None
+        self.local = {}
+        self.ranking = []
+        self.server = None
+        self.tasks = []
+
+    async def start(self):
+        '''Raises OSError when the coordinator port can not be bound'''
+        if self.coordinator and not self.standalone:
+            try:
+                self.server = await asyncio.start_server(
+                    self._handle_shard,
+                    "localhost",
+                    config.leaderboard_port,
+                )
+            except OSError as e:
+                logger.error(f"Leaderboard coordinator can't bind port {config.leaderboard_port}, is another process coordinating? {e}")  # noqa: E501
+                raise
+            logger.info(f"Leaderboard coordinator running on port {config.leaderboard_port}")  # noqa: E501
+        self.tasks.append(asyncio.create_task(self._publish_loop()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def top(self, n:int=10) -> list[tuple[int, int]]:
+        if self.index is not None:
+            return self.index.top(n)
+        return self.ranking[:n]
+
+    def _summary(self, reset:bool) -> dict:
+        if reset:
+            # XP is only earned in guilds we are connected to, so after
+            # the snapshot the deltas stay inside them too
+            self.store.take_deltas()
+            self.local = self.store.totals_for(guild.id for guild in self.bot.guilds)  # noqa: E501
+            delta = dict(self.local)
+        else:
+            delta = self.store.take_deltas()
+            for user, xp in delta.items():
+                self.local[user] = self.local.get(user, 0) + xp
+        return {
+            "proc": self.proc,
+            "reset": reset,
+            "top": heapq.nlargest(SHARD_TOP, self.local.items(), key=lambda item: item[1]),  # noqa: E501
+            "delta": {str(user): xp for user, xp in delta.items()},
+        }
+
+    ########################### Coordinator ############################
+
+    def _merge(self, message:dict):
+        self.index.apply(
+            message["proc"],
+            {int(user): xp for user, xp in message["delta"].items()},
+            reset=message.get("reset", False),
+            top=message.get("top"),
+        )
+
+    async def _handle_shard(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                self._merge(json.loads(line))
+                writer.write(json.dumps({"top": self.index.top(GLOBAL_TOP)}).encode() + b"\n")  # noqa: E501
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError, KeyError) as e:
+            logger.warning(f"Leaderboard shard connection dropped: {e}")
+        finally:
+            writer.close()
+
+    ############################ Publisher #############################
+
+    async def _publish_loop(self):
+        reset = True
+        writer = None
+        while True:
+            try:
+                if self.coordinator:
+                    self._merge(self._summary(reset))
+                    self.index.expire(config.leaderboard_interval * STALE_INTERVALS)
+                else:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(
+                            "localhost",
+                            config.leaderboard_port,
+                        )
+                        reset = True
+                    writer.write(json.dumps(self._summary(reset)).encode() + b"\n")  # noqa: E501
+                    await writer.drain()
+                    reply = json.loads(await reader.readline())
+                    self.ranking = [tuple(entry) for entry in reply["top"]]
+                reset = False
+            except (OSError, json.JSONDecodeError) as e:
+                logger.debug(f"Leaderboard publish failed, reconnecting: {e}")
+                if writer is not None:
+                    writer.close()
+                writer = None
+            await asyncio.sleep(config.leaderboard_interval)
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+
+import discord
+import toml
+
+from utils.configmanager import gconfig
+from utils.levels import LEVELS_DIR, LevelStore
+from utils.workqueue import CoalescingQueue
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = os.path.join(LEVELS_DIR, "reconcile.toml")
+RECONCILE_CHUNK = 100
+RECONCILE_CONCURRENCY = 4
+
+class LevelRewards:
+
+    '''
+    Role rewards for reaching levels
+
+    Thresholds live in the guild config under [LEVELREWARDS] as
+    level = role_id. Level-ups are queued per member and coalesced, so a
+    member jumping several levels gets one role edit. reconcile() diffs
+    the expected roles of every member against the real ones after
+    thresholds change, and keeps a checkpoint so it resumes after restart.
+    Roles of removed or replaced thresholds are kept in the checkpoint as
+    retired until the reconcile finishes, so it strips them too.
+    '''
+
+    def __init__(self, bot, store:LevelStore):
+        self.bot = bot
+        self.store = store
+        self.queue = CoalescingQueue(
+            self._apply,
+            workers=2,
+            interval=0.25,
+            merge=max,
+            name="level-rewards",
+        )
+        self.running = {}
+        self.retired = {}
+        self.checkpoints = self._load_checkpoints()
+        self.saves = CoalescingQueue(
+            self._write_checkpoints,
+            workers=1,
+            name="reconcile-checkpoints",
+        )
+
+    ############################ Thresholds ############################
+
+    def thresholds(self, guild_id:int) -> dict[int, int]:
+        section = gconfig.config.get(str(guild_id), {}).get("LEVELREWARDS", {})
+        return {int(level): int(role) for level, role in section.items()}
+
+    def set_threshold(self, guild_id:int, level:int, role_id:int):
+        self._retire(guild_id, level)
+        gconfig.set(guild_id, "LEVELREWARDS", str(level), role_id)
+
+    def remove_threshold(self, guild_id:int, level:int):
+        self._retire(guild_id, level)
+        gconfig.delete(guild_id, "LEVELREWARDS", str(level))
+
+    def _retire(self, guild_id:int, level:int):
+        '''Remembers the old role of level for the next reconcile'''
+        old = self.thresholds(guild_id).get(level)
+        if old is not None:
+            self.retired.setdefault(guild_id, set()).add(old)
+
+    def expected_roles(self, thresholds:dict[int, int], level:int) -> set[int]:
+        return {role for needed, role in thresholds.items() if level >= needed}
+
+    ############################ Level-ups #############################
+
+    def queue_levelup(self, member:discord.Member, level:int):
+        if self.thresholds(member.guild.id):
+            self.queue.push((member.guild.id, member.id), level)
+
+    async def _apply(self, key, level):
+        guild_id, user_id = key
+        guild = self.bot.get_guild(guild_id)
+        member = guild.get_member(user_id) if guild else None
+        if member is None:
+            return
+        await self._sync_member(member, self.thresholds(guild_id), level)
+
+    async def _sync_member(self, member:discord.Member, thresholds, level, retired=()) -> bool:  # noqa: E501
+        managed = set(thresholds.values()) | set(retired)
+        expected = self.expected_roles(thresholds, level)
+        actual = {role.id for role in member.roles} & managed
+        if actual == expected:
+            return False
+        roles = [
+            role for role in member.roles
+            if not role.is_default() and (role.id not in managed or role.id in expected)  # noqa: E501
+        ]
+        for role_id in expected - actual:
+            role = member.guild.get_role(role_id)
+            if role is not None:
+                roles.append(role)
+        # One PATCH for all additions and removals
+        await member.edit(roles=roles, reason="Level rewards")
+        return True
+
+    ########################### Reconciler #############################
+
+    def _load_checkpoints(self) -> dict:
+        try:
+            with open(CHECKPOINT_FILE, encoding="utf-8") as f:
+                return toml.load(f)
+        except FileNotFoundError:
+            return {}
+        except toml.TomlDecodeError as e:
+            logger.warning(f"Broken reconcile checkpoint, starting over: {e}")
+            return {}
+
+    def _save_checkpoints(self):
+        self.saves.push("checkpoints")
+
+    async def _write_checkpoints(self, key, payload):
+        # Copy on the loop, reconciles keep updating their state
+        data = {guild: dict(state) for guild, state in self.checkpoints.items()}
+        await asyncio.to_thread(self._dump_checkpoints, data)
+
+    def _dump_checkpoints(self, data:dict):
+        with open(CHECKPOINT_FILE + ".tmp", "w", encoding="utf-8") as f:
+            toml.dump(data, f)
+        os.replace(CHECKPOINT_FILE + ".tmp", CHECKPOINT_FILE)
+
+    async def flush(self):
+        '''Writes the pending checkpoint and stops the writer'''
+        await self.saves.join()
+        await self.saves.stop()
+
+    def start_reconcile(self, guild:discord.Guild, progress=None) -> asyncio.Task:
+        '''Restarts reconciling guild from the first member'''
+        task = self.running.get(guild.id)
+        if task is not None and not task.done():
+            task.cancel()
+        # Keep retired roles of an unfinished reconcile, members it did
+        # not reach yet may still have them
+        retired = set(self.checkpoints.get(str(guild.id), {}).get("retired", []))
+        retired |= self.retired.pop(guild.id, set())
+        self.checkpoints[str(guild.id)] = {
+            "after": 0,
+            "done": 0,
+            "changed": 0,
+            "retired": sorted(retired),
+        }
+        self._save_checkpoints()
+        return self._spawn(guild, progress)
+
+    def resume_all(self):
+        '''Continues reconciles interrupted by restart'''
+        for guild_id in list(self.checkpoints):
+            guild = self.bot.get_guild(int(guild_id))
+            if guild is None:
+                continue
+            logger.info(f"Resuming level reward reconcile of {guild_id}")
+            self._spawn(guild)
+
+    def _spawn(self, guild, progress=None) -> asyncio.Task:
+        task = asyncio.create_task(self._reconcile(guild, progress))
+        self.running[guild.id] = task
+        return task
+
+    async def _reconcile(self, guild:discord.Guild, progress=None):
+        state = self.checkpoints[str(guild.id)]
+        thresholds = self.thresholds(guild.id)
+        retired = set(state.get("retired", [])) - set(thresholds.values())
+        semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+        members = sorted(
+            (m for m in guild.members if m.id > state["after"] and not m.bot),
+            key=lambda m: m.id,
+        )
+        total = state["done"] + len(members)
+
+        async def sync(member):
+            async with semaphore:
+                try:
+                    level = self.store.level(guild.id, member.id)
+                    return await self._sync_member(member, thresholds, level, retired)  # noqa: E501
+                except discord.HTTPException as e:
+                    logger.warning(f"Reward sync of {member.id} failed: {e}")
+                    return False
+
+        for start in range(0, len(members), RECONCILE_CHUNK):
+            chunk = members[start:start + RECONCILE_CHUNK]
+            changed = await asyncio.gather(*(sync(m) for m in chunk))
+            state["after"] = chunk[-1].id
+            state["done"] += len(chunk)
+            state["changed"] += sum(changed)
+            self._save_checkpoints()
+            if progress is not None:
+                await progress(state["done"], total, state["changed"])
+
+        del self.checkpoints[str(guild.id)]
+        self._save_checkpoints()
+        self.running.pop(guild.id, None)
+        logger.info(f"Level rewards of {guild.id} reconciled, {state['changed']} members changed")  # noqa: E501
+        return state
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import math
+import os
+from collections import defaultdict
+
+import toml
+
+logger = logging.getLogger(__name__)
+
+LEVELS_DIR = "data/levels"
+
+def level_for_xp(xp:int) -> int:
+    return int(math.sqrt(xp / 100))
+
+def xp_for_level(level:int) -> int:
+    return level * level * 100
+
+class LevelStore:
+
+    '''
+    XP of members per guild
+
+    Kept in memory and written to data/levels/<guild>.toml by flush(),
+    so messages dont rewrite the file every time and the event loop
+    never waits on the disk
+    '''
+
+    def __init__(self, levels_dir=LEVELS_DIR):
+        self.levels_dir = levels_dir
+        self.xp = defaultdict(dict)
+        self.totals = defaultdict(int)
+        self.deltas = defaultdict(int)
+        self._dirty = set()
+        self._load_all()
+        for users in self.xp.values():
+            for user, xp in users.items():
+                self.totals[user] += xp
+
+    def _load_all(self):
+        for filename in os.listdir(self.levels_dir):
+            if not filename.endswith(".toml") or not filename[:-5].isdigit():
+                continue
+            try:
+                with open(os.path.join(self.levels_dir, filename), encoding="utf-8") as f:  # noqa: E501
+                    data = toml.load(f)
+                self.xp[int(filename[:-5])] = {
+                    int(user): int(xp) for user, xp in data.get("xp", {}).items()
+                }
+            except (toml.TomlDecodeError, ValueError) as e:
+                logger.warning(f"{filename} is not valid level data, skipping: {e}")  # noqa: E501
+
+    def get(self, guild_id:int, user_id:int) -> int:
+        return self.xp.get(guild_id, {}).get(user_id, 0)
+
+    def level(self, guild_id:int, user_id:int) -> int:
+        return level_for_xp(self.get(guild_id, user_id))
+
+    def add(self, guild_id:int, user_id:int, amount:int) -> tuple[int, int]:
+        '''Adds xp, returns (old level, new level)'''
+        old = self.xp[guild_id].get(user_id, 0)
+        self.xp[guild_id][user_id] = old + amount
+        self.totals[user_id] += amount
+        self.deltas[user_id] += amount
+        self._dirty.add(guild_id)
+        return level_for_xp(old), level_for_xp(old + amount)
+
+    def members(self, guild_id:int) -> dict:
+        return self.xp.get(guild_id, {})
+
+    def top(self, guild_id:int, n:int=10) -> list[tuple[int, int]]:
+        users = self.xp.get(guild_id, {})
+        return sorted(users.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def totals_for(self, guild_ids) -> dict[int, int]:
+        '''XP per user summed over the given guilds only'''
+        totals = defaultdict(int)
+        for guild_id in guild_ids:
+            for user, xp in self.xp.get(guild_id, {}).items():
+                totals[user] += xp
+        return totals
+
+    def take_deltas(self) -> dict[int, int]:
+        '''XP gained per user across guilds since the last call'''
+        deltas, self.deltas = self.deltas, defaultdict(int)
+        return deltas
+
+    async def flush(self):
+        '''Writes changed guilds from a thread'''
+        dirty, self._dirty = self._dirty, set()
+        # Copy on the loop, xp keeps changing while the thread writes
+        snapshot = {
+            guild_id: {"xp": {str(user): xp for user, xp in self.xp[guild_id].items()}}  # noqa: E501
+            for guild_id in dirty
+        }
+        try:
+            await asyncio.to_thread(self._dump, snapshot)
+        except OSError:
+            self._dirty |= dirty
+            raise
+        if dirty:
+            logger.debug(f"Flushed levels of {len(dirty)} guilds")
+
+    def _dump(self, snapshot:dict):
+        for guild_id, data in snapshot.items():
+            path = os.path.join(self.levels_dir, f"{guild_id}.toml")
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                toml.dump(data, f)
+            os.replace(path + ".tmp", path)
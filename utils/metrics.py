@@ -0,0 +1,100 @@
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Counter:
+    def __init__(self, name:str, help:str=""):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount:int=1):
+        self.value += amount
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {self.value}"]
+
+class Gauge:
+    def __init__(self, name:str, func, help:str=""):
+        self.name = name
+        self.func = func
+        self.help = help
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {self.func()}"]
+
+class Histogram:
+    def __init__(self, name:str, buckets=DEFAULT_BUCKETS, help:str=""):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value:float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q:float) -> float:
+        '''Upper bucket bound the q quantile falls into'''
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts, strict=False):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return float("inf") if self.count else 0.0
+
+    def render(self) -> list[str]:
+        lines = []
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts, strict=False):
+            seen += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {seen}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum:.6f}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+class Metrics:
+
+    '''
+    Process wide metrics
+
+    Read by the helper with `metrics`, rendered in Prometheus text format
+    '''
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _get(self, name, factory):
+        if name not in self.metrics:
+            self.metrics[name] = factory()
+        return self.metrics[name]
+
+    def counter(self, name:str, help:str="") -> Counter:
+        return self._get(name, lambda: Counter(name, help))
+
+    def histogram(self, name:str, buckets=DEFAULT_BUCKETS, help:str="") -> Histogram:  # noqa: E501
+        return self._get(name, lambda: Histogram(name, buckets, help))
+
+    def gauge(self, name:str, func, help:str="") -> Gauge:
+        gauge = self._get(name, lambda: Gauge(name, func, help))
+        gauge.func = func
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            if metric.help:
+                lines.append(f"# HELP {name} {metric.help}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import re
+import time
+
+import discord
+
+from utils.cases import cases
+
+logger = logging.getLogger(__name__)
+
+# Snowflakes or mentions in a free-form list
+ID_RE = re.compile(r"\d{15,20}")
+BULK_BAN_SIZE = 200
+# Pause of each worker between single bans/kicks
+SINGLE_ACTION_INTERVAL = 0.5
+DM_TIMEOUT = 5
+PROGRESS_INTERVAL = 2.0
+
+def parse_ids(text:str) -> list[int]:
+    '''Unique ids in order of appearance'''
+    return list(dict.fromkeys(int(match) for match in ID_RE.findall(text or "")))
+
+def select_targets(
+    guild:discord.Guild,
+    ids:str=None,
+    joined_within:int=None,
+    role:discord.Role=None,
+) -> list[discord.Member | discord.Object]:
+    '''
+    Members matching every given filter
+
+    Ids that are not members are kept as bare objects so they can
+    still be banned.
+    '''
+    since = None
+    if joined_within:
+        since = discord.utils.utcnow().timestamp() - joined_within
+    if ids:
+        candidates = [guild.get_member(i) or discord.Object(i) for i in parse_ids(ids)]  # noqa: E501
+    elif role is not None:
+        candidates = list(role.members)
+    else:
+        candidates = list(guild.members)
+    targets = []
+    for target in candidates:
+        if not isinstance(target, discord.Member):
+            if since is None and role is None:
+                targets.append(target)
+            continue
+        if role is not None and role not in target.roles:
+            continue
+        if since is not None and (target.joined_at is None or target.joined_at.timestamp() < since):  # noqa: E501
+            continue
+        targets.append(target)
+    return targets
+
+def split_by_hierarchy(
+    guild:discord.Guild,
+    moderator:discord.Member,
+    targets:list,
+) -> tuple[list, list]:
+    '''Targets the moderator and the bot may act on, and the rest'''
+    me_top = guild.me.top_role
+    mod_top = moderator.top_role
+    is_owner = moderator.id == guild.owner_id
+    allowed, skipped = [], []
+    protected = {moderator.id, guild.owner_id, guild.me.id}
+    for target in targets:
+        outranks = isinstance(target, discord.Member) and (
+            target.top_role >= me_top or (not is_owner and target.top_role >= mod_top)  # noqa: E501
+        )
+        if target.id in protected or outranks:
+            skipped.append(target)
+        else:
+            allowed.append(target)
+    return allowed, skipped
+
+class MassAction:
+
+    '''
+    Ban or kick many members with one status message
+
+    Notices are sent in parallel and never block the action. Bans use
+    the bulk endpoint in chunks; kicks go through a small throttled
+    worker pool. Bulk bans need Manage Server, without it bans fall back
+    to the same worker pool.
+    '''
+
+    def __init__(
+        self,
+        guild:discord.Guild,
+        action:str,
+        reason:str,
+        moderator_id:int,
+        workers:int=4,
+        notify:bool=True,
+    ):
+        self.guild = guild
+        self.action = action
+        self.reason = reason
+        self.moderator_id = moderator_id
+        self.workers = workers
+        self.notify = notify
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.notified = 0
+        self.started = time.monotonic()
+        self._last_update = 0.0
+
+    def progress(self) -> str:
+        elapsed = int(time.monotonic() - self.started)
+        return (
+            f"**Mass {self.action}**: {self.done + self.failed}/{self.total}\n"
+            f"Succeeded: {self.done} | Failed: {self.failed} | "
+            f"Notified: {self.notified} | {elapsed}s"
+        )
+
+    async def _report(self, status, force:bool=False):
+        now = time.monotonic()
+        if status is None or (not force and now - self._last_update < PROGRESS_INTERVAL):  # noqa: E501
+            return
+        self._last_update = now
+        try:
+            await status(self.progress())
+        except discord.HTTPException as e:
+            logger.warning(f"Mass {self.action} progress update failed: {e}")
+
+    async def _dm(self, member:discord.Member):
+        verb = "banned" if self.action == "ban" else "kicked"
+        try:
+            await asyncio.wait_for(
+                member.send(
+                    embed=discord.Embed(
+                        description=f"You have been {verb} from {self.guild.name}\n**Reason**: {self.reason}",  # noqa: E501
+                        color=discord.Color.red(),
+                    ),
+                ),
+                DM_TIMEOUT,
+            )
+            self.notified += 1
+        except (discord.HTTPException, asyncio.TimeoutError):
+            pass
+
+    async def _notify(self, targets:list):
+        if not self.notify:
+            return
+        members = [t for t in targets if isinstance(t, discord.Member)]
+        await asyncio.gather(*(self._dm(member) for member in members))
+
+    async def _ban(self, targets:list, status):
+        for start in range(0, len(targets), BULK_BAN_SIZE):
+            chunk = targets[start:start + BULK_BAN_SIZE]
+            await self._notify(chunk)
+            try:
+                result = await self.guild.bulk_ban(chunk, reason=self.reason)
+            except discord.Forbidden:
+                logger.info(f"No bulk ban permission in {self.guild.id}, banning one by one")  # noqa: E501
+                await self._single(targets[start:], status, notified=chunk)
+                return
+            except discord.HTTPException as e:
+                logger.warning(f"Bulk ban chunk failed: {e}")
+                self.failed += len(chunk)
+            else:
+                self.done += len(result.banned)
+                self.failed += len(result.failed)
+                for user in result.banned:
+                    await cases.record(self.guild.id, "ban", user.id, self.moderator_id, self.reason)  # noqa: E501
+            await self._report(status)
+
+    async def _single(self, targets:list, status, notified=()):
+        '''Acts on targets one at a time through the worker pool'''
+        queue = asyncio.Queue()
+        for target in targets:
+            queue.put_nowait(target)
+        notified = {target.id for target in notified}
+        act = self.guild.ban if self.action == "ban" else self.guild.kick
+
+        async def worker():
+            while not queue.empty():
+                target = queue.get_nowait()
+                if target.id not in notified:
+                    await self._notify([target])
+                try:
+                    await act(target, reason=self.reason)
+                    self.done += 1
+                    await cases.record(self.guild.id, self.action, target.id, self.moderator_id, self.reason)  # noqa: E501
+                except discord.HTTPException:
+                    self.failed += 1
+                await self._report(status)
+                await asyncio.sleep(SINGLE_ACTION_INTERVAL)
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+
+    async def run(self, targets:list, status=None) -> "MassAction":
+        '''
+        Applies the action to targets
+
+        status(text) is awaited with progress at most every couple of
+        seconds and once at the end.
+        '''
+        self.total = len(targets)
+        self.started = time.monotonic()
+        if self.action == "ban":
+            await self._ban(targets, status)
+        else:
+            await self._single(targets, status)
+        await self._report(status, force=True)
+        return self
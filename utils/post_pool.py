@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+from utils.http import HttpError, http
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+IMAGE_HOSTS = {"i.redd.it", "i.imgur.com"}
+MAX_BACKOFF = 1800
+
+def image_url(post:dict) -> str | None:
+    '''Direct image link of a listing entry, None for anything else'''
+    if post.get("stickied") or post.get("is_video"):
+        return None
+    url = post.get("url_overridden_by_dest") or post.get("url") or ""
+    parts = urlsplit(url)
+    if parts.scheme != "https":
+        return None
+    path = parts.path.lower()
+    if path.endswith(IMAGE_EXTENSIONS):
+        return url
+    # Imgur serves the image without an extension too, but not .gifv
+    if parts.hostname in IMAGE_HOSTS and "." not in path.rsplit("/", 1)[-1]:
+        return url
+    return None
+
+class PostPool:
+
+    '''
+    Image posts of a Reddit listing, refreshed in the background
+
+    The listing is polled every `interval` seconds with If-None-Match,
+    new image links are appended and the oldest dropped past
+    `max_posts`. Commands pick from memory; when Reddit is down the
+    pool keeps serving what it has and the poller backs off.
+    '''
+
+    def __init__(self, name:str, url:str, interval:int=300, max_posts:int=500):
+        self.name = name
+        self.url = url
+        self.interval = interval
+        self.max_posts = max_posts
+        self.posts = []
+        self.known = set()
+        self.etag = None
+        self.refreshed_at = None
+        self.task = None
+        self.refreshes = metrics.counter(f"{name}_refresh_total", "Listing refreshes that returned posts")  # noqa: E501
+        self.not_modified = metrics.counter(f"{name}_refresh_not_modified_total", "Refreshes answered 304")  # noqa: E501
+        self.failures = metrics.counter(f"{name}_refresh_failed_total", "Refreshes that failed")  # noqa: E501
+        self.added = metrics.counter(f"{name}_posts_added_total", "New posts taken into the pool")  # noqa: E501
+        self.refresh_time = metrics.histogram(f"{name}_refresh_seconds", help="Time spent on one refresh")  # noqa: E501
+        metrics.gauge(f"{name}_size", lambda: len(self.posts), "Posts in the pool")
+        metrics.gauge(f"{name}_age_seconds", self.age, "Seconds since the last good refresh")  # noqa: E501
+
+    def __len__(self):
+        return len(self.posts)
+
+    def age(self) -> float:
+        if self.refreshed_at is None:
+            return -1
+        return time.monotonic() - self.refreshed_at
+
+    def pick(self) -> str | None:
+        return random.choice(self.posts) if self.posts else None  # noqa: S311
+
+    def _merge(self, urls:list[str]) -> int:
+        fresh = [url for url in dict.fromkeys(urls) if url not in self.known]
+        self.posts.extend(fresh)
+        self.known.update(fresh)
+        overflow = len(self.posts) - self.max_posts
+        if overflow > 0:
+            for url in self.posts[:overflow]:
+                self.known.discard(url)
+            del self.posts[:overflow]
+        return len(fresh)
+
+    async def refresh(self):
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        started = time.perf_counter()
+        try:
+            response = await http.get(self.url, headers=headers, params={"limit": "100"})  # noqa: E501
+            if response.status == 304:  # noqa: PLR2004
+                self.not_modified.inc()
+                self.refreshed_at = time.monotonic()
+                return
+            if response.status != 200:  # noqa: PLR2004
+                raise HttpError(self.url, response.status)
+            children = response.json()["data"]["children"]
+        finally:
+            self.refresh_time.observe(time.perf_counter() - started)
+        urls = [url for url in (image_url(child["data"]) for child in children) if url]  # noqa: E501
+        self.added.inc(self._merge(urls))
+        self.etag = response.headers.get("ETag")
+        self.refreshed_at = time.monotonic()
+        self.refreshes.inc()
+
+    async def _loop(self):
+        delay = self.interval
+        while True:
+            try:
+                await self.refresh()
+                delay = self.interval
+            except (HttpError, KeyError, TypeError, ValueError) as e:
+                self.failures.inc()
+                # Keep serving the old pool, poll less while upstream is down
+                delay = min(delay * 2, MAX_BACKOFF)
+                logger.warning(f"{self.name}: refresh failed, {len(self.posts)} stale posts left: {e}")  # noqa: E501
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
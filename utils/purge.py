@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import logging
+import time
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+SCAN_BUDGET = 5000
+# Bulk delete refuses messages older than this
+BULK_MAX_AGE = datetime.timedelta(days=14)
+SINGLE_DELETE_INTERVAL = 1.0
+PROGRESS_INTERVAL = 2.0
+
+def make_predicate(
+    author:discord.abc.User=None,
+    contains:str=None,
+    attachments:bool=False,
+    bots:bool=False,
+):
+    '''Message filter built from the purge options'''
+    contains = contains.lower() if contains else None
+
+    def predicate(message:discord.Message) -> bool:
+        if message.pinned:
+            return False
+        if author is not None and message.author.id != author.id:
+            return False
+        if bots and not message.author.bot:
+            return False
+        if attachments and not message.attachments:
+            return False
+        return not (contains and contains not in message.content.lower())
+
+    return predicate
+
+class Purge:
+
+    '''
+    Filtered channel cleanup
+
+    History is scanned newest first one page at a time and matching
+    messages are deleted while the scan goes on: recent ones through
+    bulk delete in chunks of 100, older ones one by one with a pause
+    between them. Stops when `amount` messages matched or `budget`
+    messages were looked at. Old messages that are still left when the
+    `deadline` (time.monotonic) passes are counted as skipped.
+    '''
+
+    def __init__(
+        self,
+        channel,
+        predicate,
+        amount:int,
+        budget:int=SCAN_BUDGET,
+        deadline:float=None,
+    ):
+        self.channel = channel
+        self.predicate = predicate
+        self.amount = amount
+        self.budget = budget
+        self.deadline = deadline
+        self.scanned = 0
+        self.deleted = 0
+        self.failed = 0
+        self.skipped = 0
+        self._last_update = 0.0
+
+    def progress(self) -> str:
+        return (
+            f"Deleted {self.deleted}/{self.amount} messages, "
+            f"scanned {self.scanned}"
+            + (f", {self.failed} failed" if self.failed else "")
+            + (f", {self.skipped} skipped for time" if self.skipped else "")
+        )
+
+    async def _report(self, status, force:bool=False):
+        now = time.monotonic()
+        if status is None or (not force and now - self._last_update < PROGRESS_INTERVAL):  # noqa: E501
+            return
+        self._last_update = now
+        try:
+            await status(self.progress())
+        except discord.HTTPException as e:
+            logger.debug(f"Purge progress update failed: {e}")
+
+    async def _bulk(self, messages:list):
+        try:
+            if len(messages) == 1:
+                await messages[0].delete()
+            else:
+                await self.channel.delete_messages(messages)
+            self.deleted += len(messages)
+        except discord.NotFound:
+            # Someone else deleted part of the chunk, retry one by one
+            await self._singles(messages, interval=0)
+        except discord.HTTPException as e:
+            logger.warning(f"Bulk delete in {self.channel.id} failed: {e}")
+            self.failed += len(messages)
+
+    async def _singles(self, messages:list, interval:float=SINGLE_DELETE_INTERVAL):  # noqa: E501
+        for index, message in enumerate(messages):
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                self.skipped += len(messages) - index
+                return
+            try:
+                await message.delete()
+                self.deleted += 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                self.failed += 1
+            if interval:
+                await asyncio.sleep(interval)
+
+    async def _scan(self):
+        '''Yields matching messages until amount or budget is used up'''
+        before = None
+        matched = 0
+        while matched < self.amount and self.scanned < self.budget:
+            limit = min(PAGE_SIZE, self.budget - self.scanned)
+            page = [
+                message async for message in self.channel.history(
+                    limit=limit,
+                    before=before,
+                )
+            ]
+            self.scanned += len(page)
+            for message in page:
+                if self.predicate(message):
+                    matched += 1
+                    yield message
+                    if matched >= self.amount:
+                        return
+            if len(page) < limit:
+                return
+            before = page[-1]
+
+    async def run(self, status=None) -> "Purge":
+        '''
+        Deletes matching messages
+
+        status(text) is awaited with progress every couple of seconds
+        and once at the end.
+        '''
+        cutoff = discord.utils.utcnow() - BULK_MAX_AGE
+        chunk, old = [], []
+        async for message in self._scan():
+            if message.created_at > cutoff:
+                chunk.append(message)
+                if len(chunk) == PAGE_SIZE:
+                    await self._bulk(chunk)
+                    chunk = []
+            else:
+                old.append(message)
+            await self._report(status)
+        if chunk:
+            await self._bulk(chunk)
+        await self._report(status)
+        if old:
+            await self._singles(old)
+        await self._report(status, force=True)
+        return self
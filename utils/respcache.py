@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+def estimate_size(value) -> int:
+    '''Rough deep size of JSON-like values'''
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, list | tuple):
+        size += sum(estimate_size(item) for item in value)
+    elif hasattr(value, "__slots__"):
+        size += sum(estimate_size(getattr(value, slot)) for slot in value.__slots__)  # noqa: E501
+    return size
+
+class ResponseCache:
+
+    '''
+    TTL cache of parsed upstream responses
+
+    Entries younger than `ttl` are served as is. Until `ttl + stale`
+    they are still served, and one background reload refreshes them.
+    Older entries are reloaded inline. Concurrent loads of one key
+    share a request. The cache keeps its total estimated size under
+    `max_bytes` by evicting the least recently used entries.
+    '''
+
+    def __init__(self, name:str, ttl:float=60, stale:float=300, max_bytes:int=8 * 1024 * 1024):  # noqa: E501
+        self.name = name
+        self.ttl = ttl
+        self.stale = stale
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.loading = {}
+        self.hits = metrics.counter(f"{name}_cache_hits_total", "Answers served from cache")  # noqa: E501
+        self.misses = metrics.counter(f"{name}_cache_misses_total", "Answers that waited for upstream")  # noqa: E501
+        self.stale_hits = metrics.counter(f"{name}_cache_stale_total", "Stale answers served while refreshing")  # noqa: E501
+        self.evictions = metrics.counter(f"{name}_cache_evictions_total", "Entries evicted by the byte budget")  # noqa: E501
+        metrics.gauge(f"{name}_cache_bytes", lambda: self.size, "Estimated cache size")  # noqa: E501
+
+    def _store(self, key, value):
+        size = estimate_size(value)
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[2]
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, time.monotonic(), size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions.inc()
+
+    def _load(self, key, loader) -> asyncio.Task:
+        task = self.loading.get(key)
+        if task is None:
+            async def load():
+                value = await loader()
+                self._store(key, value)
+                return value
+
+            task = asyncio.create_task(load())
+            self.loading[key] = task
+            task.add_done_callback(lambda _: self.loading.pop(key, None))
+        return task
+
+    def _refresh_done(self, task:asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"{self.name}: background refresh failed: {task.exception()}")  # noqa: E501
+
+    async def get(self, key, loader):
+        '''
+        Cached value of key, loader() is awaited for a fresh one
+
+        Errors of an inline load propagate; a failed background
+        refresh keeps the stale entry until it expires.
+        '''
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, loaded_at, _ = entry
+            age = time.monotonic() - loaded_at
+            if age < self.ttl + self.stale:
+                self.entries.move_to_end(key)
+                if age < self.ttl:
+                    self.hits.inc()
+                else:
+                    self.stale_hits.inc()
+                    if key not in self.loading:
+                        self._load(key, loader).add_done_callback(self._refresh_done)  # noqa: E501
+                return value
+        self.misses.inc()
+        return await asyncio.shield(self._load(key, loader))
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+
+from utils.http import HttpError, http
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+E621_TAGS = "https://e621.net/tags.json"
+LIMIT = 20
+TTL = 600
+MAX_ENTRIES = 5000
+# Discord drops autocomplete answers after 3 seconds
+LATENCY_BUDGET = 1.5
+
+class TrieNode:
+    __slots__ = ("children", "tags", "complete", "expires")
+
+    def __init__(self):
+        self.children = {}
+        self.tags = None
+        self.complete = False
+        self.expires = 0.0
+
+class TagSuggester:
+
+    '''
+    e621 tag suggestions for autocomplete
+
+    Results are kept in a prefix trie with a TTL. A prefix whose
+    shorter prefix returned fewer than LIMIT tags is answered by
+    filtering that result, without a request. Identical queries share
+    one request, and if it does not answer within LATENCY_BUDGET the
+    best cached guess is returned while the request keeps filling the
+    cache for the next keystroke.
+    '''
+
+    def __init__(self, budget:float=LATENCY_BUDGET, ttl:int=TTL):
+        self.budget = budget
+        self.ttl = ttl
+        self.root = TrieNode()
+        self.entries = 0
+        self.inflight = {}
+        self.hits = metrics.counter("tag_suggest_hits_total", "Suggestions answered from cache")  # noqa: E501
+        self.misses = metrics.counter("tag_suggest_misses_total", "Suggestions that needed a request")  # noqa: E501
+        self.stale = metrics.counter("tag_suggest_stale_total", "Suggestions answered stale after the budget ran out")  # noqa: E501
+
+    def _lookup(self, prefix:str) -> tuple[list | None, bool]:
+        '''
+        Best cached answer for prefix and whether it can be trusted
+
+        Walks the trie down the prefix and remembers the deepest node
+        with tags; ancestors only count as fresh when they were complete.
+        '''
+        now = time.monotonic()
+        node = self.root
+        best = None
+        fresh = False
+        for depth in range(len(prefix) + 1):
+            if node.tags is not None:
+                usable = depth == len(prefix) or node.complete
+                node_fresh = usable and node.expires > now
+                # Deeper results are closer, unless we already trust one
+                if node_fresh or not fresh:
+                    best = node.tags
+                    fresh = node_fresh
+            if depth == len(prefix):
+                break
+            node = node.children.get(prefix[depth])
+            if node is None:
+                break
+        if best is None:
+            return None, False
+        return [tag for tag in best if tag.startswith(prefix)], fresh
+
+    def _store(self, prefix:str, tags:list):
+        node = self.root
+        for char in prefix:
+            node = node.children.setdefault(char, TrieNode())
+        if node.tags is None:
+            self.entries += 1
+        node.tags = tags
+        node.complete = len(tags) < LIMIT
+        node.expires = time.monotonic() + self.ttl
+        if self.entries > MAX_ENTRIES:
+            self._sweep()
+
+    def _sweep(self):
+        '''Drops expired results and empty branches'''
+        now = time.monotonic()
+
+        def prune(node:TrieNode) -> bool:
+            if node.tags is not None and node.expires <= now:
+                node.tags = None
+                self.entries -= 1
+            for char in [c for c, child in node.children.items() if prune(child)]:
+                del node.children[char]
+            return node.tags is None and not node.children
+
+        prune(self.root)
+        if self.entries > MAX_ENTRIES:
+            self.root = TrieNode()
+            self.entries = 0
+
+    async def _fetch(self, prefix:str) -> list | None:
+        '''Fresh tags of prefix, None when upstream failed'''
+        params = {
+            "search[name_matches]": prefix + "*",
+            "search[order]": "count",
+            "limit": str(LIMIT),
+        }
+        try:
+            data = await http.get_json(E621_TAGS, params=params, retries=0)
+        except HttpError as e:
+            logger.debug(f"Tag search for {prefix} failed: {e}")
+            return None
+        # e621 answers an empty search with {"tags": []}
+        tags = [tag["name"] for tag in data] if isinstance(data, list) else []
+        self._store(prefix, tags)
+        return tags
+
+    async def suggest(self, prefix:str) -> list[str]:
+        '''Tags starting with prefix, most used first'''
+        prefix = prefix.strip().lower()
+        cached, fresh = self._lookup(prefix)
+        if fresh:
+            self.hits.inc()
+            return cached
+        self.misses.inc()
+        task = self.inflight.get(prefix)
+        if task is None:
+            task = asyncio.create_task(self._fetch(prefix))
+            self.inflight[prefix] = task
+            task.add_done_callback(lambda _: self.inflight.pop(prefix, None))
+        try:
+            tags = await asyncio.wait_for(asyncio.shield(task), self.budget)
+        except asyncio.TimeoutError:
+            tags = None
+        if tags is None:
+            # Slow or failing upstream, an old answer beats none
+            self.stale.inc()
+            return cached or []
+        return tags
+
+tag_suggester = TagSuggester()
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+MODERATION_DIR = "data/moderation"
+TEMPBANS_FILE = os.path.join(MODERATION_DIR, "tempbans.jsonl")
+
+class TempBanStore:
+
+    '''
+    Pending unbans of temporary bans
+
+    Bans and finished unbans are appended to a journal; on startup it is
+    replayed and rewritten with only the pending entries, so it never
+    grows past one restart worth of history.
+    '''
+
+    def __init__(self, path:str=TEMPBANS_FILE):
+        self.path = path
+        self.pending = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    key = (event["guild"], event["user"])
+                    if event["op"] == "ban":
+                        self.pending[key] = event["until"]
+                    else:
+                        self.pending.pop(key, None)
+        except FileNotFoundError:
+            pass
+        self._compact()
+
+    def _compact(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for (guild, user), until in self.pending.items():
+                f.write(json.dumps({"op": "ban", "guild": guild, "user": user, "until": until}) + "\n")  # noqa: E501
+        os.replace(self.path + ".tmp", self.path)
+
+    def _append(self, event:dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event) + "\n")
+
+    def add(self, guild_id:int, user_id:int, until:int):
+        self.pending[(guild_id, user_id)] = until
+        self._append({"op": "ban", "guild": guild_id, "user": user_id, "until": until})  # noqa: E501
+
+    def done(self, guild_id:int, user_id:int):
+        if self.pending.pop((guild_id, user_id), None) is not None:
+            self._append({"op": "done", "guild": guild_id, "user": user_id})
+
+tempbans = TempBanStore()
@@ -0,0 +1,183 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import json
+import logging
+import os
+from collections import defaultdict
+
+from utils.tickets import TICKETS_DIR
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.path.join(TICKETS_DIR, "archive")
+REORDER_WINDOW = 1000
+STREAM_BATCH = 500
+
+def serialize(message) -> dict:
+    return {
+        "id": message.id,
+        "author": {"id": message.author.id, "name": str(message.author)},
+        "created_at": message.created_at.isoformat(),
+        "edited_at": message.edited_at.isoformat() if message.edited_at else None,
+        "content": message.clean_content,
+        "reply_to": message.reference.message_id if message.reference else None,
+        "attachments": [
+            {
+                "id": attachment.id,
+                "filename": attachment.filename,
+                "url": attachment.url,
+                "size": attachment.size,
+                "content_type": attachment.content_type,
+            } for attachment in message.attachments
+        ],
+        "embeds": [embed.to_dict() for embed in message.embeds],
+    }
+
+def _append_batch(directory:str, batch:dict):
+    for channel_id, lines in batch.items():
+        with open(os.path.join(directory, f"{channel_id}.jsonl"), "a", encoding="utf-8") as f:  # noqa: E501
+            f.write("".join(lines))
+
+class TicketArchive:
+
+    '''
+    Append-only event log of every ticket
+
+    Messages, edits and deletes are appended to
+    data/tickets/archive/<channel>.jsonl while the ticket is open, so
+    the transcript is already on disk when it gets closed. Appends are
+    batched by a single writer task and written from a thread.
+    '''
+
+    def __init__(self, directory:str=ARCHIVE_DIR):
+        self.directory = directory
+        self.queue = None
+        self.task = None
+
+    def path(self, channel_id:int) -> str:
+        return os.path.join(self.directory, f"{channel_id}.jsonl")
+
+    def has(self, channel_id:int) -> bool:
+        return os.path.exists(self.path(channel_id))
+
+    def append(self, channel_id:int, event:dict):
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._writer())
+        self.queue.put_nowait((channel_id, json.dumps(event) + "\n"))
+
+    def message(self, message):
+        self.append(message.channel.id, {"op": "create", "message": serialize(message)})  # noqa: E501
+
+    def edit(self, message):
+        self.append(message.channel.id, {
+            "op": "edit",
+            "id": message.id,
+            "content": message.clean_content,
+            "edited_at": message.edited_at.isoformat() if message.edited_at else None,  # noqa: E501
+            "embeds": [embed.to_dict() for embed in message.embeds],
+        })
+
+    def delete(self, channel_id:int, message_id:int):
+        self.append(channel_id, {"op": "delete", "id": message_id})
+
+    async def _writer(self):
+        while True:
+            items = [await self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            batch = defaultdict(list)
+            for channel_id, line in items:
+                batch[channel_id].append(line)
+            try:
+                await asyncio.to_thread(_append_batch, self.directory, batch)
+            except OSError as e:
+                logger.error(f"Writing ticket archive failed: {e}")
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    async def flush(self):
+        if self.queue is not None:
+            await self.queue.join()
+
+    def last_id(self, channel_id:int) -> int:
+        '''Id of the newest logged message, None when nothing is logged'''
+        last = None
+        with contextlib.suppress(FileNotFoundError), open(self.path(channel_id), encoding="utf-8") as f:  # noqa: E501
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if event["op"] == "create":
+                    last = max(last or 0, event["message"]["id"])
+        return last
+
+    def _events(self, channel_id:int):
+        with open(self.path(channel_id), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def compact(self, channel_id:int):
+        '''
+        Folds the event log into the final messages, oldest first
+
+        Streams instead of holding the ticket in memory: the first pass
+        only keeps edits and deletes by message id, the second applies
+        them to creates as they are read. Creates logged slightly out of
+        order (catch-up racing live messages) are sorted through a
+        window of REORDER_WINDOW messages, duplicates are dropped.
+        '''
+        overlay = {}
+        for event in self._events(channel_id):
+            if event["op"] == "edit" and overlay.get(event["id"], {}) is not None:
+                overlay[event["id"]] = {
+                    "content": event["content"],
+                    "edited_at": event["edited_at"],
+                    "embeds": event["embeds"],
+                }
+            elif event["op"] == "delete":
+                overlay[event["id"]] = None
+        window = []
+        last = 0
+
+        def emit():
+            nonlocal last
+            message_id, _, message = heapq.heappop(window)
+            if message_id <= last:
+                return None
+            last = message_id
+            patch = overlay.get(message_id, {})
+            if patch is None:
+                return None
+            message.update(patch)
+            return message
+
+        for order, event in enumerate(self._events(channel_id)):
+            if event["op"] != "create":
+                continue
+            heapq.heappush(window, (event["message"]["id"], order, event["message"]))
+            if len(window) > REORDER_WINDOW and (message := emit()) is not None:
+                yield message
+        while window:
+            if (message := emit()) is not None:
+                yield message
+
+    async def stream(self, channel_id:int):
+        '''compact() off the event loop, a batch of messages at a time'''
+        records = self.compact(channel_id)
+        while batch := await asyncio.to_thread(list, itertools.islice(records, STREAM_BATCH)):  # noqa: E501
+            for record in batch:
+                yield record
+
+    def discard(self, channel_id:int):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path(channel_id))
+
+archive = TicketArchive()
@@ -0,0 +1,199 @@
+import asyncio
+import contextlib
+import html
+import json
+import logging
+import os
+import shutil
+import zipfile
+from datetime import datetime
+
+from utils.http import HttpError, http
+from utils.transcripts import CACHE_DIR, DATE_FORMAT, LineWriter, iter_records
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENT_CAP = 20 * 1024 * 1024
+DOWNLOAD_CONCURRENCY = 4
+DOWNLOAD_TIMEOUT = 120
+# Upload limit space kept for the transcripts and zip headers
+TRANSCRIPT_RESERVE = 1024 * 1024
+SPOOL_FILE = "records.jsonl"
+READ_HINT = 256 * 1024
+
+HTML_HEAD = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title><style>
+body{{background:#313338;color:#dbdee1;font-family:sans-serif;margin:2em}}
+.msg{{padding:4px 0;border-bottom:1px solid #3f4147}}
+.author{{font-weight:bold;color:#f2f3f5}}.time,.reply{{color:#949ba4;font-size:.8em}}
+.embed{{border-left:4px solid #5865f2;background:#2b2d31;padding:6px;margin:4px 0}}
+img{{max-width:400px;display:block}}a{{color:#00a8fc}}
+</style></head><body><h1>{title}</h1>
+"""
+
+def render_html(record:dict, archived:dict) -> str:
+    esc = html.escape
+    created = datetime.fromisoformat(record["created_at"]).strftime(DATE_FORMAT)
+    parts = [f'<div class="msg" id="m{record["id"]}">']
+    if record["reply_to"]:
+        parts.append(f'<div class="reply">replying to <a href="#m{record["reply_to"]}">message</a></div>')  # noqa: E501
+    parts.append(f'<span class="author">{esc(record["author"]["name"])}</span> <span class="time">{created}</span>')  # noqa: E501
+    if record["edited_at"]:
+        parts.append(' <span class="time">(edited)</span>')
+    parts.append(f'<div>{esc(record["content"])}</div>')
+    for attachment in record["attachments"]:
+        href = esc(archived.get(attachment["url"], attachment["url"]))
+        if (attachment["content_type"] or "").startswith("image/"):
+            parts.append(f'<a href="{href}"><img src="{href}" alt="{esc(attachment["filename"])}"></a>')  # noqa: E501
+        else:
+            parts.append(f'<a href="{href}">{esc(attachment["filename"])}</a>')
+    for embed in record["embeds"]:
+        parts.append('<div class="embed">')
+        if embed.get("title"):
+            parts.append(f'<b>{esc(embed["title"])}</b>')
+        if embed.get("description"):
+            parts.append(f'<div>{esc(embed["description"])}</div>')
+        for field in embed.get("fields", []):
+            parts.append(f'<div><b>{esc(field["name"])}</b>: {esc(field["value"])}</div>')  # noqa: E501
+        parts.append('</div>')
+    parts.append('</div>\n')
+    return "".join(parts)
+
+class AttachmentArchiver:
+
+    '''
+    Downloads ticket attachments with bounded concurrency
+
+    Same URL is downloaded once. Space is reserved from the cap by the
+    size Discord reports before downloading. `archived` maps every
+    accepted URL to its local path, URLs in `failed` did not make it.
+    Downloads go through the shared HTTP client, capped at that size.
+    '''
+
+    def __init__(self, directory:str, cap:int=ATTACHMENT_CAP):
+        self.directory = directory
+        self.remaining = cap
+        self.semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        self.archived = {}
+        self.failed = []
+        self.tasks = []
+
+    async def __aenter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.gather(*self.tasks)
+
+    def add(self, attachment:dict):
+        url = attachment["url"]
+        if url in self.archived or attachment["size"] > self.remaining:
+            return
+        self.remaining -= attachment["size"]
+        name = f"{attachment['id']}-{os.path.basename(attachment['filename'])}"
+        self.archived[url] = f"attachments/{name}"
+        self.tasks.append(asyncio.create_task(
+            self._download(url, os.path.join(self.directory, name), attachment["size"]),  # noqa: E501
+        ))
+
+    async def _download(self, url:str, path:str, size:int):
+        async with self.semaphore:
+            try:
+                response = await http.get(url, timeout=DOWNLOAD_TIMEOUT, max_bytes=size)  # noqa: E501
+                if response.status != 200:  # noqa: PLR2004
+                    raise HttpError(url, response.status)
+                await asyncio.to_thread(_write, path, response.body)
+            except (HttpError, OSError) as e:
+                logger.debug(f"Attachment {url} not archived: {e}")
+                self.failed.append(url)
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+def _write(path:str, body:bytes):
+    with open(path, "wb") as f:
+        f.write(body)
+
+def _package(directory:str, zip_path:str, limit:int, files) -> list[str]:
+    '''Zips transcripts and files below limit bytes, returns the files left out'''  # noqa: E501
+    skipped = []
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        # Transcripts first, attachments only while they still fit
+        for name in ("transcript.html", "transcript.json"):
+            archive.write(os.path.join(directory, name), name)
+        for name in sorted(files):
+            full = os.path.join(directory, name)
+            # Deflate never grows a file by more than a few bytes per block
+            if archive.fp.tell() + os.path.getsize(full) * 1.01 + 1024 > limit:
+                skipped.append(name)
+                continue
+            archive.write(full, name)
+    return skipped
+
+async def _saved_records(path:str):
+    '''Yields records of the spool file, a batch of lines at a time'''
+    with open(path, encoding="utf-8") as f:
+        while lines := await asyncio.to_thread(f.readlines, READ_HINT):
+            for line in lines:
+                yield json.loads(line)
+
+async def _render(workdir:str, channel, local:dict, requested_by:str, generated:str):  # noqa: E501
+    title = html.escape(f"Transcript of {channel.name}")
+    async with (
+        LineWriter(os.path.join(workdir, "transcript.html")) as page,
+        LineWriter(os.path.join(workdir, "transcript.json")) as archive,
+    ):
+        await page.write(HTML_HEAD.format(title=title))
+        await archive.write(json.dumps({"channel": {"id": channel.id, "name": channel.name}})[:-1] + ', "messages": [\n')  # noqa: E501
+        first = True
+        async for record in _saved_records(os.path.join(workdir, SPOOL_FILE)):
+            record["archived"] = [
+                local[a["url"]] for a in record["attachments"] if a["url"] in local
+            ]
+            await page.write(render_html(record, local))
+            await archive.write(("" if first else ",\n") + json.dumps(record))
+            first = False
+        await page.write(f"<p><i>Generated at {generated} by {html.escape(requested_by)}, times in UTC</i></p></body></html>\n")  # noqa: E501
+        await archive.write(f'\n], "generated_at": {json.dumps(generated)}, "generated_by": {json.dumps(requested_by)}}}\n')  # noqa: E501
+
+async def export_ticket(channel, requested_by:str, cache_dir:str=CACHE_DIR) -> str:
+    '''
+    Exports channel into zip of transcript.html, transcript.json and attachments
+
+    Records are spooled to disk while attachments download, the pages
+    are rendered afterwards so they only link local copies that made it
+    into the zip. Attachments that failed or dont fit below the upload
+    limit of the guild are linked by URL.
+    '''
+    limit = channel.guild.filesize_limit
+    workdir = os.path.join(cache_dir, f"export-{channel.id}")
+    zip_path = os.path.join(cache_dir, f"export-{channel.id}.zip")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        async with (
+            AttachmentArchiver(
+                os.path.join(workdir, "attachments"),
+                min(ATTACHMENT_CAP, limit - TRANSCRIPT_RESERVE),
+            ) as archiver,
+            LineWriter(os.path.join(workdir, SPOOL_FILE)) as spool,
+        ):
+            async for record in iter_records(channel):
+                for attachment in record["attachments"]:
+                    archiver.add(attachment)
+                await spool.write(json.dumps(record) + "\n")
+        failed = set(archiver.failed)
+        if failed:
+            logger.info(f"{len(failed)} attachments of {channel.id} were not archived")  # noqa: E501
+        local = {url: path for url, path in archiver.archived.items() if url not in failed}  # noqa: E501
+        generated = datetime.now().strftime(DATE_FORMAT)
+        # Every pass drops at least one file, usually one pass is enough
+        while True:
+            await _render(workdir, channel, local, requested_by, generated)
+            skipped = await asyncio.to_thread(_package, workdir, zip_path, limit, set(local.values()))  # noqa: E501
+            if not skipped:
+                break
+            logger.warning(f"{len(skipped)} attachments of {channel.id} left out to fit the upload limit")  # noqa: E501
+            skipped = set(skipped)
+            local = {url: path for url, path in local.items() if path not in skipped}
+    finally:
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
+    return zip_path
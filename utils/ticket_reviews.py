@@ -0,0 +1,112 @@
+import logging
+import os
+import struct
+import time
+from collections import defaultdict, deque
+
+from utils.tickets import TICKETS_DIR
+
+logger = logging.getLogger(__name__)
+
+REVIEWS_FILE = os.path.join(TICKETS_DIR, "reviews.bin")
+# guild, ticket, staff, rating, unix time
+RECORD = struct.Struct("<QQQBI")
+MAX_RATING = 5
+WINDOW_DAYS = 30
+DAY = 86400
+
+class RatingStats:
+
+    '''
+    Running statistics of ratings
+
+    Count, sum and histogram are updated per vote. The 30 day window is
+    kept as per-day buckets with running totals, old days drop off the
+    front, so reads never walk the history.
+    '''
+
+    __slots__ = ("count", "total", "histogram", "days", "window_count", "window_total")  # noqa: E501
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.histogram = [0] * MAX_RATING
+        self.days = deque()
+        self.window_count = 0
+        self.window_total = 0
+
+    def add(self, rating:int, timestamp:int):
+        self.count += 1
+        self.total += rating
+        self.histogram[rating - 1] += 1
+        day = timestamp // DAY
+        if self.days and self.days[-1][0] == day:
+            self.days[-1][1] += 1
+            self.days[-1][2] += rating
+        else:
+            self.days.append([day, 1, rating])
+        self.window_count += 1
+        self.window_total += rating
+        self._expire(day)
+
+    def _expire(self, today:int):
+        while self.days and self.days[0][0] <= today - WINDOW_DAYS:
+            _, count, total = self.days.popleft()
+            self.window_count -= count
+            self.window_total -= total
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def window_mean(self, now:int=None) -> tuple[int, float]:
+        self._expire(int(now or time.time()) // DAY)
+        mean = self.window_total / self.window_count if self.window_count else 0.0
+        return self.window_count, mean
+
+class ReviewStore:
+
+    '''
+    Ticket reviews
+
+    Every vote is appended as a fixed size record to
+    data/tickets/reviews.bin and folded into per-guild and per-staff
+    RatingStats. The log is only read once, on startup.
+    '''
+
+    def __init__(self, path:str=REVIEWS_FILE):
+        self.path = path
+        self.guilds = defaultdict(RatingStats)
+        self.staff = defaultdict(RatingStats)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        usable = len(data) - len(data) % RECORD.size
+        for record in RECORD.iter_unpack(data[:usable]):
+            self._apply(*record)
+
+    def _apply(self, guild_id, ticket_id, staff_id, rating, timestamp):
+        self.guilds[guild_id].add(rating, timestamp)
+        if staff_id:
+            self.staff[(guild_id, staff_id)].add(rating, timestamp)
+
+    def add(self, guild_id:int, ticket_id:int, staff_id:int, rating:int):
+        if not 1 <= rating <= MAX_RATING:
+            raise ValueError(f"rating {rating} is out of range")
+        record = (guild_id, ticket_id, staff_id or 0, rating, int(time.time()))
+        with open(self.path, "ab") as f:
+            f.write(RECORD.pack(*record))
+        self._apply(*record)
+
+    def guild_stats(self, guild_id:int) -> RatingStats:
+        return self.guilds.get(guild_id)
+
+    def staff_stats(self, guild_id:int, staff_id:int) -> RatingStats:
+        return self.staff.get((guild_id, staff_id))
+
+reviews = ReviewStore()
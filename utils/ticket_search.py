@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.tickets import ARCHIVED, TICKETS_DIR
+from utils.transcripts import TRANSCRIPT_DIR
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join(TICKETS_DIR, "search.db")
+PAGE_SIZE = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ticket_meta (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    opener_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    closed_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ticket_meta_guild ON ticket_meta (guild_id, closed_at);
+CREATE TABLE IF NOT EXISTS ticket_staff (
+    channel_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, channel_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS ticket_fts USING fts5 (body);
+"""
+
+# Tokens the unicode61 tokenizer keeps, punctuation only separates them
+TERM_RE = re.compile(r"\w+")
+
+def fts_query(text:str) -> str:
+    '''
+    Quotes every term, so user input cant break FTS5 syntax
+
+    Empty when text has no terms, MATCH fails on an empty query.
+    '''
+    return " ".join(f'"{term}"' for term in TERM_RE.findall(text or ""))
+
+class TicketSearch:
+
+    '''
+    Full-text index of archived tickets
+
+    One FTS5 row per closed ticket (rowid = channel id) with guild,
+    opener, staff and close date facets in normal tables. Everything
+    runs on one dedicated thread, so the event loop never touches SQLite.
+    '''
+
+    def __init__(self, path:str=DB_PATH):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ticket-search")  # noqa: E501
+        self.db = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.executescript(SCHEMA)
+        return self.db
+
+    def _index(self, channel_id:int, entry:dict, name:str, exclude:set):
+        path = os.path.join(TRANSCRIPT_DIR, f"{channel_id}.jsonl")
+        lines = []
+        staff = set()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                author = record["author"]["id"]
+                if author != entry["opener"] and author not in exclude:
+                    staff.add(author)
+                lines.append(f"{record['author']['name']}: {record['content']}")
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM ticket_fts WHERE rowid = ?", (channel_id,))
+            db.execute("DELETE FROM ticket_staff WHERE channel_id = ?", (channel_id,))  # noqa: E501
+            db.execute(
+                "INSERT OR REPLACE INTO ticket_meta VALUES (?, ?, ?, ?, ?)",
+                (channel_id, entry["guild"], entry["opener"], name, int(time.time())),  # noqa: E501
+            )
+            db.execute(
+                "INSERT INTO ticket_fts (rowid, body) VALUES (?, ?)",
+                (channel_id, "\n".join(lines)),
+            )
+            db.executemany(
+                "INSERT INTO ticket_staff VALUES (?, ?)",
+                [(channel_id, user) for user in staff],
+            )
+
+    async def index(self, channel_id:int, entry:dict, name:str, exclude=()):
+        '''Indexes final transcript of a closed ticket'''
+        try:
+            await self._run(self._index, channel_id, entry, name, set(exclude))
+        except (OSError, sqlite3.Error, json.JSONDecodeError) as e:
+            logger.error(f"Indexing ticket {channel_id} failed: {e}")
+
+    def _missing(self, channel_ids):
+        db = self._connect()
+        return [
+            channel_id for channel_id in channel_ids
+            if os.path.exists(os.path.join(TRANSCRIPT_DIR, f"{channel_id}.jsonl"))
+            and db.execute("SELECT 1 FROM ticket_meta WHERE channel_id = ?", (channel_id,)).fetchone() is None  # noqa: E501
+        ]
+
+    async def backfill(self, registry):
+        '''Indexes archived tickets that closed without being indexed'''
+        archived = [
+            channel_id for channel_id, entry in registry.channels.items()
+            if entry["state"] == ARCHIVED
+        ]
+        for channel_id in await self._run(self._missing, archived):
+            await self.index(channel_id, registry.get(channel_id), str(channel_id))
+
+    def _search(self, guild_id, text, opener, staff, since, page):
+        sql = (
+            "SELECT m.channel_id, m.name, m.opener_id, m.closed_at,"
+            " snippet(ticket_fts, 0, '**', '**', '...', 16)"
+            " FROM ticket_fts JOIN ticket_meta m ON m.channel_id = ticket_fts.rowid"
+            " WHERE ticket_fts MATCH ? AND m.guild_id = ?"
+        )
+        args = [fts_query(text), guild_id]
+        if opener is not None:
+            sql += " AND m.opener_id = ?"
+            args.append(opener)
+        if staff is not None:
+            sql += " AND m.channel_id IN (SELECT channel_id FROM ticket_staff WHERE user_id = ?)"  # noqa: E501
+            args.append(staff)
+        if since is not None:
+            sql += " AND m.closed_at >= ?"
+            args.append(since)
+        sql += " ORDER BY bm25(ticket_fts) LIMIT ? OFFSET ?"
+        # One extra row tells if there is a next page
+        args += [PAGE_SIZE + 1, page * PAGE_SIZE]
+        return self._connect().execute(sql, args).fetchall()
+
+    async def search(self, guild_id:int, text:str, opener=None, staff=None, since=None, page:int=0):  # noqa: E501
+        '''Returns (results, has_next) of one page'''
+        rows = await self._run(self._search, guild_id, text, opener, staff, since, page)  # noqa: E501
+        return rows[:PAGE_SIZE], len(rows) > PAGE_SIZE
+
+ticket_search = TicketSearch()
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+
+import discord
+import toml
+
+from utils.workqueue import CoalescingQueue
+
+logger = logging.getLogger(__name__)
+
+TICKETS_DIR = "data/tickets"
+TICKET_PREFIX = "ticket-for-"
+
+OPEN = "open"
+CLOSING = "closing"
+ARCHIVED = "archived"
+
+# Archived tickets are forgotten after this many seconds
+ARCHIVE_RETENTION = 30 * 86400
+# Changes within this many seconds are written together
+SAVE_INTERVAL = 2.0
+
+class TicketRegistry:
+
+    '''
+    All tickets, saved to data/tickets/index.toml
+
+    Tickets are stored by channel id with guild, opener and state
+    (open, closing, archived). Live tickets are also indexed by
+    (guild, opener), so duplicate checks dont scan the channel list.
+    Guilds with tickets made before the registry are scanned once, on
+    first use after restart. Writes are coalesced and done off the event
+    loop, archived tickets are dropped after ARCHIVE_RETENTION.
+    '''
+
+    def __init__(self, path:str=os.path.join(TICKETS_DIR, "index.toml")):
+        self.path = path
+        self.channels = {}
+        self.by_opener = defaultdict(dict)
+        self.scanned = set()
+        self.saves = CoalescingQueue(
+            self._write,
+            workers=1,
+            interval=SAVE_INTERVAL,
+            name="ticket-index",
+        )
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = toml.load(f)
+        except FileNotFoundError:
+            return
+        except toml.TomlDecodeError as e:
+            logger.warning(f"Ticket index is broken, starting empty: {e}")
+            return
+        for channel, entry in data.get("channels", {}).items():
+            entry.setdefault("state", OPEN)
+            entry.setdefault("opened", 0)
+            self._index(int(channel), entry)
+        self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - ARCHIVE_RETENTION
+        expired = [
+            channel for channel, entry in self.channels.items()
+            if entry["state"] == ARCHIVED and entry.get("closed", entry["opened"]) < cutoff  # noqa: E501
+        ]
+        for channel in expired:
+            del self.channels[channel]
+
+    def _save(self):
+        self.saves.push("index")
+
+    async def _write(self, key, payload):
+        self._prune()
+        # Copy on the loop, entries keep changing while the thread writes
+        data = {"channels": {str(channel): dict(entry) for channel, entry in self.channels.items()}}  # noqa: E501
+        await asyncio.to_thread(self._dump, data)
+
+    def _dump(self, data:dict):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            toml.dump(data, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    async def flush(self):
+        '''Writes pending changes and stops the writer'''
+        await self.saves.join()
+        await self.saves.stop()
+
+    def _index(self, channel_id:int, entry:dict):
+        self.channels[channel_id] = entry
+        openers = self.by_opener[entry["guild"]]
+        if entry["state"] != ARCHIVED:
+            openers[entry["opener"]] = channel_id
+        elif openers.get(entry["opener"]) == channel_id:
+            del openers[entry["opener"]]
+
+    def __contains__(self, channel_id:int):
+        '''True for tickets that are still live'''
+        entry = self.channels.get(channel_id)
+        return entry is not None and entry["state"] != ARCHIVED
+
+    def get(self, channel_id:int) -> dict:
+        return self.channels.get(channel_id)
+
+    def find_open(self, guild, opener_id:int) -> int:
+        '''Channel id of live ticket of opener, or None'''
+        if guild.id not in self.scanned:
+            self.rebuild(guild)
+        return self.by_opener[guild.id].get(opener_id)
+
+    def count_open(self, guild_id:int) -> int:
+        return len(self.by_opener.get(guild_id, ()))
+
+    def add(self, channel_id:int, guild_id:int, opener_id:int):
+        self._index(channel_id, {
+            "guild": guild_id,
+            "opener": opener_id,
+            "state": OPEN,
+            "opened": int(time.time()),
+        })
+        self._save()
+
+    def set_state(self, channel_id:int, state:str):
+        entry = self.channels.get(channel_id)
+        if entry is None or entry["state"] == state:
+            return
+        entry["state"] = state
+        if state == ARCHIVED:
+            entry["closed"] = int(time.time())
+        self._index(channel_id, entry)
+        self._save()
+
+    def remove(self, channel_id:int):
+        self.set_state(channel_id, ARCHIVED)
+
+    def rebuild(self, guild):
+        '''
+        Syncs the registry with the ticket channels of guild
+
+        Registers channels the registry misses and archives tickets whose
+        channel was deleted while the bot was offline, so they dont count
+        against the open ticket cap.
+        '''
+        self.scanned.add(guild.id)
+        gone = [
+            channel_id for channel_id, entry in self.channels.items()
+            if entry["guild"] == guild.id and entry["state"] != ARCHIVED
+            and guild.get_channel(channel_id) is None
+        ]
+        for channel_id in gone:
+            entry = self.channels[channel_id]
+            entry["state"] = ARCHIVED
+            entry["closed"] = int(time.time())
+            self._index(channel_id, entry)
+        found = 0
+        for channel in guild.text_channels:
+            if channel.id in self.channels or not channel.name.startswith(TICKET_PREFIX):  # noqa: E501
+                continue
+            openers = [
+                target for target in channel.overwrites
+                if isinstance(target, discord.Member) and target != guild.me
+            ]
+            if openers:
+                self._index(channel.id, {
+                    "guild": guild.id,
+                    "opener": openers[0].id,
+                    "state": OPEN,
+                    "opened": int(channel.created_at.timestamp()),
+                })
+                found += 1
+        if found or gone:
+            logger.info(f"Recovered {found} and archived {len(gone)} deleted tickets of guild {guild.id}")  # noqa: E501
+            self._save()
+
+tickets = TicketRegistry()
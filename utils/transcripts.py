@@ -0,0 +1,213 @@
+import asyncio
+import contextlib
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+
+import discord
+
+from utils.ticket_archive import archive, serialize
+from utils.tickets import TICKETS_DIR
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = ".cache"
+TRANSCRIPT_DIR = os.path.join(TICKETS_DIR, "transcripts")
+DATE_FORMAT = "%m/%d/%Y at %H:%M:%S"
+PAGE_SIZE = 100
+QUEUE_SIZE = 1000
+WRITE_BATCH = 200
+
+def render_line(record:dict) -> str:
+    created = datetime.fromisoformat(record["created_at"]).strftime(DATE_FORMAT)
+    line = f"{record['author']['name']} on {created}: {record['content']}"
+    if record["edited_at"]:
+        edited = datetime.fromisoformat(record["edited_at"]).strftime(DATE_FORMAT)
+        line += f" (Edited at {edited})"
+    return line + "\n"
+
+async def iter_history(channel, page_size:int=PAGE_SIZE, after:int=None):
+    '''Yields channel messages oldest first, one REST page at a time'''
+    after = discord.Object(after) if after else None
+    while True:
+        page = [
+            message async for message in channel.history(
+                limit=page_size,
+                after=after,
+                oldest_first=True,
+            )
+        ]
+        for message in page:
+            yield message
+        if len(page) < page_size:
+            return
+        after = page[-1]
+
+async def catch_up(channel) -> int:
+    '''
+    Logs messages the archive of channel missed
+
+    Messages sent while the bot was offline, or in tickets recovered by
+    the registry rebuild, are fetched after the newest logged message.
+    Returns how many were added.
+    '''
+    await archive.flush()
+    last = await asyncio.to_thread(archive.last_id, channel.id)
+    added = 0
+    try:
+        async for message in iter_history(channel, after=last):
+            archive.message(message)
+            added += 1
+    except discord.HTTPException as e:
+        logger.warning(f"Catching up archive of {channel.id} failed: {e}")
+    await archive.flush()
+    if added:
+        logger.info(f"Archived {added} missed messages of ticket {channel.id}")
+    return added
+
+async def iter_records(channel):
+    '''
+    Yields serialized messages of channel
+
+    Tickets recorded by the archive are read from disk after catching up
+    on missed messages, others fall back to fetching the history
+    '''
+    if archive.has(channel.id):
+        await catch_up(channel)
+        async for record in archive.stream(channel.id):
+            yield record
+        return
+    async for message in iter_history(channel):
+        yield serialize(message)
+
+class LineWriter:
+
+    '''
+    Writes lines to a file off the event loop
+
+    Lines go through a bounded asyncio queue and are written in batches
+    from a worker thread, so memory stays flat for any ticket length.
+    When writing fails, the error is raised from write() and on exit.
+    '''
+
+    def __init__(self, path:str, compress:bool=False):
+        self.path = path
+        self.compress = compress
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.handle = None
+        self.task = None
+
+    async def __aenter__(self):
+        opener = gzip.open if self.compress else open
+        self.handle = await asyncio.to_thread(opener, self.path, "wt", encoding="utf-8")  # noqa: E501
+        self.task = asyncio.create_task(self._drain())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self._put(None)
+            await self.task
+        finally:
+            await asyncio.to_thread(self.handle.close)
+
+    async def write(self, line:str):
+        await self._put(line)
+
+    async def _put(self, item):
+        '''Queues item, raises the writer's error instead of waiting on a dead writer'''  # noqa: E501
+        if self.task.done():
+            self.task.result()
+            raise RuntimeError(f"Writer of {self.path} already closed")
+        if not self.queue.full():
+            self.queue.put_nowait(item)
+            return
+        put = asyncio.create_task(self.queue.put(item))
+        await asyncio.wait({put, self.task}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            self.task.result()
+            raise RuntimeError(f"Writer of {self.path} stopped")
+
+    async def _drain(self):
+        done = False
+        while not done:
+            batch = [await self.queue.get()]
+            while len(batch) < WRITE_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch:
+                await asyncio.to_thread(self.handle.write, "".join(batch))
+
+class TranscriptService:
+
+    '''
+    Markdown transcripts of ticket channels
+
+    Requests for a channel that is already being exported wait for the
+    same task instead of starting another one. The file is removed once
+    the last requester is done with it.
+    '''
+
+    def __init__(self, cache_dir:str=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.inflight = {}
+
+    async def build(self, channel, requested_by:str, compress:bool=False) -> str:
+        suffix = ".md.gz" if compress else ".md"
+        path = os.path.join(self.cache_dir, f"transcript-{channel.id}{suffix}")
+        try:
+            async with LineWriter(path, compress) as writer:
+                await writer.write(f"# Transcript of {channel.name}:\n\n")
+                async for record in iter_records(channel):
+                    await writer.write(render_line(record))
+                generated = datetime.now().strftime(DATE_FORMAT)
+                await writer.write(
+                    f"\n*Generated at {generated} by {requested_by}*\n*Date Formatting: MM/DD/YY*\n*Time Zone: UTC*",  # noqa: E501
+                )
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            raise
+        return path
+
+    async def finalize(self, channel, closed_by:str) -> str:
+        '''Compacts the archive of a closing ticket into the final transcript'''  # noqa: E501
+        await archive.flush()
+        base = os.path.join(TRANSCRIPT_DIR, str(channel.id))
+        async with LineWriter(base + ".jsonl") as data, LineWriter(base + ".md") as page:  # noqa: E501
+            await page.write(f"# Transcript of {channel.name}:\n\n")
+            async for record in archive.stream(channel.id):
+                await data.write(json.dumps(record) + "\n")
+                await page.write(render_line(record))
+            closed = datetime.now().strftime(DATE_FORMAT)
+            await page.write(f"\n*Closed at {closed} by {closed_by}*\n*Time Zone: UTC*")  # noqa: E501
+        archive.discard(channel.id)
+        return base + ".md"
+
+    @contextlib.asynccontextmanager
+    async def shared(self, key, build):
+        '''Runs build() once per key, all requesters get the same file'''
+        entry = self.inflight.get(key)
+        if entry is None:
+            entry = self.inflight[key] = {"task": asyncio.create_task(build()), "users": 0}  # noqa: E501
+        entry["users"] += 1
+        try:
+            yield await asyncio.shield(entry["task"])
+        finally:
+            entry["users"] -= 1
+            if not entry["users"]:
+                self.inflight.pop(key, None)
+                with contextlib.suppress(Exception):
+                    os.remove(entry["task"].result())
+
+    def transcript(self, channel, requested_by:str, compress:bool=False):
+        return self.shared(
+            (channel.id, "md"),
+            lambda: self.build(channel, requested_by, compress),
+        )
+
+transcripts = TranscriptService()
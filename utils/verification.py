@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+import logging
+import time
+
+import discord
+
+from utils.metrics import metrics
+from utils.workqueue import CoalescingQueue
+
+logger = logging.getLogger(__name__)
+
+# Spacing of role grants inside one guild, the route is limited per guild
+GRANT_INTERVAL = 0.25
+GRANT_WORKERS = 2
+# Queues of guilds without clicks for this long are stopped and dropped
+QUEUE_IDLE = 600
+REAP_INTERVAL = 60
+
+class RoleGrants:
+
+    '''
+    Verification role grants, queued per guild
+
+    Clicks are acknowledged right away and the grant is pushed to the
+    guild queue keyed by member, so repeated clicks while waiting are
+    one grant. Queues of guilds that went quiet are reaped, so their
+    workers dont stay around.
+    '''
+
+    def __init__(self):
+        self.queues = {}
+        self.last_push = {}
+        self.reaper = None
+        self.granted = metrics.counter("verify_grants_total", "Verification roles granted")  # noqa: E501
+        self.failed = metrics.counter("verify_grants_failed_total", "Verification grants that failed")  # noqa: E501
+        self.collapsed = metrics.counter("verify_clicks_collapsed_total", "Clicks merged into a waiting grant")  # noqa: E501
+        self.latency = metrics.histogram("verify_grant_latency_seconds", help="Time from click to role grant")  # noqa: E501
+        metrics.gauge("verify_grant_queue_depth", self.depth, "Grants waiting in all guilds")  # noqa: E501
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _queue(self, guild_id:int) -> CoalescingQueue:
+        if guild_id not in self.queues:
+            self.queues[guild_id] = CoalescingQueue(
+                self._grant,
+                workers=GRANT_WORKERS,
+                interval=GRANT_INTERVAL,
+                # Keep the first click time and the newest interaction
+                merge=lambda old, new: (old[0], new[1], new[2]),
+                name=f"verify-grants-{guild_id}",
+            )
+        return self.queues[guild_id]
+
+    def push(self, member:discord.Member, role:discord.Role, interaction:discord.Interaction=None) -> bool:  # noqa: E501
+        '''Queues grant, returns False when merged into a waiting one'''
+        if self.reaper is None:
+            self.reaper = asyncio.create_task(self._reap_loop())
+        self.last_push[member.guild.id] = time.monotonic()
+        queued = self._queue(member.guild.id).push(
+            member.id,
+            (time.monotonic(), role, interaction),
+        )
+        if not queued:
+            self.collapsed.inc()
+        return queued
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            cutoff = time.monotonic() - QUEUE_IDLE
+            idle = [
+                guild_id for guild_id, queue in self.queues.items()
+                if not len(queue) and self.last_push.get(guild_id, 0) < cutoff
+            ]
+            for guild_id in idle:
+                # New clicks get a fresh queue while this one shuts down
+                queue = self.queues.pop(guild_id)
+                self.last_push.pop(guild_id, None)
+                await queue.join()
+                await queue.stop()
+            if idle:
+                logger.debug(f"Reaped grant queues of {len(idle)} idle guilds")
+
+    async def _grant(self, member_id:int, payload):
+        clicked, role, interaction = payload
+        member = role.guild.get_member(member_id)
+        if member is None:
+            return
+        try:
+            if role not in member.roles:
+                await member.add_roles(role, reason="Verification")
+        except discord.HTTPException as e:
+            self.failed.inc()
+            logger.warning(f"Granting {role.id} to {member_id} failed: {e}")
+            text = "Verification failed: Insufficient Permissions"
+        else:
+            self.granted.inc()
+            self.latency.observe(time.monotonic() - clicked)
+            text = "Verified!"
+        if interaction is not None:
+            with contextlib.suppress(discord.HTTPException):
+                await interaction.edit_original_response(content=text)
+
+    async def stop(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+            self.reaper = None
+        for queue in self.queues.values():
+            await queue.stop()
+        self.queues.clear()
+        self.last_push.clear()
+
+role_grants = RoleGrants()
@@ -0,0 +1,87 @@
+import logging
+import os
+
+import toml
+
+logger = logging.getLogger(__name__)
+
+VERIFY_DIR = "data/verification"
+PANELS_FILE = os.path.join(VERIFY_DIR, "panels.toml")
+# Bump when the panel components change, older panels get re-attached
+VIEW_VERSION = 1
+
+class PanelIndex:
+
+    '''
+    Verify panels by message id
+
+    Replaces the "<channel>-verifybutton" guild config sections: one
+    file maps every panel message to its guild, channel, role and mode,
+    so startup needs no guild walk and a click resolves its role with a
+    single dict lookup. Emoji panels are also kept in `watched`, the
+    reaction listener drops everything else with one set lookup.
+    '''
+
+    def __init__(self, path:str=PANELS_FILE):
+        self.path = path
+        self.panels = {}
+        self.watched = set()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = toml.load(f)
+        except FileNotFoundError:
+            return
+        except toml.TomlDecodeError as e:
+            logger.error(f"Verify panel index is broken, starting empty: {e}")
+            return
+        for message_id, panel in data.items():
+            if not message_id.isdigit() or "role" not in panel:
+                logger.warning(f"Skipping broken verify panel {message_id}")
+                continue
+            panel.setdefault("version", 0)
+            self.panels[int(message_id)] = panel
+            if panel["mode"] == "emoji":
+                self.watched.add(int(message_id))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            toml.dump({str(mid): panel for mid, panel in self.panels.items()}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def __len__(self):
+        return len(self.panels)
+
+    def get(self, message_id:int) -> dict | None:
+        return self.panels.get(message_id)
+
+    def add(self, message_id:int, guild_id:int, channel_id:int, role_id:int, mode:str, **extra) -> dict:  # noqa: E501
+        panel = {
+            "guild": guild_id,
+            "channel": channel_id,
+            "role": role_id,
+            "mode": mode,
+            "version": VIEW_VERSION,
+            **extra,
+        }
+        self.panels[message_id] = panel
+        if mode == "emoji":
+            self.watched.add(message_id)
+        self.save()
+        return panel
+
+    def remove(self, message_id:int):
+        self.watched.discard(message_id)
+        if self.panels.pop(message_id, None) is not None:
+            self.save()
+
+    def mark_current(self, message_id:int):
+        panel = self.panels.get(message_id)
+        if panel is not None and panel["version"] != VIEW_VERSION:
+            panel["version"] = VIEW_VERSION
+            self.save()
+
+panels = PanelIndex()
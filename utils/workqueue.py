@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class CoalescingQueue:
+
+    '''
+    Queue of jobs keyed by id
+
+    Pushing a key that is already waiting only merges its payload, so
+    many updates for one member end up as one REST call. Jobs are
+    drained by a bounded number of workers, spaced at least `interval`
+    seconds apart to stay under the route rate limits.
+    '''
+
+    def __init__(
+        self,
+        handler,
+        workers:int=2,
+        interval:float=0.0,
+        merge=None,
+        name:str="queue",
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.interval = interval
+        self.merge = merge or (lambda old, new: new)
+        self.name = name
+        self._pending = {}
+        self._keys = None
+        self._tasks = []
+        self._throttle_lock = None
+        self._next_slot = 0.0
+        self.processed = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, key):
+        return key in self._pending
+
+    def _start(self):
+        self._keys = asyncio.Queue()
+        self._throttle_lock = asyncio.Lock()
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    def push(self, key, payload=None) -> bool:
+        '''Queues job, returns False when it was merged into a waiting one'''
+        if not self._tasks:
+            self._start()
+        if key in self._pending:
+            self._pending[key] = self.merge(self._pending[key], payload)
+            return False
+        self._pending[key] = payload
+        self._keys.put_nowait(key)
+        return True
+
+    async def _throttle(self):
+        if not self.interval:
+            return
+        async with self._throttle_lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _worker(self):
+        while True:
+            key = await self._keys.get()
+            try:
+                payload = self._pending.pop(key)
+                await self._throttle()
+                await self.handler(key, payload)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"{self.name}: job {key} failed: {e}")
+            finally:
+                self._keys.task_done()
+
+    async def join(self):
+        if self._keys is not None:
+            await self._keys.join()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []